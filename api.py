@@ -1,66 +1,289 @@
-import os
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import uvicorn
-from main import detect_bugs
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional
+from main import (detect_bugs_async, detect_bugs_batch, detect_bugs_incremental, enable_batching, stream_detect_bugs,
+                  cache_stats)
+from jobs import JobStore, WorkerPool
+from singleflight import SingleFlight
+import metrics
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Verify the API key is available
-api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables")
+# OPENAI_API_KEY is checked when the first LLM call is made (see main._chains)
+
+# Analyses in progress for /detect-bugs; identical requests wait for the same one
+inflight_analyses = SingleFlight("request")
+
+# Durable job queue behind /jobs and the workers that process it
+job_store = None
+job_workers = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global job_store, job_workers
+    # Chunks of concurrent requests share LLM calls (FOAMAI_BATCH_WINDOW_MS=0 turns this off)
+    enable_batching()
+    job_store = JobStore.from_env()
+    job_workers = WorkerPool.from_env(job_store)
+    # Jobs interrupted by the last shutdown resume from their saved progress
+    job_workers.start()
+    yield
+    await job_workers.stop()
 
 # Create FastAPI app
 app = FastAPI(
     title="Foamai - Python Bug Detection API",
     description="API for detecting and fixing bugs in Python code",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (/jobs/{job_id}), not the raw path, to keep the number of series bounded
+        route = request.scope.get("route")
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            path=route.path if route is not None else "unmatched",
+            status=status
+        )
+
 # Define request and response models
 class CodeRequest(BaseModel):
     code: str
     strip_comments: Optional[bool] = True  # Make it optional with a default value
+    max_concurrency: Optional[int] = Field(None, gt=0)  # Defaults to FOAMAI_MAX_CONCURRENCY
+    use_cache: Optional[bool] = True  # Reuse results for code that was analyzed before
+    static_analysis: Optional[Literal["off", "prefilter", "trust"]] = None  # Defaults to FOAMAI_STATIC_ANALYSIS
+    mode: Optional[Literal["two_stage", "fused"]] = None  # Defaults to FOAMAI_MODE
+    document_id: Optional[str] = None  # /detect-bugs only: re-analyze just the functions changed since the last request with this ID
+    # /detect-bugs and /detect-bugs/stream: seconds before unfinished work is cancelled
+    timeout: Optional[float] = Field(None, gt=0, allow_inf_nan=False)
     
 class BugInfo(BaseModel):
     type: str
     location: str
     description: str
+    id: Optional[str] = None  # Referenced by FixInfo.bug_id
     
 class FixInfo(BaseModel):
     bug: str
     suggestion: str
+    bug_id: Optional[str] = None  # id of the BugInfo this fix is for
     
 class BugResponse(BaseModel):
     bugs: List[BugInfo]
     fixes: List[FixInfo]
+    units: Optional[Dict[str, int]] = None  # With document_id: units in the code, and how many were analyzed or reused
+    incomplete: Optional[bool] = None  # True if the timeout passed first; unfinished chunks and fixes have "Incomplete" entries
+
+class BatchRequest(BaseModel):
+    items: List[CodeRequest]
+    max_concurrency: Optional[int] = Field(None, gt=0)  # Shared by all items; defaults to FOAMAI_MAX_CONCURRENCY
+
+class BatchItemResponse(BaseModel):
+    bugs: Optional[List[BugInfo]] = None
+    fixes: Optional[List[FixInfo]] = None
+    error: Optional[str] = None  # Set instead of bugs and fixes when this item failed
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResponse]
+    llm_calls: int  # Chain calls the items needed
+    unique_llm_calls: int  # Chain calls actually made after deduplication
+
+class JobProgress(BaseModel):
+    stage: Optional[str] = None  # "detect" or "fix" once the job has started
+    done: int  # Chunks (or fix batches) finished in the current stage
+    total: int
+
+class JobResponse(BaseModel):
+    id: str
+    status: str  # "queued", "running", "done" or "failed"
+    progress: Optional[JobProgress] = None
+    result: Optional[BugResponse] = None  # Set once the job is done
+    error: Optional[str] = None  # Set if the job failed
+
+def _pipeline_options(request: CodeRequest) -> Dict[str, Any]:
+    """Translate a CodeRequest into keyword arguments for the pipeline in main.py."""
+    return {
+        # Handle the case where strip_comments might be None
+        "strip_comments": request.strip_comments if request.strip_comments is not None else True,
+        "max_concurrency": request.max_concurrency,
+        "use_cache": request.use_cache is not False,
+        "static_analysis": request.static_analysis,
+        "mode": request.mode,
+    }
+
+# Seconds between checks whether the client of /detect-bugs is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+def _deadline(request: CodeRequest, header_timeout: Optional[float]) -> Optional[float]:
+    """The time.monotonic() deadline set by the request's timeout or X-Request-Timeout header, whichever is sooner."""
+    timeouts = [timeout for timeout in (request.timeout, header_timeout) if timeout is not None]
+    return time.monotonic() + min(timeouts) if timeouts else None
+
+async def _unless_disconnected(http_request: Request, analysis):
+    """Await the analysis, cancelling it if the client disconnects first."""
+    task = asyncio.ensure_future(analysis)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                # 499: the client closed the request; nobody will read the response
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        task.cancel()
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Foamai - Python Bug Detection API"}
 
+@app.get("/cache/stats")
+async def api_cache_stats():
+    stats = cache_stats()
+    if stats is None:
+        return {"enabled": False}
+    return {"enabled": True, **stats}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def api_metrics():
+    """Counters and histograms for every pipeline stage, in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/detect-bugs", response_model=BugResponse)
-async def api_detect_bugs(request: CodeRequest):
+async def api_detect_bugs(request: CodeRequest, http_request: Request,
+                          x_request_timeout: Optional[float] = Header(None, gt=0, allow_inf_nan=False)):
+    deadline = _deadline(request, x_request_timeout)
     try:
-        # Handle the case where strip_comments might be None
-        strip_comments = request.strip_comments if request.strip_comments is not None else True
-        
-        # Call the bug detection function from main.py with the strip_comments parameter
-        result = detect_bugs(request.code, strip_comments=strip_comments)
+        # Await the async pipeline from main.py so chunks are analyzed concurrently
+        if request.document_id:
+            analysis = detect_bugs_incremental(request.code, request.document_id, deadline=deadline,
+                                               **_pipeline_options(request))
+        elif deadline is not None:
+            # A shared analysis would run with the first request's deadline, not this one's
+            analysis = detect_bugs_async(request.code, deadline=deadline, **_pipeline_options(request))
+        else:
+            options = _pipeline_options(request)
+            key = json.dumps([request.code, options], sort_keys=True)
+            analysis = inflight_analyses.do(key, lambda: detect_bugs_async(request.code, **options))
+        result = await _unless_disconnected(http_request, analysis)
         
         # Convert the result to the expected response format
-        response = BugResponse(
-            bugs=[BugInfo(**bug) for bug in result["bugs"]],
-            fixes=[FixInfo(**fix) for fix in result["fixes"]]
-        )
+        with metrics.STAGE_DURATION.time(stage="response"):
+            response = BugResponse(
+                bugs=[BugInfo(**bug) for bug in result["bugs"]],
+                fixes=[FixInfo(**fix) for fix in result["fixes"]],
+                units=result.get("units"),
+                incomplete=result.get("incomplete")
+            )
         return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error detecting bugs: {str(e)}")
+
+@app.post("/detect-bugs/stream")
+async def api_detect_bugs_stream(request: CodeRequest, http_request: Request,
+                                 x_request_timeout: Optional[float] = Header(None, gt=0, allow_inf_nan=False)):
+    """
+    Stream results as newline-delimited JSON while the analysis runs.
+
+    Each line is one event from main.stream_detect_bugs: "start", then one
+    "bugs" event per chunk and "fixes" events as they become ready, and
+    finally "summary" (or "error"). If the client disconnects, the
+    outstanding chunk work is cancelled. So is the work still running when
+    the request's timeout passes, and the summary then says "incomplete".
+    """
+    events = stream_detect_bugs(request.code, deadline=_deadline(request, x_request_timeout),
+                                **_pipeline_options(request))
+
+    async def ndjson():
+        try:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    break
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": f"Error detecting bugs: {str(e)}"}) + "\n"
+        finally:
+            # Cancels the chunk and fix tasks that are still running
+            await events.aclose()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.post("/detect-bugs/batch", response_model=BatchResponse)
+async def api_detect_bugs_batch(request: BatchRequest):
+    """
+    Analyze many snippets in one request.
+
+    Identical chunks across the whole batch are analyzed once. Results come
+    back in the order of the items; an item that fails carries an error
+    instead of failing the batch.
+    """
+    try:
+        batch = await detect_bugs_batch(
+            [{"code": item.code, **_pipeline_options(item)} for item in request.items],
+            max_concurrency=request.max_concurrency
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error detecting bugs: {str(e)}")
 
+    results = []
+    for result in batch["results"]:
+        if "error" in result:
+            results.append(BatchItemResponse(error=result["error"]))
+            continue
+        try:
+            results.append(BatchItemResponse(
+                bugs=[BugInfo(**bug) for bug in result["bugs"]],
+                fixes=[FixInfo(**fix) for fix in result["fixes"]]
+            ))
+        except Exception as e:
+            results.append(BatchItemResponse(error=f"Error detecting bugs: {str(e)}"))
+    return BatchResponse(
+        results=results,
+        llm_calls=batch["llm_calls"],
+        unique_llm_calls=batch["unique_llm_calls"]
+    )
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def api_submit_job(request: CodeRequest):
+    """Queue an analysis and return its job ID right away; poll GET /jobs/{id} for the result."""
+    job_id = await asyncio.to_thread(job_store.submit, {"code": request.code, **_pipeline_options(request)})
+    job_workers.notify()
+    return JobResponse(id=job_id, status="queued")
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def api_get_job(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return JobResponse(
+        id=job["id"],
+        status=job["status"],
+        progress=JobProgress(**job["progress"]),
+        result=job["result"],
+        error=job["error"]
+    )
+
 # Run the API server when the script is executed directly
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,327 @@
+"""
+Chat model backends.
+
+A backend is a named factory that returns a LangChain chat model. main.py
+builds its chains around the backend named by FOAMAI_BACKEND (default
+"openai"); new backends are added with register_backend.
+
+The "fake" backend runs entirely offline. It answers main.py's prompts
+with canned or rule-based JSON and simulates a configurable latency,
+token throughput and failure rate, so the pipeline's own overhead and
+concurrency behavior can be measured without network access.
+
+With FOAMAI_CASSETTE set, any backend's completions can be recorded to a
+file and replayed later without it (see cassette.py and CassetteChatModel).
+"""
+import asyncio
+import atexit
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+
+from cassette import CassetteMiss, prompt_key
+from json_extract import ExtractionError, extract_json_array
+from static_analysis import analyze_code
+
+DEFAULT_BACKEND = "openai"
+
+BACKENDS = {}
+
+def register_backend(name):
+    """Decorator registering factory(model_name, temperature) as backend name."""
+    def register(factory):
+        BACKENDS[name] = factory
+        return factory
+    return register
+
+def create_llm(name=None, model_name="gpt-3.5-turbo", temperature=0.3):
+    """
+    Create the chat model for a backend.
+
+    Args:
+        name (str): Backend name (defaults to FOAMAI_BACKEND, then "openai")
+        model_name (str): Model to request from the backend
+        temperature (float): Sampling temperature
+
+    Returns:
+        BaseChatModel: The chat model
+    """
+    cassette_path = os.environ.get("FOAMAI_CASSETTE")
+    mode = os.environ.get("FOAMAI_CASSETTE_MODE", "replay")
+    if cassette_path and mode == "replay":
+        # Replaying needs neither the backend nor its API key
+        from cassette import Cassette
+        return CassetteChatModel(cassette=Cassette(cassette_path))
+    name = name or os.environ.get("FOAMAI_BACKEND", DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name} (available: {', '.join(sorted(BACKENDS))})")
+    llm = BACKENDS[name](model_name, temperature)
+    if cassette_path:
+        from cassette import CASSETTE_MODES, Cassette
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode} (available: {', '.join(CASSETTE_MODES)})")
+        cassette = Cassette(cassette_path)
+        atexit.register(cassette.compact)
+        llm = CassetteChatModel(cassette=cassette, inner=llm)
+    return llm
+
+@register_backend("openai")
+def _openai_backend(model_name, temperature):
+    # Verify the API key is available
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    # langchain_openai is slow to import, so only load it when this backend is used
+    from langchain_openai import ChatOpenAI
+    # Answers are streamed (see main._astream_answer); stream_usage keeps token usage reported.
+    # Retries are left to ratelimit.py, which needs to see throttling to adapt to it
+    return ChatOpenAI(model_name=model_name, temperature=temperature, stream_usage=True, max_retries=0)
+
+@register_backend("fake")
+def _fake_backend(model_name, temperature):
+    return FakeChatModel.from_env()
+
+def estimate_tokens(text):
+    """Rough token count (4 characters per token) used for fake usage accounting."""
+    return max(1, len(text) // 4)
+
+# A snippet of main.py's batched prompts
+_SNIPPET = re.compile(r'<snippet id="([^"]+)">\n(.*?)\n</snippet>', re.DOTALL)
+
+def _static_answer(code, with_fixes):
+    """The static analyzer's findings as the bug items a detection (or fused) prompt asks for."""
+    answer = []
+    for finding in analyze_code(code).findings:
+        bug = {"type": finding.type, "location": f"line {finding.line}", "description": finding.description}
+        if with_fixes:
+            bug["fix"] = finding.suggestion
+        answer.append(bug)
+    return answer
+
+def _text_between(text, prefix, suffix):
+    start = text.find(prefix)
+    end = text.rfind(suffix)
+    if start == -1 or end == -1:
+        return None
+    return text[start + len(prefix):end]
+
+class FakeBackendError(RuntimeError):
+    """A failure injected by FakeChatModel."""
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline chat model that answers main.py's detect, fix, fused, repair and batched prompts.
+
+    Each call sleeps for a fixed latency plus the time it would take to
+    stream the completion at tokens_per_second, then either fails (with
+    probability failure_rate) or returns the canned response for the prompt's
+    stage. Without a canned response, detection answers (per snippet, for
+    batched prompts) come from the static analyzer, fixes from the bugs in the fix prompt and repairs from the
+    locally extracted array of the answer to repair. Calls and estimated
+    token usage are counted in stats.
+
+    Args:
+        latency (float): Fixed seconds per call (connection and time to first token)
+        tokens_per_second (float): Completion streaming rate
+        failure_rate (float): Probability that a call raises FakeBackendError
+        seed (int): Seed for the failure draws, for reproducible runs
+        responses (dict): Canned completions by stage ("detect", "fix", "fused", "repair",
+            "batch_detect", "batch_fused")
+    """
+
+    latency: float = 0.2
+    tokens_per_second: float = 50.0
+    failure_rate: float = 0.0
+    seed: Optional[int] = None
+    responses: Dict[str, str] = Field(default_factory=dict)
+    stats: Dict[str, Any] = Field(
+        default_factory=lambda: {"calls": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    )
+    _random: Any = PrivateAttr(default=None)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a fake model configured by environment variables.
+
+        FOAMAI_FAKE_LATENCY, FOAMAI_FAKE_TOKENS_PER_SECOND, FOAMAI_FAKE_FAILURE_RATE
+        and FOAMAI_FAKE_SEED set the fields of the same name. FOAMAI_FAKE_RESPONSES
+        names a JSON file with canned completions by stage.
+        """
+        responses = {}
+        if os.environ.get("FOAMAI_FAKE_RESPONSES"):
+            with open(os.environ["FOAMAI_FAKE_RESPONSES"], "r") as f:
+                responses = json.load(f)
+        seed = os.environ.get("FOAMAI_FAKE_SEED")
+        return cls(
+            latency=float(os.environ.get("FOAMAI_FAKE_LATENCY", "0.2")),
+            tokens_per_second=float(os.environ.get("FOAMAI_FAKE_TOKENS_PER_SECOND", "50")),
+            failure_rate=float(os.environ.get("FOAMAI_FAKE_FAILURE_RATE", "0")),
+            seed=int(seed) if seed else None,
+            responses=responses
+        )
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    @staticmethod
+    def stage(prompt):
+        """Tell which of main.py's prompts this is from the output format it asks for."""
+        if prompt.startswith("This answer was supposed to be a JSON array"):
+            return "repair"
+        if '"snippet"' in prompt:
+            return "batch_fused" if '"fix"' in prompt else "batch_detect"
+        if '"bug_id"' in prompt:
+            return "fix"
+        if '"fix"' in prompt:
+            return "fused"
+        return "detect"
+
+    def respond(self, prompt):
+        """Return the completion for a rendered prompt."""
+        stage = self.stage(prompt)
+        if stage in self.responses:
+            return self.responses[stage]
+
+        if stage == "repair":
+            try:
+                items, _ = extract_json_array(_text_between(prompt, "could not be parsed:\n\n", "\n\nRewrite it as") or "")
+            except ExtractionError:
+                items = []
+            return json.dumps(items)
+
+        if stage == "fix":
+            bugs = json.loads(_text_between(prompt, "each identified by an \"id\":\n\n", "\n\nSuggest a fix"))
+            return json.dumps([
+                {"bug_id": bug["id"], "bug": bug["description"], "suggestion": f"Fix the {bug['type'].lower()}."}
+                for bug in bugs
+            ])
+
+        if stage in ("batch_detect", "batch_fused"):
+            answer = []
+            for snippet, code in _SNIPPET.findall(prompt):
+                answer.extend(dict(bug, snippet=snippet) for bug in _static_answer(code, stage == "batch_fused"))
+            return json.dumps(answer, indent=2)
+
+        code = _text_between(prompt, ":\n\n", "\n\nIdentify bugs such as")
+        return json.dumps(_static_answer(code or "", stage == "fused"), indent=2)
+
+    def _call(self, messages):
+        """Return (result or exception, delay) for one call and record it in stats."""
+        prompt = "\n".join(str(message.content) for message in messages)
+        prompt_tokens = estimate_tokens(prompt)
+        self.stats["calls"] += 1
+        self.stats["prompt_tokens"] += prompt_tokens
+        if self._random is None:
+            self._random = random.Random(self.seed)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.stats["failures"] += 1
+            return FakeBackendError("Simulated backend failure"), self.latency
+
+        completion = self.respond(prompt)
+        completion_tokens = estimate_tokens(completion)
+        self.stats["completion_tokens"] += completion_tokens
+        message = AIMessage(
+            content=completion,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+        delay = self.latency + completion_tokens / self.tokens_per_second
+        return ChatResult(generations=[ChatGeneration(message=message)]), delay
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        result, delay = self._call(messages)
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        result, delay = self._call(messages)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+class SyncFakeChatModel(FakeChatModel):
+    """FakeChatModel without a native async path, like a blocking-only backend."""
+
+    _agenerate = BaseChatModel._agenerate
+
+    @property
+    def _llm_type(self):
+        return "fake-sync"
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Chat model that records another model's completions, or replays recorded ones.
+
+    Args:
+        cassette (Cassette): Where completions are kept
+        inner (BaseChatModel): The model to record; None to replay
+    """
+
+    cassette: Any
+    inner: Optional[Any] = None
+
+    @property
+    def _llm_type(self):
+        return "cassette"
+
+    def _replay(self, key):
+        completion = self.cassette.get(key)
+        if completion is None:
+            raise CassetteMiss(
+                f"No completion recorded for this prompt in {self.cassette.path}; "
+                "record it with FOAMAI_CASSETTE_MODE=record"
+            )
+        return completion
+
+    def _result(self, key, message):
+        if self.inner is None:
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._replay(key)))])
+        self.cassette.record(key, str(message.content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        key = prompt_key(messages)
+        return self._result(key, self.inner.invoke(messages, stop=stop) if self.inner is not None else None)
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        key = prompt_key(messages)
+        return self._result(key, await self.inner.ainvoke(messages, stop=stop) if self.inner is not None else None)
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        key = prompt_key(messages)
+        if self.inner is None:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=self._replay(key)))
+            return
+        # Record what was streamed, also when the caller stops reading early
+        # (GeneratorExit), but not an answer cut short by an error
+        text = []
+        try:
+            async for chunk in self.inner.astream(messages, stop=stop):
+                if not isinstance(chunk, AIMessageChunk):
+                    # A model without streaming of its own answers in one message
+                    chunk = AIMessageChunk(content=chunk.content, usage_metadata=chunk.usage_metadata,
+                                           response_metadata=chunk.response_metadata)
+                if isinstance(chunk.content, str):
+                    text.append(chunk.content)
+                yield ChatGenerationChunk(message=chunk)
+        except GeneratorExit:
+            if text:
+                self.cassette.record(key, "".join(text))
+            raise
+        if text:
+            self.cassette.record(key, "".join(text))
@@ -0,0 +1,95 @@
+"""
+Micro-batching of concurrent calls.
+
+Calls submitted within a short window of each other are collected and
+handed to one run_batch call, which answers all of them at once. Under
+load, this trades a few milliseconds of queueing for fewer round trips. A
+batch is sent early once it has max_size items or would exceed max_chars,
+so it never waits longer than the window and never grows beyond what a
+single prompt should carry. A batch whose callers have all given up is
+cancelled.
+"""
+import asyncio
+
+class MicroBatcher:
+    """
+    Collect submitted items into batches per key.
+
+    Args:
+        run_batch (callable): Coroutine function run_batch(key, items) returning one
+            result per item; a result that is an exception fails only its item
+        window (float): Seconds the first item of a batch waits for others
+        max_size (int): Most items in one batch
+        max_chars (int): Most characters (as measured by size) in one batch
+        size (callable): Size of an item, for max_chars
+    """
+
+    def __init__(self, run_batch, window=0.01, max_size=8, max_chars=4000, size=len):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_size = max_size
+        self.max_chars = max_chars
+        self.size = size
+        self._pending = {}  # (loop, key) -> [(item, future)], the batch being collected
+        self._timers = {}
+        self._running = set()
+
+    async def submit(self, key, item):
+        """Add an item to the next batch for key and wait for its result."""
+        loop = asyncio.get_running_loop()
+        # Batches never mix event loops
+        slot = (loop, key)
+        chars = self.size(item)
+        pending = self._pending.get(slot, [])
+        if pending and sum(self.size(queued) for queued, _ in pending) + chars > self.max_chars:
+            self._flush(slot)
+        future = loop.create_future()
+        pending = self._pending.setdefault(slot, [])
+        pending.append((item, future))
+        if len(pending) >= self.max_size or chars >= self.max_chars:
+            self._flush(slot)
+        elif len(pending) == 1:
+            self._timers[slot] = loop.call_later(self.window, self._flush, slot)
+        return await future
+
+    def _flush(self, slot):
+        timer = self._timers.pop(slot, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(slot, None)
+        if batch:
+            task = slot[0].create_task(self._run(slot[1], batch))
+            # Keep a reference until it is done so the task is not garbage collected
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, key, batch):
+        # Items whose caller gave up are left out
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        call = asyncio.ensure_future(self.run_batch(key, [item for item, _ in batch]))
+
+        def abandon(_):
+            # Once every caller has given up (e.g. its deadline passed), nobody needs the answer
+            if all(future.done() for _, future in batch):
+                call.cancel()
+
+        for _, future in batch:
+            future.add_done_callback(abandon)
+        try:
+            results = await call
+        except Exception as e:
+            results = [e] * len(batch)
+        except BaseException:
+            # The batch itself was cancelled, so are its callers
+            for _, future in batch:
+                future.cancel()
+            raise
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
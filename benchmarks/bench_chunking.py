@@ -0,0 +1,85 @@
+"""
+Benchmark: AST-aware chunking vs. the original character-based chunking.
+
+Compares the number of chunks (= detect_chain calls) and the total prompt
+size sent to the LLM for the files in samples/ and a few large real-world
+modules from the standard library, with both chunkers given the same
+character budget. No LLM calls are made.
+
+Usage:
+    python benchmarks/bench_chunking.py [--max-length N] [--json]
+"""
+import argparse
+import inspect
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chunking import DEFAULT_MAX_LENGTH, chunk_code, chunk_code_by_length
+from main import detect_prompt
+
+# Large modules that ship with every Python installation
+REAL_WORLD_MODULES = ["argparse", "typing", "tarfile", "asyncio.base_events", "email._header_value_parser"]
+
+def load_sources():
+    """Return a list of (name, source) pairs to benchmark."""
+    sources = []
+    samples_dir = os.path.join(ROOT, "samples")
+    for name in sorted(os.listdir(samples_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(samples_dir, name), "r") as f:
+                sources.append((f"samples/{name}", f.read()))
+    for module_name in REAL_WORLD_MODULES:
+        module = __import__(module_name, fromlist=["_"])
+        sources.append((module_name, inspect.getsource(module)))
+    return sources
+
+def measure(chunks):
+    """Return (chunk count, total prompt characters) for a list of chunks."""
+    prompt_chars = sum(len(detect_prompt.format(code=chunk.text)) for chunk in chunks)
+    return len(chunks), prompt_chars
+
+def run(max_length):
+    results = []
+    for name, source in load_sources():
+        legacy_chunks, legacy_chars = measure(chunk_code_by_length(source, max_length))
+        ast_chunks, ast_chars = measure(chunk_code(source, max_length))
+        results.append({
+            "source": name,
+            "source_chars": len(source),
+            "legacy_chunks": legacy_chunks,
+            "legacy_prompt_chars": legacy_chars,
+            "ast_chunks": ast_chunks,
+            "ast_prompt_chars": ast_chars,
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunking strategies")
+    parser.add_argument("--max-length", type=int, default=DEFAULT_MAX_LENGTH, help="Character budget per chunk for both chunkers")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON instead of a table")
+    args = parser.parse_args()
+
+    results = run(args.max_length)
+
+    if args.json:
+        print(json.dumps({"max_length": args.max_length, "results": results}, indent=2))
+        sys.exit(0)
+
+    print(f"Legacy chunker: chunk_code_by_length(max_length={args.max_length})")
+    print(f"AST chunker:    chunk_code(max_length={args.max_length})")
+    print()
+    header = f"{'source':<40} {'chars':>8} {'chunks (old/new)':>18} {'prompt chars (old/new)':>26} {'change':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        change = row["ast_prompt_chars"] / row["legacy_prompt_chars"] - 1
+        print(
+            f"{row['source']:<40} {row['source_chars']:>8} "
+            f"{row['legacy_chunks']:>8} / {row['ast_chunks']:<7} "
+            f"{row['legacy_prompt_chars']:>12} / {row['ast_prompt_chars']:<11} "
+            f"{change:>+7.0%}"
+        )
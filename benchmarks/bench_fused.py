@@ -0,0 +1,168 @@
+"""
+Benchmark: fused detect+fix mode vs. the two-stage pipeline.
+
+Runs every bundled sample (samples/ and the inline samples in
+api_test_samples.py) through detect_bugs_async in both modes. Reports
+latency, LLM calls and token usage per mode, and how closely the two
+modes agree on the bugs found and how many bugs get a fix. Static
+pre-analysis and the result cache are disabled so every chunk reaches
+the model.
+
+Timing, calls and tokens come from the fake backend in backends.py. Its
+answers come from the static analyzer in both modes, so they cannot tell
+the modes apart; agreement and fix coverage are only measured on answers
+recorded from a real model. Record them once, then replay them offline
+(the fake latency and token rate still apply):
+
+    python benchmarks/bench_fused.py --record fused.cassette.jsonl.gz --backend openai
+    python benchmarks/bench_fused.py --cassette fused.cassette.jsonl.gz
+
+Usage:
+    python benchmarks/bench_fused.py [--cassette PATH | --record PATH [--backend NAME]]
+                                     [--latency S] [--tokens-per-second N] [--json]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every call should reach the model
+os.environ["FOAMAI_CACHE"] = "0"
+
+import main
+from backends import FakeChatModel
+from cassette import Cassette, CassetteMiss
+from corpus import load_samples
+
+class RecordedChatModel(FakeChatModel):
+    """FakeChatModel whose completions are replayed from a cassette, for answers that differ by mode."""
+
+    cassette: Cassette
+
+    def respond(self, prompt):
+        # The prompt is the messages' text joined as in cassette.prompt_key
+        completion = self.cassette.get(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        if completion is None:
+            raise CassetteMiss(f"No completion recorded for this prompt in {self.cassette.path}; "
+                               "record it with --record")
+        return completion
+
+def bug_keys(result):
+    return {(bug["type"].lower(), bug["location"]) for bug in result["bugs"]}
+
+def fix_coverage(result):
+    """Fraction of bugs that have a fix linked to them."""
+    if not result["bugs"]:
+        return 1.0
+    fixed = {fix.get("bug_id") for fix in result["fixes"]}
+    return sum(1 for bug in result["bugs"] if bug["id"] in fixed) / len(result["bugs"])
+
+def create_model(cassette, latency, tokens_per_second):
+    if cassette is None:
+        return FakeChatModel(latency=latency, tokens_per_second=tokens_per_second)
+    return RecordedChatModel(cassette=cassette, latency=latency, tokens_per_second=tokens_per_second)
+
+async def run_mode(mode, samples, model):
+    main.use_llm(model)
+    results = {}
+    latencies = []
+    for name, code in samples:
+        start = time.perf_counter()
+        results[name] = await main.detect_bugs_async(code, static_analysis="off", mode=mode)
+        latencies.append(time.perf_counter() - start)
+    return results, {
+        "mode": mode,
+        "total_seconds": sum(latencies),
+        "mean_latency": statistics.mean(latencies),
+        "max_latency": max(latencies),
+        "llm_calls": model.stats["calls"],
+        "prompt_tokens": model.stats["prompt_tokens"],
+        "completion_tokens": model.stats["completion_tokens"],
+        "fix_coverage": statistics.mean(fix_coverage(result) for result in results.values()),
+    }
+
+def agreement(two_stage, fused):
+    """Mean Jaccard similarity of the (type, location) bug sets per sample."""
+    scores = []
+    for name in two_stage:
+        a, b = bug_keys(two_stage[name]), bug_keys(fused[name])
+        scores.append(len(a & b) / len(a | b) if a | b else 1.0)
+    return statistics.mean(scores)
+
+async def run(latency, tokens_per_second, cassette=None):
+    samples = load_samples()
+    two_stage_results, two_stage = await run_mode(
+        main.MODE_TWO_STAGE, samples, create_model(cassette, latency, tokens_per_second))
+    fused_results, fused = await run_mode(
+        main.MODE_FUSED, samples, create_model(cassette, latency, tokens_per_second))
+    if cassette is None:
+        # Both modes got the static analyzer's answers: nothing to compare
+        two_stage["fix_coverage"] = fused["fix_coverage"] = None
+    return {
+        "samples": len(samples),
+        "latency": latency,
+        "tokens_per_second": tokens_per_second,
+        "cassette": cassette.path if cassette is not None else None,
+        "modes": [two_stage, fused],
+        "bug_agreement": agreement(two_stage_results, fused_results) if cassette is not None else None,
+    }
+
+async def record(backend):
+    """Run both modes against a real backend; backends.create_llm saves every completion."""
+    from backends import create_llm
+    samples = load_samples()
+    for mode in (main.MODE_TWO_STAGE, main.MODE_FUSED):
+        main.use_llm(create_llm(backend, main.MODEL_NAME, main.TEMPERATURE), backend)
+        for name, code in samples:
+            await main.detect_bugs_async(code, static_analysis="off", mode=mode)
+    return len(samples)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fused and two-stage pipelines")
+    parser.add_argument("--cassette", help="Replay the model answers recorded in this cassette")
+    parser.add_argument("--record", metavar="PATH", help="Record the answers of --backend to this cassette and exit")
+    parser.add_argument("--backend", default="openai", help="With --record: backend to record (default: openai)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake latency per call in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Fake completion token rate")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON instead of a table")
+    args = parser.parse_args()
+
+    if args.record:
+        os.environ["FOAMAI_CASSETTE"] = args.record
+        os.environ["FOAMAI_CASSETTE_MODE"] = "record"
+        count = asyncio.run(record(args.backend))
+        print(f"Recorded both modes on {count} samples to {args.record}")
+        sys.exit(0)
+
+    cassette = Cassette(args.cassette) if args.cassette else None
+    report = asyncio.run(run(args.latency, args.tokens_per_second, cassette))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        sys.exit(0)
+
+    answers = f"answers from {args.cassette}" if cassette is not None else "static analyzer answers"
+    print(f"{report['samples']} samples, fake latency {args.latency}s/call, {args.tokens_per_second} tokens/s, "
+          f"{answers}")
+    print()
+    header = f"{'mode':<10} {'total s':>8} {'mean s':>8} {'max s':>8} {'calls':>6} {'prompt tok':>11} {'compl. tok':>11} {'fixed':>6}"
+    print(header)
+    print("-" * len(header))
+    for row in report["modes"]:
+        fixed = f"{row['fix_coverage']:>6.0%}" if row["fix_coverage"] is not None else f"{'n/a':>6}"
+        print(
+            f"{row['mode']:<10} {row['total_seconds']:>8.2f} {row['mean_latency']:>8.2f} {row['max_latency']:>8.2f} "
+            f"{row['llm_calls']:>6} {row['prompt_tokens']:>11} {row['completion_tokens']:>11} {fixed}"
+        )
+    print()
+    if report["bug_agreement"] is None:
+        print("Bug agreement: n/a (both modes answer from the static analyzer; replay a --cassette to measure it)")
+    else:
+        print(f"Bug agreement (mean Jaccard of type/location sets): {report['bug_agreement']:.0%}")
@@ -0,0 +1,138 @@
+"""
+Load test: concurrent /detect-bugs requests against the API.
+
+Sends the same number of requests at increasing client concurrency and
+reports throughput and latency per level. While the load runs, a probe
+requests GET / every 50 ms; its worst latency shows whether the event
+loop stays responsive. The fake backend from backends.py stands in for
+the LLM; --sync uses its blocking-only variant to exercise the thread
+pool fallback. --batch-window batches the chunks of concurrent requests
+(see main.enable_batching), as the API does on startup.
+
+Every request's code ends in an assignment of its own, so no two requests
+are identical. Otherwise concurrent requests would share one analysis
+(see api.py) and the throughput would measure coalescing rather than the
+pipeline. The LLM calls of each level are reported next to its
+throughput.
+
+Usage:
+    python benchmarks/bench_load.py [--requests N] [--concurrency 1,4,16] [--latency S] [--sync] [--batch-window MS] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every call should reach the fake model
+os.environ["FOAMAI_CACHE"] = "0"
+
+import httpx
+
+import api
+import main
+from backends import FakeChatModel, SyncFakeChatModel
+from corpus import load_samples
+
+PROBE_INTERVAL = 0.05
+
+async def probe(client, stop, latencies):
+    """Time GET / repeatedly until stop is set."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(PROBE_INTERVAL)
+
+async def run_level(client, model, samples, requests, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    calls_before = model.stats["calls"]
+
+    async def one(index):
+        # Unique per request and level (an assignment, since comments are stripped)
+        code = f"{samples[index % len(samples)][1]}\n_request = {concurrency * requests + index}\n"
+        async with slots:
+            start = time.perf_counter()
+            response = await client.post("/detect-bugs", json={
+                "code": code,
+                "static_analysis": "off",
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    probe_latencies = []
+    probe_task = asyncio.ensure_future(probe(client, stop, probe_latencies))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": elapsed,
+        "throughput": requests / elapsed,
+        "llm_calls": model.stats["calls"] - calls_before,
+        "p50_latency": statistics.median(latencies),
+        "p95_latency": latencies[max(0, int(len(latencies) * 0.95) - 1)],
+        "probe_max_latency": max(probe_latencies) if probe_latencies else 0.0,
+    }
+
+async def run(requests, levels, latency, sync, batch_window=0):
+    model_class = SyncFakeChatModel if sync else FakeChatModel
+    model = model_class(latency=latency, tokens_per_second=1000.0)
+    main.use_llm(model)
+    main.enable_batching(batch_window / 1000)
+    samples = load_samples()
+    transport = httpx.ASGITransport(app=api.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for concurrency in levels:
+            results.append(await run_level(client, model, samples, requests, concurrency))
+    return {
+        "backend": "sync" if sync else "async",
+        "latency": latency,
+        "sync_workers": main.SYNC_WORKERS,
+        "batch_window_ms": batch_window,
+        "llm_calls": model.stats["calls"],
+        "levels": results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API throughput under concurrent load")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated client concurrency levels")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake latency per call in seconds")
+    parser.add_argument("--sync", action="store_true", help="Use a blocking-only fake model")
+    parser.add_argument("--batch-window", type=float, default=0, help="Batching window in ms (0: no batching)")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON instead of a table")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    report = asyncio.run(run(args.requests, levels, args.latency, args.sync, args.batch_window))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        sys.exit(0)
+
+    print(f"{report['backend']} fake backend, {args.latency}s/call, {report['sync_workers']} sync workers, "
+          f"batch window {args.batch_window:g} ms, {report['llm_calls']} LLM calls")
+    print()
+    header = (f"{'clients':>7} {'seconds':>8} {'req/s':>7} {'LLM calls':>9} {'p50 s':>7} {'p95 s':>7} "
+              f"{'GET / max s':>12}")
+    print(header)
+    print("-" * len(header))
+    for row in report["levels"]:
+        print(
+            f"{row['concurrency']:>7} {row['seconds']:>8.2f} {row['throughput']:>7.2f} {row['llm_calls']:>9} "
+            f"{row['p50_latency']:>7.2f} {row['p95_latency']:>7.2f} {row['probe_max_latency']:>12.3f}"
+        )
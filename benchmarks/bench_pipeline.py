@@ -0,0 +1,195 @@
+"""
+Benchmark suite: the whole bug-detection pipeline, offline.
+
+Runs every input from corpus.py (the bundled samples and synthetic modules
+of 10-200 KB) through detect_bugs_async against the fake backend, with the
+result cache disabled. Reports per snippet and overall:
+
+- wall time, with p50/p95/p99 latency over all runs
+- LLM calls per snippet and prompt/completion tokens
+- chunks per KB of source
+
+Results are written as JSON (--output) together with the commit and the
+settings they were measured with. Pass an earlier result file to --compare
+to see how the summary changed between commits.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--repeat N] [--latency S] [--tokens-per-second N]
+        [--mode MODE] [--static-analysis MODE] [--output FILE] [--compare FILE] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every call should reach the fake model
+os.environ["FOAMAI_CACHE"] = "0"
+
+import main
+from backends import FakeChatModel
+from corpus import SYNTHETIC_SIZES_KB, load_corpus
+
+# Summary metrics shown by --compare: (key, label, True if lower is better)
+COMPARED = [
+    ("wall_seconds", "wall time (s)", True),
+    ("p50_latency", "p50 latency (s)", True),
+    ("p95_latency", "p95 latency (s)", True),
+    ("p99_latency", "p99 latency (s)", True),
+    ("llm_calls_per_snippet", "LLM calls / snippet", True),
+    ("prompt_tokens", "prompt tokens", True),
+    ("completion_tokens", "completion tokens", True),
+    ("chunks_per_kb", "chunks / KB", True),
+]
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def measure(name, code, fake, repeat, options):
+    before = dict(fake.stats)
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await main.detect_bugs_async(code, **options)
+        timings.append(time.perf_counter() - start)
+
+    kb = len(code.encode("utf-8")) / 1024
+    chunks = len(main._prepare_chunks(code))
+    return {
+        "name": name,
+        "kb": round(kb, 2),
+        "chunks": chunks,
+        "chunks_per_kb": chunks / kb,
+        "llm_calls": (fake.stats["calls"] - before["calls"]) / repeat,
+        "prompt_tokens": (fake.stats["prompt_tokens"] - before["prompt_tokens"]) / repeat,
+        "completion_tokens": (fake.stats["completion_tokens"] - before["completion_tokens"]) / repeat,
+        "bugs": len(result["bugs"]),
+        "fixes": len(result["fixes"]),
+        "seconds": timings,
+        "mean_seconds": statistics.mean(timings),
+    }
+
+async def run(repeat, latency, tokens_per_second, options, synthetic_sizes):
+    fake = FakeChatModel(latency=latency, tokens_per_second=tokens_per_second)
+    main.use_llm(fake)
+    snippets = [await measure(name, code, fake, repeat, options) for name, code in load_corpus(synthetic_sizes)]
+
+    latencies = [seconds for snippet in snippets for seconds in snippet["seconds"]]
+    total_kb = sum(snippet["kb"] for snippet in snippets)
+    summary = {
+        "snippets": len(snippets),
+        "runs": len(latencies),
+        "wall_seconds": sum(latencies),
+        "p50_latency": percentile(latencies, 50),
+        "p95_latency": percentile(latencies, 95),
+        "p99_latency": percentile(latencies, 99),
+        "llm_calls_per_snippet": sum(snippet["llm_calls"] for snippet in snippets) / len(snippets),
+        "prompt_tokens": sum(snippet["prompt_tokens"] for snippet in snippets),
+        "completion_tokens": sum(snippet["completion_tokens"] for snippet in snippets),
+        "chunks_per_kb": sum(snippet["chunks"] for snippet in snippets) / total_kb,
+    }
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "config": {
+                "repeat": repeat,
+                "latency": latency,
+                "tokens_per_second": tokens_per_second,
+                "synthetic_sizes_kb": synthetic_sizes,
+                "chunk_size": main.CHUNK_SIZE,
+                "max_concurrency": main.MAX_CONCURRENCY,
+                **{key: value for key, value in options.items() if value is not None},
+            },
+        },
+        "summary": summary,
+        "snippets": snippets,
+    }
+
+def print_report(report):
+    config = report["meta"]["config"]
+    print(f"commit {report['meta']['commit']}, fake latency {config['latency']}s/call, "
+          f"{config['tokens_per_second']} tokens/s, {config['repeat']} runs per snippet")
+    print()
+    header = f"{'snippet':<36} {'KB':>7} {'chunks':>7} {'/KB':>6} {'calls':>6} {'prompt tok':>11} {'compl. tok':>11} {'bugs':>5} {'mean s':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in report["snippets"]:
+        print(
+            f"{row['name']:<36} {row['kb']:>7.1f} {row['chunks']:>7} {row['chunks_per_kb']:>6.2f} {row['llm_calls']:>6.0f} "
+            f"{row['prompt_tokens']:>11.0f} {row['completion_tokens']:>11.0f} {row['bugs']:>5} {row['mean_seconds']:>7.2f}"
+        )
+    summary = report["summary"]
+    print()
+    print(f"{summary['snippets']} snippets, {summary['runs']} runs, {summary['wall_seconds']:.2f} s total")
+    print(f"latency p50 {summary['p50_latency']:.3f} s, p95 {summary['p95_latency']:.3f} s, p99 {summary['p99_latency']:.3f} s")
+    print(f"{summary['llm_calls_per_snippet']:.2f} LLM calls per snippet, {summary['chunks_per_kb']:.2f} chunks per KB")
+    print(f"{summary['prompt_tokens']:.0f} prompt tokens, {summary['completion_tokens']:.0f} completion tokens")
+
+def print_comparison(baseline, report):
+    print()
+    print(f"Compared with commit {baseline['meta'].get('commit')}:")
+    old_config = baseline["meta"].get("config", {})
+    new_config = report["meta"]["config"]
+    differences = sorted(key for key in set(old_config) | set(new_config) if old_config.get(key) != new_config.get(key))
+    if differences:
+        print(f"  (settings differ: {', '.join(differences)})")
+    for key, label, lower_is_better in COMPARED:
+        old = baseline["summary"].get(key)
+        new = report["summary"][key]
+        if not old:
+            continue
+        change = (new - old) / old
+        better = change < 0 if lower_is_better else change > 0
+        verdict = "" if abs(change) < 0.01 else ("better" if better else "worse")
+        print(f"  {label:<22} {old:>12.3f} -> {new:>12.3f}  {change:>+7.1%}  {verdict}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bug-detection pipeline offline")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per snippet")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake latency per call in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Fake completion token rate")
+    parser.add_argument("--mode", choices=main.PIPELINE_MODES, help="Pipeline mode (default: FOAMAI_MODE)")
+    parser.add_argument("--static-analysis", choices=main.STATIC_MODES, help="Static pre-analysis mode (default: FOAMAI_STATIC_ANALYSIS)")
+    parser.add_argument("--synthetic-sizes", default=",".join(str(size) for size in SYNTHETIC_SIZES_KB),
+                        help="Comma-separated sizes in KB of the synthetic modules (empty for none)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON instead of a table")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.synthetic_sizes.split(",") if size]
+    options = {"mode": args.mode, "static_analysis": args.static_analysis}
+    report = asyncio.run(run(args.repeat, args.latency, args.tokens_per_second, options, sizes))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        sys.exit(0)
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            print_comparison(json.load(f), report)
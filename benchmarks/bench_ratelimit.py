@@ -0,0 +1,127 @@
+"""
+Throttling test: the pipeline against a stub OpenAI API that answers 429.
+
+Starts benchmarks/stub_openai.py in a background thread and analyzes the
+sample corpus through the real openai backend pointed at it, in three
+scenarios: a burst of scripted 429s, a provider concurrency limit (which
+the adaptive limit has to find), and a requests-per-minute budget
+enforced by the stub and matched by FOAMAI_RPM. Reports time, errors,
+retries and the final adaptive concurrency limit of each.
+
+Usage:
+    python benchmarks/bench_ratelimit.py [--files N] [--latency S] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every call should reach the stub; retries should be quick
+os.environ["FOAMAI_CACHE"] = "0"
+os.environ["FOAMAI_RETRY_BASE"] = "0.1"
+os.environ["FOAMAI_RETRY_MAX"] = "2"
+os.environ["FOAMAI_LLM_RETRIES"] = "6"
+os.environ["OPENAI_API_KEY"] = "stub"
+
+import uvicorn
+
+import main
+from backends import create_llm
+from corpus import load_samples
+from metrics import LLM_CONCURRENCY_LIMIT, LLM_RETRIES
+from ratelimit import RateLimiter
+from stub_openai import create_app
+
+def start_stub(app):
+    """Serve app on a free local port; returns (base URL, server)."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1", server
+
+def retries(reason):
+    return sum(LLM_RETRIES.value(chain=stage, reason=reason) for stage in ("detect", "fix", "fused", "repair"))
+
+def run_scenario(name, samples, stub_options, limiter_options):
+    app = create_app(**stub_options)
+    base_url, server = start_stub(app)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    main.use_llm(create_llm("openai", main.MODEL_NAME, main.TEMPERATURE), backend="openai")
+    main._rate_limiter = RateLimiter(path=":memory:", **limiter_options)
+    throttle_retries, transient_retries = retries("throttle"), retries("transient")
+
+    async def analyze_all():
+        return await asyncio.gather(*(
+            main.detect_bugs_async(code, static_analysis="off") for _, code in samples
+        ))
+
+    start = time.perf_counter()
+    results = asyncio.run(analyze_all())
+    elapsed = time.perf_counter() - start
+    server.should_exit = True
+
+    stats = asyncio.run(_stats(app))
+    return {
+        "scenario": name,
+        "seconds": elapsed,
+        "files": len(samples),
+        "bugs": sum(len(result["bugs"]) for result in results),
+        "errors": sum(1 for result in results for bug in result["bugs"] if bug["type"] == "Error"),
+        "stub_requests": stats["requests"],
+        "stub_throttled": stats["throttled"],
+        "stub_max_in_flight": stats["max_in_flight"],
+        "throttle_retries": retries("throttle") - throttle_retries,
+        "transient_retries": retries("transient") - transient_retries,
+        "final_limit": LLM_CONCURRENCY_LIMIT.value(),
+    }
+
+async def _stats(app):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stub") as client:
+        return (await client.get("/stats")).json()
+
+def run(files, latency):
+    samples = (load_samples() * files)[:files]
+    scenarios = [
+        ("scripted 429 burst", {"script": [429] * 8 + [503, 200, 429], "latency": latency}, {"max_concurrency": 8}),
+        ("provider concurrency 4", {"max_in_flight": 4, "latency": latency}, {"max_concurrency": 32}),
+        ("provider 120 rpm", {"rpm": 120, "latency": latency}, {"max_concurrency": 32, "requests_per_minute": 120}),
+    ]
+    return [run_scenario(name, samples, stub, limiter) for name, stub, limiter in scenarios]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure throttling behaviour against a stub OpenAI API")
+    parser.add_argument("--files", type=int, default=24, help="Files analyzed per scenario")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub latency per call in seconds")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON instead of a table")
+    args = parser.parse_args()
+
+    report = run(args.files, args.latency)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        sys.exit(0)
+
+    header = (f"{'scenario':<24} {'seconds':>8} {'errors':>6} {'requests':>8} {'429s':>5} "
+              f"{'retries':>7} {'peak':>5} {'limit':>5}")
+    print(header)
+    print("-" * len(header))
+    for row in report:
+        print(
+            f"{row['scenario']:<24} {row['seconds']:>8.2f} {row['errors']:>6} {row['stub_requests']:>8} "
+            f"{row['stub_throttled']:>5} {row['throttle_retries'] + row['transient_retries']:>7} "
+            f"{row['stub_max_in_flight']:>5} {row['final_limit']:>5}"
+        )
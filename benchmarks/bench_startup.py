@@ -0,0 +1,92 @@
+"""
+Benchmark: cold-start time of the CLI and the API app.
+
+Starts a fresh interpreter for every run and measures the wall time until
+`main.py --help` exits and until `main` and `api` are imported. For each
+target it also runs `python -X importtime` once and lists the modules with
+the largest cumulative import time, so regressions are easy to trace. No
+API key is set, as none is needed to start up.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--top N] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = [
+    ("cli: main.py --help", ["main.py", "--help"]),
+    ("import main", ["-c", "import main"]),
+    ("import api", ["-c", "import api"]),
+]
+
+def clean_env():
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)
+    # Keep the benchmark from creating cache files in the repo
+    env["FOAMAI_CACHE"] = "0"
+    return env
+
+def time_run(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, env=clean_env(), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def slowest_imports(args, top):
+    """Return the top (module, cumulative seconds) pairs from -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=ROOT, env=clean_env(),
+                            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(cumulative) / 1e6))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return imports[:top]
+
+def run(runs, top):
+    results = []
+    for name, args in TARGETS:
+        timings = [time_run(args) for _ in range(runs)]
+        results.append({
+            "target": name,
+            "runs": runs,
+            "median_seconds": statistics.median(timings),
+            "min_seconds": min(timings),
+            "max_seconds": max(timings),
+            "slowest_imports": [{"module": module, "seconds": seconds} for module, seconds in slowest_imports(args, top)],
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure CLI and API cold-start time")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=5, help="Number of slowest imports to list per target")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON instead of a table")
+    args = parser.parse_args()
+
+    results = run(args.runs, args.top)
+
+    if args.json:
+        print(json.dumps({"python": sys.version.split()[0], "results": results}, indent=2))
+        sys.exit(0)
+
+    header = f"{'target':<22} {'median s':>9} {'min s':>7} {'max s':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(f"{row['target']:<22} {row['median_seconds']:>9.3f} {row['min_seconds']:>7.3f} {row['max_seconds']:>7.3f}")
+    for row in results:
+        print()
+        print(f"Slowest imports for {row['target']} (cumulative):")
+        for item in row["slowest_imports"]:
+            print(f"  {item['seconds']:>7.3f} s  {item['module']}")
@@ -0,0 +1,142 @@
+"""
+Stub of the OpenAI chat completions API that throttles on script.
+
+Answers come from the fake backend in backends.py, so the pipeline finds
+the same bugs as with FOAMAI_BACKEND=fake, but they travel over HTTP
+through langchain_openai, which is how throttling reaches ratelimit.py
+in production. Requests are answered with 429 when
+
+- the next entry of the script says so (e.g. "429,429,200,503"; once the
+  script is used up every request may succeed),
+- more than --rpm requests arrived in the last 60 seconds, or
+- more than --max-in-flight requests are being answered at once.
+
+GET /stats returns what the stub saw.
+
+Usage:
+    python benchmarks/stub_openai.py [--port 8100] [--script 429,429,200] [--rpm N] [--max-in-flight N]
+                                     [--latency S] [--retry-after S]
+
+    Then point the openai backend at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=stub python main.py ...
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from backends import FakeChatModel, estimate_tokens
+
+def create_app(script=(), rpm=0, max_in_flight=0, latency=0.05, retry_after=None):
+    """
+    Build the stub app.
+
+    Args:
+        script (list): HTTP statuses for the first requests, in order
+        rpm (int): Requests per minute before answering 429 (0 for no limit)
+        max_in_flight (int): Concurrent requests before answering 429 (0 for no limit)
+        latency (float): Seconds to answer a request
+        retry_after (float): Retry-After sent with every 429, or None
+    """
+    app = FastAPI()
+    model = FakeChatModel(latency=0)
+    script = collections.deque(script)
+    arrivals = collections.deque()
+    stats = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0,
+             "prompt_tokens": 0, "completion_tokens": 0}
+
+    def refuse(status):
+        kind = "rate_limit_exceeded" if status == 429 else "server_error"
+        stats["throttled" if status == 429 else "errors"] += 1
+        headers = {"retry-after": str(retry_after)} if status == 429 and retry_after is not None else {}
+        return JSONResponse({"error": {"message": f"Stub answered {status}", "type": kind, "code": kind}},
+                            status_code=status, headers=headers)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        now = time.monotonic()
+        arrivals.append(now)
+        while arrivals and arrivals[0] <= now - 60:
+            arrivals.popleft()
+
+        status = script.popleft() if script else 200
+        if status == 200 and rpm and len(arrivals) > rpm:
+            status = 429
+        if status == 200 and max_in_flight and stats["in_flight"] >= max_in_flight:
+            status = 429
+        if status != 200:
+            return refuse(status)
+
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            stats["in_flight"] -= 1
+        stats["ok"] += 1
+
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        content = model.respond(prompt)
+        usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(content)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        # Usage as answered, for checking what clients report
+        stats["prompt_tokens"] += usage["prompt_tokens"]
+        stats["completion_tokens"] += usage["completion_tokens"]
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body.get("model", "stub")}
+        if not body.get("stream"):
+            return {**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ]}
+
+        def events():
+            chunk = {**base, "object": "chat.completion.chunk"}
+            yield {**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": content},
+                                         "finish_reason": None}]}
+            yield {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield {**chunk, "choices": [], "usage": usage}
+
+        async def stream():
+            for event in events():
+                yield f"data: {json.dumps(event)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+def parse_script(text):
+    return [int(status) for status in text.split(",") if status.strip()] if text else []
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub OpenAI chat completions API with scripted 429s")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--script", default="", help="Comma-separated statuses of the first requests")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before answering 429")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="Concurrent requests before answering 429")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per answer")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After sent with 429s")
+    args = parser.parse_args()
+    app = create_app(parse_script(args.script), args.rpm, args.max_in_flight, args.latency, args.retry_after)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Content-addressed result cache for LLM chain calls.
+
+Results are keyed on a hash of the normalized chain inputs, the prompt
+template text and the model settings, so unchanged code never costs a
+second round trip. Lookups go through a small in-memory LRU tier first
+and then a persistent SQLite tier with size- and age-based eviction.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def normalize_text(text):
+    """
+    Normalize text so that insignificant whitespace changes hit the same entry.
+
+    Line endings are unified, trailing whitespace is removed from every line
+    and leading/trailing blank lines are dropped.
+    """
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+def make_cache_key(inputs, template, model_name, temperature):
+    """
+    Build a cache key for a chain call.
+
+    Args:
+        inputs (dict): The variables passed to the prompt template
+        template (str): The prompt template text
+        model_name (str): Name of the model the chain calls
+        temperature (float): Sampling temperature of the model
+
+    Returns:
+        str: Hex SHA-256 digest identifying the call
+    """
+    normalized = {
+        name: normalize_text(value) if isinstance(value, str) else value
+        for name, value in sorted(inputs.items())
+    }
+    payload = json.dumps(
+        [normalized, template, model_name, temperature],
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """
+    Two-tier (memory LRU + SQLite) cache of chain completions.
+
+    Args:
+        path (str): SQLite database file, or None for a memory-only cache
+        memory_size (int): Number of entries kept in the in-memory LRU tier
+        max_entries (int): Maximum number of entries kept on disk
+        max_age (float): Maximum age of an entry in seconds before it expires
+    """
+
+    # Run disk eviction after this many writes instead of on every write
+    EVICT_EVERY = 100
+
+    def __init__(self, path=None, memory_size=1024, max_entries=10000, max_age=7 * 24 * 3600):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self._db.commit()
+            self._evict()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the cache configured by environment variables.
+
+        FOAMAI_CACHE=0 disables caching entirely (returns None).
+        FOAMAI_CACHE_PATH sets the SQLite file; an empty value keeps the cache in memory.
+        FOAMAI_CACHE_MAX_ENTRIES and FOAMAI_CACHE_MAX_AGE_DAYS control disk eviction.
+        """
+        if os.environ.get("FOAMAI_CACHE", "1").lower() in ("0", "false", "no", "off"):
+            return None
+        return cls(
+            path=os.environ.get("FOAMAI_CACHE_PATH", ".foamai_cache.sqlite") or None,
+            memory_size=int(os.environ.get("FOAMAI_CACHE_MEMORY_SIZE", "1024")),
+            max_entries=int(os.environ.get("FOAMAI_CACHE_MAX_ENTRIES", "10000")),
+            max_age=float(os.environ.get("FOAMAI_CACHE_MAX_AGE_DAYS", "7")) * 24 * 3600
+        )
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                created, value = self._memory[key]
+                if time.time() - created <= self.max_age:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                now = time.time()
+                row = self._db.execute(
+                    "SELECT value, created FROM results WHERE key = ? AND created >= ?",
+                    (key, now - self.max_age)
+                ).fetchone()
+                if row is not None:
+                    value, created = row
+                    self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, created, value)
+                    self._stats["disk_hits"] += 1
+                    return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        """Store value under key in both tiers."""
+        with self._lock:
+            now = time.time()
+            self._remember(key, now, value)
+            self._stats["writes"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._db.commit()
+                self._writes_since_evict += 1
+                if self._writes_since_evict >= self.EVICT_EVERY:
+                    self._evict()
+
+    def stats(self):
+        """Return hit/miss counters and the current tier sizes."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def _remember(self, key, created, value):
+        # Caller holds the lock
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        # Caller holds the lock (or is the constructor)
+        self._writes_since_evict = 0
+        cursor = self._db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.max_age,))
+        evicted = cursor.rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            # Drop the least recently used entries beyond the size limit
+            cursor = self._db.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            evicted += cursor.rowcount
+        self._db.commit()
+        self._stats["evictions"] += max(evicted, 0)
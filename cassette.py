@@ -0,0 +1,94 @@
+"""
+Record and replay of chat model completions.
+
+With FOAMAI_CASSETTE set, backends.create_llm wraps the chat model in a
+backends.CassetteChatModel. In record mode (FOAMAI_CASSETTE_MODE=record) every
+prompt is sent to the real backend and its completion saved in the
+cassette. In replay mode (the default) completions come from the
+cassette alone, with no network access and no API key, so a test or
+benchmark run costs no tokens and gives the same answers every time.
+
+A cassette is a gzip-compressed JSON-lines file of {"key", "completion"}
+records, keyed by the SHA-256 of the prompt. New records are appended
+as they are made, so an interrupted recording keeps what it had, and
+the file is rewritten as one compact stream when the process exits.
+
+This module has no dependencies, so main.py can import CassetteMiss
+without loading LangChain.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+CASSETTE_MODES = ("record", "replay")
+
+class CassetteMiss(LookupError):
+    """The prompt has no recorded completion in the cassette being replayed."""
+
+def prompt_key(messages):
+    """Key of a prompt: the SHA-256 of its messages' text."""
+    text = "\n".join(str(message.content) for message in messages)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class Cassette:
+    """
+    Completions by prompt key, stored in a gzip JSON-lines file.
+
+    Args:
+        path (str): The cassette file (need not exist yet)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._appended = 0
+        if os.path.exists(path):
+            self._entries = self._load()
+
+    def _load(self):
+        entries = {}
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    entries[record["key"]] = record["completion"]
+        except EOFError:
+            # A recording interrupted mid-write: keep the records read so far
+            pass
+        return entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the completion recorded for key, or None."""
+        return self._entries.get(key)
+
+    def record(self, key, completion):
+        """Save a completion, replacing any earlier one for the same key."""
+        with self._lock:
+            self._entries[key] = completion
+            # Each append is a gzip member of its own; readers see one stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "completion": completion}) + "\n")
+            self._appended += 1
+
+    def compact(self):
+        """Rewrite the file as a single gzip stream with one record per key."""
+        with self._lock:
+            if not self._appended:
+                return
+            # Keep what other processes recording to the same file appended meanwhile
+            entries = {**self._load(), **self._entries}
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with gzip.open(temporary, "wt", encoding="utf-8") as f:
+                for key, completion in entries.items():
+                    f.write(json.dumps({"key": key, "completion": completion}) + "\n")
+            os.replace(temporary, self.path)
+            self._appended = 0
@@ -0,0 +1,326 @@
+"""
+Chunking strategies for splitting Python source before it is sent to the LLM.
+
+chunk_code cuts at function, class and statement boundaries using the ast
+module and packs neighbours together up to a character budget, so chunks
+never end mid-statement yet come out nearly as full as those of a plain
+character split with the same budget. The later pieces of a function or class too large for
+one chunk repeat its header (the def or class lines, and those of the
+blocks enclosing it), so the model still sees the signature of the code
+it is reading. Every chunk remembers the file line of each of its lines,
+which lets locations reported by the model be mapped back to real lines.
+"""
+import ast
+import re
+from typing import List, NamedTuple, Tuple
+
+# Default character budget for a single chunk
+DEFAULT_MAX_LENGTH = 2000
+
+# Line references inside a reported location, e.g. "line 3" or "lines 4-6"
+_LINE_REFERENCE = re.compile(r"\blines?\s+\d+(?:\s*(?:-|to|and|,)\s*\d+)*", re.IGNORECASE)
+
+class Chunk(NamedTuple):
+    text: str
+    # 1-based line of the original code the chunk starts at; header lines
+    # repeated above it for context (see _split_node) come before it
+    start_line: int
+    # Original line of every line of text, for text that is not a contiguous
+    # slice of the original (see normalize.py) or repeats a header; empty when it is
+    lines: Tuple[int, ...] = ()
+
+    @property
+    def end_line(self):
+        if self.lines:
+            return self.lines[-1]
+        return self.start_line + self.text.count("\n")
+
+    def original_line(self, line):
+        """Translate a 1-based line of text into a line of the original code."""
+        if self.lines and 1 <= line <= len(self.lines):
+            return self.lines[line - 1]
+        if self.lines:
+            # Past either end: keep the distance to the nearest known line
+            return self.lines[0] + line - 1 if line < 1 else self.lines[-1] + line - len(self.lines)
+        return self.start_line + line - 1
+
+def chunk_code_by_length(code, max_length=500):
+    """
+    Split code into chunks of roughly max_length characters at line breaks.
+
+    This is the original character-based strategy. It is used as a fallback
+    for code that does not parse.
+    """
+    if len(code) <= max_length:
+        return [Chunk(code, 1)]
+    lines = code.split("\n")
+    chunks = []
+    current_chunk = ""
+    start_line = 1
+    for line_number, line in enumerate(lines, 1):
+        if len(current_chunk) + len(line) > max_length and current_chunk:
+            chunks.append(Chunk(current_chunk, start_line))
+            current_chunk = line
+            start_line = line_number
+        elif current_chunk:
+            current_chunk += "\n" + line
+        else:
+            # Leading blank lines are dropped, so the chunk starts at the first kept line
+            current_chunk = line
+            start_line = line_number
+    if current_chunk:
+        chunks.append(Chunk(current_chunk, start_line))
+    return chunks
+
+def chunk_code(code, max_length=DEFAULT_MAX_LENGTH):
+    """
+    Split code into chunks at syntactic boundaries.
+
+    Consecutive top-level statements, functions and classes are packed into
+    chunks of up to max_length characters. A class or function is split at
+    the boundaries of its inner statements when it is larger than
+    max_length, or would otherwise leave a chunk less than seven-eighths
+    full. A chunk that continues a statement starts with the header lines
+    of the statements it is inside, unless little of them is left. Comments
+    and blank lines stay with the statement that follows them. Code that
+    does not parse falls back to chunk_code_by_length.
+
+    Args:
+        code (str): The Python code to split
+        max_length (int): Character budget per chunk
+
+    Returns:
+        list: Chunk tuples of (text, start_line, lines)
+    """
+    if len(code) <= max_length:
+        return [Chunk(code, 1)]
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return chunk_code_by_length(code, max_length)
+
+    lines = code.split("\n")
+    if not tree.body:
+        return chunk_code_by_length(code, max_length)
+    ranges = _split_statements(tree.body, lines, 1, len(lines), max_length, ())
+    return _pack(ranges, lines, max_length)
+
+def relocate_location(location, chunk):
+    """
+    Translate a location reported for a chunk into a location in the original code.
+
+    Line numbers mentioned in the location ("line 3", "lines 4-6") are relative
+    to the chunk and are shifted by its starting line. Locations without a line
+    number (e.g. a function name) are prefixed with the chunk's line range.
+    """
+    location = str(location).strip()
+    if location.isdigit() or _LINE_REFERENCE.search(location):
+        return _map_lines(location, chunk.original_line)
+    prefix = f"lines {chunk.start_line}-{chunk.end_line}"
+    return f"{prefix}: {location}" if location else prefix
+
+def relocate_text(text, chunk):
+    """
+    Translate the line references ("line 3", "lines 4-6") in a description or
+    fix reported for a chunk into lines of the original code.
+
+    Unlike relocate_location, the rest of the text, including any bare
+    number, is left as it is.
+    """
+    return _map_text_lines(text, chunk.original_line)
+
+def shift_text(text, offset):
+    """Add offset to every line reference in a description or fix, like shift_location."""
+    return _map_text_lines(text, lambda line: line + offset)
+
+def _map_text_lines(text, translate):
+    if not isinstance(text, str):
+        return text
+    return _LINE_REFERENCE.sub(lambda match: _translate_numbers(match, translate), text)
+
+def shift_location(location, offset):
+    """
+    Add offset to every line number mentioned in a location.
+
+    Bare numbers are read as a line number ("3" becomes "line 3" shifted).
+    Locations without a line number are returned unchanged.
+    """
+    return _map_lines(location, lambda line: line + offset)
+
+def location_lines(location):
+    """
+    The first and last line a location mentions ("line 9", "lines 8-9: ..."), or None.
+
+    Bare numbers are read as a line number, as in shift_location.
+    """
+    location = str(location).strip()
+    if location.isdigit():
+        return int(location), int(location)
+    numbers = [int(number) for match in _LINE_REFERENCE.finditer(location)
+               for number in re.findall(r"\d+", match.group())]
+    return (min(numbers), max(numbers)) if numbers else None
+
+def _map_lines(location, translate):
+    """Replace every line number n mentioned in a location with translate(n)."""
+    location = str(location).strip()
+    if location.isdigit():
+        return f"line {translate(int(location))}"
+
+    return _LINE_REFERENCE.sub(lambda match: _translate_numbers(match, translate), location)
+
+def _translate_numbers(match, translate):
+    return re.sub(r"\d+", lambda number: str(translate(int(number.group()))), match.group())
+
+def first_line(node):
+    """The first line of a statement, counting the decorators above a def or class."""
+    decorators = getattr(node, "decorator_list", None) or []
+    return min([node.lineno] + [decorator.lineno for decorator in decorators])
+
+def span_size(lines, start, end):
+    """Characters (with line breaks) of lines start..end (1-based, inclusive)."""
+    return sum(len(line) + 1 for line in lines[start - 1:end])
+
+def _split_statements(statements, lines, first, last, max_length, context):
+    """
+    Return contiguous (start, end, context, node) line ranges covering first..last.
+
+    context is the tuple of header lines of the statements enclosing them.
+    node is the statement a range holds whole, which _pack may still split
+    to fill a chunk, or None.
+    """
+    ranges = []
+    previous_end = first - 1
+    for index, statement in enumerate(statements):
+        start = previous_end + 1
+        # The last statement also owns any trailing lines
+        end = last if index == len(statements) - 1 else statement.end_lineno
+        if start > end:
+            # Several statements on one line (a; b)
+            continue
+        if span_size(lines, start, end) > max_length:
+            ranges.extend(_split_node(statement, lines, start, end, max_length, context))
+        else:
+            ranges.append((start, end, context, statement))
+        previous_end = end
+    return ranges
+
+def _children(node):
+    """The statements nested in a compound statement, in source order."""
+    children = []
+    for field in ("body", "orelse", "finalbody", "handlers", "cases"):
+        children.extend(
+            child for child in getattr(node, field, None) or []
+            if hasattr(child, "lineno")
+        )
+    return sorted(children, key=first_line)
+
+def _split_node(node, lines, first, last, max_length, context):
+    """
+    Split a compound statement at the boundaries of its children.
+
+    The children's ranges carry the statement's header (e.g. its def line
+    with decorators and the whole signature) as context, and are cut small
+    enough to leave room for it. A header longer than an eighth of the
+    budget is not repeated. A simple statement is split at line breaks.
+    """
+    children = _children(node)
+    if not children or first_line(children[0]) <= first:
+        return _split_lines(lines, first, last, max_length, context)
+
+    header_end = first_line(children[0]) - 1
+    if span_size(lines, first, header_end) > max_length:
+        # Long comments above the statement, or a very long signature
+        ranges = _split_lines(lines, first, header_end, max_length, context)
+    else:
+        ranges = [(first, header_end, context, None)]
+    inner_context = context + tuple(range(first_line(node), header_end + 1))
+    if _size_of(lines, inner_context) > max_length // 8:
+        inner_context = context
+    budget = max_length - _size_of(lines, inner_context)
+    ranges.extend(_split_statements(children, lines, header_end + 1, last, budget, inner_context))
+    return ranges
+
+def _split_lines(lines, first, last, max_length, context):
+    """Split a single oversized statement at line breaks."""
+    ranges = []
+    start = first
+    size = 0
+    for line_number in range(first, last + 1):
+        line_size = len(lines[line_number - 1]) + 1
+        if size + line_size > max_length and size:
+            ranges.append((start, line_number - 1, context, None))
+            start = line_number
+            size = 0
+        size += line_size
+    ranges.append((start, last, context, None))
+    return ranges
+
+def _remainder(ranges, index, lines):
+    """Size of ranges[index] and the ranges after it inside the same enclosing statements."""
+    context = ranges[index][2]
+    size = 0
+    for start, end, inner, _ in ranges[index:]:
+        if inner[:len(context)] != context:
+            break
+        size += span_size(lines, start, end)
+    return size
+
+def _pack(ranges, lines, max_length):
+    """
+    Greedily merge consecutive line ranges into chunks up to max_length characters.
+
+    A compound statement that does not fit in what is left of a chunk is
+    split between its children to fill it, unless the chunk is already
+    seven-eighths full, so chunks come out nearly as full as with a plain
+    line split. The cut still falls between statements, and the rest of
+    the statement follows in the next chunk under its header.
+
+    A chunk starts with the context of its first range, unless little of
+    the enclosing statements is left (a quarter of the budget or less),
+    which is not worth repeating their headers for. The headers of the
+    ranges after it are part of the chunk's own lines.
+    """
+    ranges = list(ranges)
+    chunks: List[Chunk] = []
+    current_start = None
+    current_end = None
+    current_context = ()
+    current_size = 0
+    index = 0
+    while index < len(ranges):
+        start, end, context, node = ranges[index]
+        size = span_size(lines, start, end)
+        if current_start is not None and current_size + size > max_length:
+            room = max_length - current_size
+            if node is not None and room >= max_length // 8 and _children(node):
+                pieces = _split_node(node, lines, start, end, max_length, context)
+                if len(pieces) > 1 and span_size(lines, pieces[0][0], pieces[0][1]) <= room:
+                    ranges[index:index + 1] = pieces
+                    continue
+            chunks.append(_make_chunk(lines, current_start, current_end, current_context))
+            current_start = None
+            current_size = 0
+        if current_start is None:
+            current_start = start
+            current_context = context
+            if context and _remainder(ranges, index, lines) <= max_length // 4:
+                current_context = ()
+            current_size = _size_of(lines, current_context)
+        current_end = end
+        current_size += size
+        index += 1
+    if current_start is not None:
+        chunks.append(_make_chunk(lines, current_start, current_end, current_context))
+    # A repeated header alone is no code to analyze
+    return [chunk for chunk in chunks if chunk is not None]
+
+def _size_of(lines, numbers):
+    return sum(len(lines[number - 1]) + 1 for number in numbers)
+
+def _make_chunk(lines, start, end, context=()):
+    if not "\n".join(lines[start - 1:end]).strip():
+        return None
+    if not context:
+        return Chunk("\n".join(lines[start - 1:end]), start)
+    numbers = context + tuple(range(start, end + 1))
+    return Chunk("\n".join(lines[number - 1] for number in numbers), start, numbers)
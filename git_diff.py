@@ -0,0 +1,173 @@
+"""
+Diff-only analysis for pull-request checks.
+
+The changed lines of every file come from `git diff` between two refs
+(or between a ref and the working tree) or from a unified diff. Only the
+top-level functions and classes containing a changed line are analyzed
+(see main.detect_bugs_changed), with the LLM calls of all files sharing
+one concurrency limit. Bug locations are lines of the new version of the
+file, and each result names its file.
+"""
+import asyncio
+import json
+import os
+import re
+import subprocess
+
+from main import CallGroup, detect_bugs_changed
+from scan import DEFAULT_INCLUDE, path_matches
+
+# @@ -old_start[,old_count] +new_start[,new_count] @@
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+def _new_path(header):
+    path = header[4:].split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    # git prefixes the new side with "b/" unless --no-prefix was used
+    return path[2:] if path.startswith("b/") else path
+
+def parse_unified_diff(diff_text):
+    """
+    Find the changed lines of every file in a unified diff.
+
+    Added lines count as changed. Where lines were only removed, the lines
+    on either side of the removal count as changed, so the function they
+    were removed from is still analyzed. Deleted files are left out.
+
+    Args:
+        diff_text (str): A unified diff, e.g. the output of `git diff`
+
+    Returns:
+        dict: {path: set of 1-based line numbers in the new version}
+    """
+    changes = {}
+    path = None
+    old_left = new_left = 0
+    new_line = 0
+    for line in diff_text.splitlines():
+        if old_left > 0 or new_left > 0:
+            # Inside a hunk
+            if line.startswith("+"):
+                changes[path].add(new_line)
+                new_line += 1
+                new_left -= 1
+            elif line.startswith("-"):
+                changes[path].update((new_line - 1, new_line))
+                old_left -= 1
+            elif line.startswith("\\"):
+                pass  # "\ No newline at end of file"
+            else:
+                new_line += 1
+                old_left -= 1
+                new_left -= 1
+            continue
+
+        if line.startswith("+++ "):
+            path = _new_path(line)
+            if path is not None:
+                changes.setdefault(path, set())
+            continue
+        match = _HUNK_HEADER.match(line)
+        if match and path is not None:
+            old_left = int(match.group(2) if match.group(2) is not None else 1)
+            new_left = int(match.group(4) if match.group(4) is not None else 1)
+            new_line = int(match.group(3))
+            if new_left == 0:
+                # A pure removal names the line before it
+                new_line += 1
+    return {path: {line for line in lines if line > 0} for path, lines in changes.items()}
+
+def _git(repo, *args):
+    return subprocess.run(["git", "-C", repo] + list(args), capture_output=True, text=True, check=True).stdout
+
+def git_changes(repo, base, head=None):
+    """
+    Return the changed lines per file between base and head.
+
+    Args:
+        repo (str): Path inside the git repository
+        base (str): Ref to compare against, e.g. "origin/main"
+        head (str): Ref with the new code, or None for the working tree
+
+    Returns:
+        dict: {path relative to the repository root: set of changed lines in head}
+    """
+    refs = [base] if head is None else [base, head]
+    return parse_unified_diff(_git(repo, "diff", "--unified=0", "--no-color", "--no-ext-diff", *refs, "--"))
+
+def repository_root(path="."):
+    """Return the top directory of the git repository containing path, or path itself outside a repository."""
+    try:
+        return _git(path, "rev-parse", "--show-toplevel").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return path
+
+def working_tree_reader(root):
+    """Return a function reading a file given its path relative to root."""
+    def read(path):
+        with open(os.path.join(root, path), "r", encoding="utf-8") as f:
+            return f.read()
+    return read
+
+def file_reader(repo, head=None):
+    """Return a function reading a file (path relative to the repository root) at head, or from the working tree."""
+    if head is not None:
+        return lambda path: _git(repo, "show", f"{head}:{path}")
+    return working_tree_reader(_git(repo, "rev-parse", "--show-toplevel").strip())
+
+async def analyze_changes(changes, read_file, output, include=None, exclude=None, workers=4, max_concurrency=None,
+                          progress=None, **options):
+    """
+    Analyze the changed parts of every file, writing one JSON line per file.
+
+    Args:
+        changes (dict): {path: changed lines}, e.g. from git_changes or parse_unified_diff
+        read_file (callable): Returns the new version of a file given its path; it may block
+            (e.g. run git show), so it is called in a worker thread
+        output: Text file the JSONL records are written to; each record is
+            {"path", "bugs", "fixes", "units"} or {"path", "error"}
+        include (list): Globs of files to analyze (defaults to *.py)
+        exclude (list): Globs of files and directories to skip
+        workers (int): Number of files read and analyzed at the same time
+        max_concurrency (int): Maximum number of LLM calls in flight across all files
+        progress (callable): Called as progress(done, total, path, record) after each file
+        options: Keyword arguments for detect_bugs_changed
+
+    Returns:
+        dict: Counts of "files" analyzed, "failed" files and "units" (functions and classes) analyzed
+    """
+    include = include or DEFAULT_INCLUDE
+    exclude = exclude or []
+    paths = [path for path in sorted(changes)
+             if changes[path] and path_matches(path, include) and not path_matches(path, exclude)]
+    calls = CallGroup(max_concurrency)
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+    counts = {"files": len(paths), "failed": 0, "units": 0}
+    done = 0
+
+    async def analyze(path):
+        nonlocal done
+        try:
+            # Keeps the event loop free for the other files' LLM calls while git runs
+            code = await asyncio.to_thread(read_file, path)
+            result = await detect_bugs_changed(code, changes[path], call_group=calls, **options)
+            record = {"path": path, **result}
+            counts["units"] += result["units"]["analyzed"]
+        except Exception as e:
+            record = {"path": path, "error": f"Error detecting bugs: {str(e)}"}
+            counts["failed"] += 1
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        done += 1
+        if progress is not None:
+            progress(done, len(paths), path, record)
+
+    async def worker():
+        while not queue.empty():
+            await analyze(queue.get_nowait())
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    return counts
@@ -0,0 +1,197 @@
+"""
+Incremental re-analysis of a document that is resubmitted after every edit.
+
+split_units cuts a module into its top-level functions and classes (with
+the statements between them grouped into "module" units), and a class too
+large for one chunk into its methods, and fingerprints each unit's
+normalized source. DocumentStore remembers, per document ID,
+the bugs and fixes found for every fingerprint, so the next submission of
+the same document only needs to analyze the units whose fingerprint
+changed. Locations are stored relative to the unit, which lets reused
+results follow the unit when the code above it grows or shrinks.
+"""
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Tuple
+
+from cache import normalize_text
+from chunking import first_line, span_size
+
+class Unit(NamedTuple):
+    # Function or class name, "Class.method" for a method, or "<module>" for other top-level statements
+    name: str
+    text: str  # Source of the unit, including the comments and blank lines above it
+    start_line: int  # 1-based line of the first line of text
+    anchor_line: int  # Line of the unit's first statement (or decorator); locations are stored relative to it
+    fingerprint: str
+    # The class line(s) of a method, or of class statements after the first
+    # method, which the model needs to see with the unit, and their lines
+    header: str = ""
+    header_lines: Tuple[int, ...] = ()
+
+    @property
+    def end_line(self):
+        return self.start_line + self.text.count("\n")
+
+_DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+def _fingerprint(name, lines, anchor, end, header=""):
+    # A method's header is part of it: a new base class can change what the method does
+    source = normalize_text("\n".join([header] + lines[anchor - 1:end]))
+    return hashlib.sha256(f"{name}\n{source}".encode("utf-8")).hexdigest()
+
+def _make_unit(name, lines, start, anchor, end, header_lines=()):
+    header = "\n".join(lines[line - 1] for line in header_lines)
+    return Unit(name, "\n".join(lines[start - 1:end]), start, anchor,
+                _fingerprint(name, lines, anchor, end, header), header, header_lines)
+
+def _class_spans(node, lines):
+    """(name, first line, end line, header lines) of the units of a class split into its methods."""
+    header_end = first_line(node.body[0]) - 1
+    while header_end > node.lineno and lines[header_end - 1].strip()[:1] in ("", "#"):
+        header_end -= 1
+    header = tuple(range(node.lineno, header_end + 1))
+    spans = []
+    for statement in node.body:
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            spans.append((f"{node.name}.{statement.name}", first_line(statement), statement.end_lineno, header))
+        elif spans and spans[-1][0] == node.name:
+            spans[-1] = spans[-1][:2] + (statement.end_lineno, header)
+        else:
+            spans.append((node.name, first_line(statement), statement.end_lineno, header))
+    # The first unit starts with the class line itself, so it needs no header
+    spans[0] = (spans[0][0], first_line(node), spans[0][2], ())
+    return spans
+
+def split_units(code, max_length=None):
+    """
+    Split a module into fingerprinted top-level units.
+
+    Every top-level function and class is a unit of its own; runs of other
+    top-level statements (imports, assignments, ...) form "<module>" units.
+    A class longer than max_length characters is split further: each method
+    is a unit ("Class.method") and runs of other class statements are units
+    named after the class. Those units carry the class line as their header
+    (except the first, which starts with it), so a change to one method
+    does not send the whole class to the LLM.
+
+    Comments and blank lines belong to the unit that follows them, and the
+    last unit also owns any trailing lines, so the units cover the code
+    without gaps. The fingerprint covers the unit's header and its source
+    from its first statement on, ignoring line endings, trailing whitespace
+    and the lines above it, so a unit keeps its fingerprint when it only
+    moves. Code that does not parse is a single unit.
+
+    Args:
+        code (str): The Python code to split
+        max_length (int): Size in characters above which a class is split
+            into its methods; None keeps every class whole
+
+    Returns:
+        list: Unit tuples in source order
+    """
+    lines = code.split("\n")
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        tree = None
+    if tree is None or not tree.body:
+        return [_make_unit("<module>", lines, 1, 1, len(lines))]
+
+    # (name, first statement line, end line, header lines) of each unit before gaps are assigned
+    spans = []
+    for statement in tree.body:
+        name = statement.name if isinstance(statement, _DEFINITIONS) else "<module>"
+        first = first_line(statement)
+        if (isinstance(statement, ast.ClassDef) and max_length is not None
+                and span_size(lines, first, statement.end_lineno) > max_length):
+            spans.extend(_class_spans(statement, lines))
+        elif name == "<module>" and spans and spans[-1][0] == "<module>":
+            spans[-1] = (name, spans[-1][1], statement.end_lineno, ())
+        else:
+            spans.append((name, first, statement.end_lineno, ()))
+
+    units = []
+    previous_end = 0
+    for index, (name, anchor, end, header_lines) in enumerate(spans):
+        if index == len(spans) - 1:
+            end = len(lines)
+        if anchor <= previous_end:
+            # Several statements on one line (a; def f(): ...)
+            anchor = previous_end + 1
+            if anchor > end:
+                continue
+        units.append(_make_unit(name, lines, previous_end + 1, anchor, end, header_lines))
+        previous_end = end
+    return units
+
+class DocumentStore:
+    """
+    SQLite-backed results of the last analysis of each document.
+
+    A document's record holds, for every unit fingerprint, the bugs and fixes
+    found in that unit with line numbers relative to the unit's anchor line.
+    Records are tagged with the analysis options they were produced with and
+    are ignored when the options change.
+
+    Args:
+        path (str): SQLite database file (":memory:" for a throwaway store)
+    """
+
+    def __init__(self, path=".foamai_documents.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " id TEXT PRIMARY KEY,"
+            " options TEXT NOT NULL,"
+            " units TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls):
+        """Create the store at FOAMAI_DOCUMENTS_PATH (default .foamai_documents.sqlite)."""
+        return cls(os.environ.get("FOAMAI_DOCUMENTS_PATH", ".foamai_documents.sqlite"))
+
+    def load(self, document_id, options):
+        """
+        Return the saved unit results of a document.
+
+        Args:
+            document_id (str): The document's ID
+            options (str): The analysis options the results must have been produced with
+
+        Returns:
+            dict: Records ({"bugs", "fixes"}) by unit fingerprint; empty if the
+            document is unknown or was analyzed with other options
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT options, units FROM documents WHERE id = ?", (document_id,)
+            ).fetchone()
+        if row is None or row[0] != options:
+            return {}
+        return json.loads(row[1])
+
+    def save(self, document_id, options, units):
+        """Replace a document's saved results with units (records by fingerprint)."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO documents (id, options, units, updated) VALUES (?, ?, ?, ?)",
+                (document_id, options, json.dumps(units), time.time())
+            )
+            self._db.commit()
+
+    def delete(self, document_id):
+        """Forget a document."""
+        with self._lock:
+            self._db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+            self._db.commit()
@@ -0,0 +1,387 @@
+"""
+Durable job queue for analyses that take too long for one HTTP request.
+
+Jobs are stored in SQLite along with every chunk and fix batch they have
+finished, so a job interrupted by a restart resumes where it stopped
+instead of starting over. A pool of asyncio workers running inside the
+API process takes jobs from the queue in submission order.
+
+Several processes (e.g. uvicorn --workers N) can share one store. A job
+is claimed in a single write transaction and leased to the claiming
+store: its workers renew the lease while the job runs, and a running job
+whose lease has expired (its process died) is claimed again by whoever
+looks next. A clean shutdown hands its jobs back to the queue right away.
+
+Every database call of the workers runs in a thread, so waiting for another
+process's write lock never blocks the event loop. A database error (e.g.
+"database is locked") is logged and retried after a pause instead of
+stopping the worker; saving progress is best effort.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from main import detect_bugs_resumable
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class JobStore:
+    """
+    SQLite-backed store of jobs and their saved progress.
+
+    Args:
+        path (str): SQLite database file (":memory:" for a throwaway store)
+        lease (float): Seconds a claimed job stays with this store without its lease being renewed
+    """
+
+    def __init__(self, path=".foamai_jobs.sqlite", lease=60.0):
+        self.path = path
+        self.lease = lease
+        # Identifies this store's claims among the processes sharing the database
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " request TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " stage TEXT,"
+            " done INTEGER NOT NULL DEFAULT 0,"
+            " total INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " error TEXT,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " owner TEXT)"
+        )
+        if "owner" not in {column[1] for column in self._db.execute("PRAGMA table_info(jobs)")}:
+            # Stores created before jobs were leased
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_steps ("
+            " job_id TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " idx INTEGER NOT NULL,"
+            " record TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, kind, idx))"
+        )
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls):
+        """Create the store at FOAMAI_JOBS_PATH (default .foamai_jobs.sqlite) with a FOAMAI_JOB_LEASE (default 60 s)."""
+        return cls(os.environ.get("FOAMAI_JOBS_PATH", ".foamai_jobs.sqlite"),
+                   lease=float(os.environ.get("FOAMAI_JOB_LEASE", "60")))
+
+    def submit(self, request):
+        """
+        Queue a job.
+
+        Args:
+            request (dict): "code" plus keyword arguments for detect_bugs_resumable
+
+        Returns:
+            str: The new job's ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, request, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (job_id, json.dumps(request), JOB_QUEUED, now, now)
+            )
+            self._db.commit()
+        return job_id
+
+    def get(self, job_id):
+        """Return a job's status, progress and (once done) result, or None if unknown."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, stage, done, total, result, error, created, updated FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, stage, done, total, result, error, created, updated = row
+        return {
+            "id": job_id,
+            "status": status,
+            "progress": {"stage": stage, "done": done, "total": total},
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "created": created,
+            "updated": updated,
+        }
+
+    def claim(self):
+        """
+        Lease the oldest queued job, or a running one whose lease expired, to this store.
+
+        Returns:
+            tuple: (job ID, request dict), or None when the queue is empty
+        """
+        with self._lock:
+            now = time.time()
+            # Other processes wait for the write lock, so no two claim the same job
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, request FROM jobs WHERE status = ? OR (status = ? AND updated < ?)"
+                    " ORDER BY created LIMIT 1",
+                    (JOB_QUEUED, JOB_RUNNING, now - self.lease)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, owner = ?, updated = ? WHERE id = ?",
+                        (JOB_RUNNING, self.owner, now, row[0])
+                    )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def renew(self, job_ids=None):
+        """Renew the lease on the given jobs (default: every job this store is running)."""
+        query = "UPDATE jobs SET updated = ? WHERE status = ? AND owner = ?"
+        parameters = [time.time(), JOB_RUNNING, self.owner]
+        if job_ids is not None:
+            job_ids = list(job_ids)
+            if not job_ids:
+                return
+            query += f" AND id IN ({', '.join('?' * len(job_ids))})"
+            parameters += job_ids
+        with self._lock:
+            self._db.execute(query, parameters)
+            self._db.commit()
+
+    def release(self):
+        """Put the jobs this store is running back in the queue; returns how many."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated = ? WHERE status = ? AND owner = ?",
+                (JOB_QUEUED, time.time(), JOB_RUNNING, self.owner)
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def finish(self, job_id, result):
+        self._set_outcome(job_id, JOB_DONE, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._set_outcome(job_id, JOB_FAILED, error=error)
+
+    def checkpoint(self, job_id):
+        """Return the JobCheckpoint that saves this job's progress."""
+        return JobCheckpoint(self, job_id)
+
+    def _set_outcome(self, job_id, status, result=None, error=None):
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ? AND owner = ?",
+                (status, result, error, time.time(), job_id, self.owner)
+            )
+            if cursor.rowcount:
+                # Saved steps are only needed to resume
+                self._db.execute("DELETE FROM job_steps WHERE job_id = ?", (job_id,))
+            # else the lease expired and the job went to another store, whose outcome counts
+            self._db.commit()
+
+    def _load_steps(self, job_id, kind):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT idx, record FROM job_steps WHERE job_id = ? AND kind = ?", (job_id, kind)
+            ).fetchall()
+        return {idx: json.loads(record) for idx, record in rows}
+
+    def _save_step(self, job_id, kind, idx, record):
+        with self._lock:
+            try:
+                # Checked first, in the same write transaction, so a job that went to another store is left alone
+                owned = self._db.execute(
+                    "UPDATE jobs SET updated = ? WHERE id = ? AND owner = ?", (time.time(), job_id, self.owner)
+                ).rowcount
+                if owned:
+                    added = self._db.execute(
+                        "INSERT OR IGNORE INTO job_steps (job_id, kind, idx, record) VALUES (?, ?, ?, ?)",
+                        (job_id, kind, idx, json.dumps(record))
+                    ).rowcount
+                    if added:
+                        self._db.execute("UPDATE jobs SET done = done + 1 WHERE id = ?", (job_id,))
+                    else:
+                        # A step saved again (e.g. redone after a resume) is not new progress
+                        self._db.execute(
+                            "UPDATE job_steps SET record = ? WHERE job_id = ? AND kind = ? AND idx = ?",
+                            (json.dumps(record), job_id, kind, idx)
+                        )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def _set_stage(self, job_id, stage, total, done):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET stage = ?, total = ?, done = ?, updated = ? WHERE id = ? AND owner = ?",
+                (stage, total, done, time.time(), job_id, self.owner)
+            )
+            self._db.commit()
+
+class JobCheckpoint:
+    """
+    Progress of one job, in the form detect_bugs_resumable expects.
+
+    Progress is saved in a thread. A save that fails is logged and skipped,
+    which only means the step is redone if the job has to resume.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.chunks = store._load_steps(job_id, "chunk")
+        self.fix_batches = store._load_steps(job_id, "fix")
+
+    async def _write(self, method, *args):
+        try:
+            await asyncio.to_thread(method, self.job_id, *args)
+        except sqlite3.Error as e:
+            logger.warning("Could not save the progress of job %s: %s", self.job_id, e)
+
+    async def begin(self, stage, total, done):
+        await self._write(self.store._set_stage, stage, total, done)
+
+    async def save_chunk(self, i, record):
+        await self._write(self.store._save_step, "chunk", i, record)
+
+    async def save_fix_batch(self, k, record):
+        await self._write(self.store._save_step, "fix", k, record)
+
+class WorkerPool:
+    """
+    Asyncio workers that run queued jobs.
+
+    Args:
+        store (JobStore): Where jobs come from and results go
+        workers (int): Number of jobs run at the same time
+        poll_interval (float): Seconds an idle worker waits before checking the queue again
+    """
+
+    # Longest pause after a database error, in seconds
+    MAX_BACKOFF = 30.0
+    # Attempts at recording a job's outcome before its lease is left to lapse
+    OUTCOME_ATTEMPTS = 5
+
+    def __init__(self, store, workers=2, poll_interval=1.0):
+        self.store = store
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._tasks = []
+        self._running = set()  # IDs of the jobs the workers are running, whose leases are renewed
+
+    @classmethod
+    def from_env(cls, store):
+        """Create a pool with FOAMAI_JOB_WORKERS workers (default 2)."""
+        return cls(store, workers=int(os.environ.get("FOAMAI_JOB_WORKERS", "2")))
+
+    def start(self):
+        """Start the workers (and the renewal of their leases)."""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._renew_leases()))
+
+    async def stop(self):
+        """Stop the workers and hand the jobs they were running back to the queue, to resume from their progress."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await asyncio.to_thread(self.store.release)
+
+    def notify(self):
+        """Wake idle workers, e.g. after a job was submitted."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _backoff(self, failures):
+        return min(self.MAX_BACKOFF, self.poll_interval * 2 ** failures)
+
+    async def _work(self):
+        failures = 0
+        while True:
+            # Clear before looking, so a job submitted in between still wakes us
+            self._wakeup.clear()
+            try:
+                # Waiting for another process's write lock must not block the event loop
+                claimed = await asyncio.to_thread(self.store.claim)
+            except sqlite3.Error as e:
+                logger.warning("Could not claim a job: %s", e)
+                await asyncio.sleep(self._backoff(failures))
+                failures += 1
+                continue
+            failures = 0
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, request = claimed
+            self._running.add(job_id)
+            try:
+                await self._run(job_id, request)
+            finally:
+                self._running.discard(job_id)
+
+    async def _run(self, job_id, request):
+        options = dict(request)
+        code_snippet = options.pop("code")
+        try:
+            checkpoint = await asyncio.to_thread(self.store.checkpoint, job_id)
+            result = await detect_bugs_resumable(code_snippet, checkpoint, **options)
+        except asyncio.CancelledError:
+            raise
+        except sqlite3.Error as e:
+            # Not the job's fault: leave it to be claimed again once its lease lapses
+            logger.warning("Could not load the progress of job %s: %s", job_id, e)
+            return
+        except Exception as e:
+            await self._record_outcome(job_id, self.store.fail, f"Error detecting bugs: {str(e)}")
+        else:
+            await self._record_outcome(job_id, self.store.finish, result)
+
+    async def _record_outcome(self, job_id, method, outcome):
+        for attempt in range(self.OUTCOME_ATTEMPTS):
+            try:
+                await asyncio.to_thread(method, job_id, outcome)
+                return
+            except sqlite3.Error as e:
+                logger.warning("Could not record the outcome of job %s: %s", job_id, e)
+                await asyncio.sleep(self._backoff(attempt))
+        # The job stops being renewed, so it is run again once its lease lapses
+        logger.error("Gave up recording the outcome of job %s", job_id)
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(self.store.lease / 3)
+            try:
+                await asyncio.to_thread(self.store.renew, set(self._running))
+            except sqlite3.Error as e:
+                # Retried at the next renewal, well before the lease lapses
+                logger.warning("Could not renew job leases: %s", e)
@@ -0,0 +1,213 @@
+"""
+Tolerant extraction of the JSON array in a model answer.
+
+Models do not always answer with bare JSON: the array may be wrapped in a
+code fence, surrounded by prose, use Python literals or trailing commas,
+or be cut off by the token limit. extract_json_array finds the array and
+repairs these problems locally, and validate_items keeps only the items
+that match the bug or fix schema, so an answer is thrown away (or the
+model asked again) only when nothing usable can be recovered.
+
+ArrayScanner does the finding incrementally, so a streamed answer can be
+recognized as complete as soon as its array closes.
+"""
+import ast
+import json
+import re
+
+class ExtractionError(ValueError):
+    """No usable JSON array could be recovered from an answer."""
+
+# Required and optional keys of the items each stage returns (see BugInfo and FixInfo in api.py;
+# batched prompts add the snippet each bug is in)
+SCHEMAS = {
+    "detect": (("type", "location", "description"), ()),
+    "fused": (("type", "location", "description"), ("fix",)),
+    "fix": (("bug", "suggestion"), ("bug_id",)),
+    "batch_detect": (("snippet", "type", "location", "description"), ()),
+    "batch_fused": (("snippet", "type", "location", "description"), ("fix",)),
+}
+
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PYTHON_LITERAL = re.compile(r"\b(True|False|None)\b")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+class ArrayScanner:
+    """
+    Find the first complete JSON array in text that arrives in pieces.
+
+    Brackets inside strings are ignored. A bracketed span that turns out not
+    to be an array of objects (e.g. "[see below]" or "[2]" in a preamble) is
+    skipped and the search continues after its opening bracket.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.array = None  # The loaded array once found
+        self.end = None  # Index in text just past the array once found
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._last_item_end = None  # End of the last complete item of the current array
+
+    @property
+    def done(self):
+        return self.array is not None
+
+    def feed(self, piece):
+        """Add the next piece of text; returns True once the array is complete."""
+        self.text += piece
+        while not self.done and self._pos < len(self.text):
+            self._step(self.text[self._pos])
+            self._pos += 1
+        return self.done
+
+    def _step(self, char):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+            return
+        if self._start is None:
+            if char == "[":
+                self._start = self._pos
+                self._depth = 1
+                self._last_item_end = None
+            return
+        if char == '"':
+            self._in_string = True
+        elif char in "[{":
+            self._depth += 1
+        elif char in "]}":
+            self._depth -= 1
+            if self._depth == 1 and char == "}":
+                self._last_item_end = self._pos
+            elif self._depth == 0:
+                array = _load_array(self.text[self._start:self._pos + 1])
+                if array is not None and all(isinstance(item, dict) for item in array):
+                    self.array = array
+                    self.end = self._pos + 1
+                else:
+                    # Not an array after all: look again from the next character
+                    self._pos = self._start
+                    self._start = None
+
+    def salvage(self):
+        """Return the complete items of an array that was cut off, or None."""
+        if self.done:
+            return self.array
+        if self._start is None or self._last_item_end is None:
+            return None
+        return _load_array(self.text[self._start:self._last_item_end + 1] + "]")
+
+def _load_array(candidate):
+    """Load a bracketed candidate as a list, repairing common formatting problems; None if it is not one."""
+    attempts = [
+        lambda: json.loads(candidate, strict=False),
+        lambda: json.loads(_repair(candidate), strict=False),
+        # Python list literals: single quotes, True/False/None
+        lambda: ast.literal_eval(candidate.translate(_SMART_QUOTES)),
+    ]
+    for attempt in attempts:
+        try:
+            value = attempt()
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+        if isinstance(value, list):
+            return value
+    return None
+
+def _repair(text):
+    text = text.translate(_SMART_QUOTES)
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    return _PYTHON_LITERAL.sub(lambda match: _PYTHON_LITERALS[match.group()], text)
+
+def _as_items(value):
+    """Interpret a parsed answer as a list of items, or None."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        lists = [item for item in value.values() if isinstance(item, list)]
+        if len(lists) == 1:
+            # A wrapper object such as {"bugs": [...]}
+            return lists[0]
+        if any(key in value for required, _ in SCHEMAS.values() for key in required):
+            # A single item without the array around it
+            return [value]
+    return None
+
+def extract_json_array(text):
+    """
+    Return the items of the JSON array in a model answer.
+
+    Bare JSON is parsed directly. Otherwise the first array in the answer
+    is used, after removing trailing commas and converting smart quotes and
+    Python literals; an array cut off before its end keeps its complete
+    items. A wrapper object ({"bugs": [...]}) or a single object is also
+    accepted.
+
+    Args:
+        text (str): The model's answer
+
+    Returns:
+        tuple: (list of items, True if the answer needed any repair)
+
+    Raises:
+        ExtractionError: If no array can be recovered
+    """
+    try:
+        items = _as_items(json.loads(text))
+        if items is not None:
+            return items, False
+    except json.JSONDecodeError:
+        pass
+
+    scanner = ArrayScanner()
+    scanner.feed(text)
+    items = scanner.salvage()
+    if items is not None:
+        return items, True
+    # A lone object, possibly surrounded by prose
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            items = _as_items(json.loads(_repair(text[start:end + 1]), strict=False))
+        except json.JSONDecodeError:
+            items = None
+        if items is not None:
+            return items, True
+    raise ExtractionError("No JSON array found in the answer")
+
+def validate_items(items, stage):
+    """
+    Keep the items that match the stage's schema.
+
+    Items must be objects with every required key set. Values of known keys
+    are converted to strings; other keys are dropped.
+
+    Returns:
+        tuple: (valid items, number of items dropped)
+    """
+    required, optional = SCHEMAS[stage]
+    valid = []
+    for item in items:
+        if not isinstance(item, dict) or any(item.get(key) is None for key in required):
+            continue
+        valid.append({
+            key: _as_text(value) for key, value in item.items()
+            if key in required or (key in optional and value is not None)
+        })
+    return valid, len(items) - len(valid)
+
+def _as_text(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
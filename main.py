@@ -1,43 +1,99 @@
 import os
+import asyncio
+import functools
+import keyword
+import re
+import time
 from dotenv import load_dotenv
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+from concurrent.futures import ThreadPoolExecutor
 import json
-import re
+from cache import ResultCache, make_cache_key
+from metrics import (ANALYSIS_CHUNKS, CACHE_LOOKUPS, DEADLINE_EXCEEDED, JSON_PARSE_FAILURES, JSON_REPAIRS,
+                     LLM_BATCH_SIZE, LLM_CALL_DURATION, LLM_CALLS, LLM_ITEMS_REJECTED, LLM_TOKENS, SIMILARITY_LOOKUPS,
+                     STAGE_DURATION)
+from chunking import (DEFAULT_MAX_LENGTH, Chunk, chunk_code, location_lines, relocate_location, relocate_text,
+                      shift_location, shift_text)
+from incremental import DocumentStore, split_units
+from ratelimit import RateLimiter
+from batching import MicroBatcher
+from singleflight import SingleFlight
+from cassette import CassetteMiss
+from similarity import SimilarityIndex
+from normalize import normalize_code, to_original_lines
+from json_extract import SCHEMAS, ArrayScanner, ExtractionError, extract_json_array, validate_items
+from static_analysis import STATIC_MODES, STATIC_OFF, STATIC_TRUST, analyze_code
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Verify the API key is available
-api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables")
-
-# Now create the OpenAI instance with the key from environment variables
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.3)
-
-# Chunking function
-def chunk_code(code, max_length=500):
-    if len(code) <= max_length:
-        return [code]
-    lines = code.split("\n")
-    chunks = []
-    current_chunk = ""
-    for line in lines:
-        if len(current_chunk) + len(line) > max_length and current_chunk:
-            chunks.append(current_chunk)
-            current_chunk = line
-        else:
-            current_chunk += "\n" + line if current_chunk else line
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
+# Model settings (also part of every cache key)
+MODEL_NAME = "gpt-3.5-turbo"
+TEMPERATURE = 0.3
+
+# Chat model backend, see backends.py (part of every cache key except for "openai")
+BACKEND = os.environ.get("FOAMAI_BACKEND", "openai")
+
+# The chat model and the chains around it (llm, detect_chain, fix_chain,
+# fused_chain, repair_chain) are built on first use by _chains(), or by use_llm, so that
+# importing this module is fast and does not need an API key
+_chains_by_stage = None
+
+# Maximum number of LLM calls allowed in flight at once for a single analysis
+MAX_CONCURRENCY = int(os.environ.get("FOAMAI_MAX_CONCURRENCY", "5"))
+
+# Worker threads for chat models that only implement blocking calls; shared
+# by every analysis, so it also bounds the blocking calls across API requests
+SYNC_WORKERS = int(os.environ.get("FOAMAI_SYNC_WORKERS", "8"))
+_sync_executor = None
+
+# Cache of chain completions shared by every analysis (None when disabled).
+# The module attribute result_cache is created on first use, see _get_result_cache
+
+# Detection answers reused for near-duplicate chunks, e.g. copies with renamed
+# variables (None unless FOAMAI_SIMILARITY_THRESHOLD is set, see similarity.py).
+# The module attribute similarity_index is created on first use, see _get_similarity_index
+SIMILARITY_STAGES = ("detect", "fused")
+
+# Request and token budgets, adaptive concurrency and retries applied to every
+# LLM call of the process (created on first use, see ratelimit.py)
+_rate_limiter = None
 
-# Prompt Templates with structured output format
-detect_prompt = PromptTemplate(
-    input_variables=["code"],
-    template="""Analyze this Python code for common bugs:
+# Results of the last analysis of each document, for detect_bugs_incremental
+# (created on first use from FOAMAI_DOCUMENTS_PATH)
+_document_store = None
+
+# Character budget for a single chunk sent to the LLM
+CHUNK_SIZE = int(os.environ.get("FOAMAI_CHUNK_SIZE", str(DEFAULT_MAX_LENGTH)))
+
+# Default static pre-analysis mode: "off", "prefilter" or "trust" (see static_analysis.py)
+STATIC_ANALYSIS = os.environ.get("FOAMAI_STATIC_ANALYSIS", "prefilter")
+
+# Budget for a single fix_chain call: bugs are batched up to this many
+# characters of bug JSON and this many bugs per call
+FIX_BATCH_CHARS = int(os.environ.get("FOAMAI_FIX_BATCH_CHARS", "8000"))
+FIX_BATCH_SIZE = int(os.environ.get("FOAMAI_FIX_BATCH_SIZE", "25"))
+
+# Pipeline modes: detect and fix in separate calls, or both in one call per chunk
+MODE_TWO_STAGE = "two_stage"
+MODE_FUSED = "fused"
+PIPELINE_MODES = (MODE_TWO_STAGE, MODE_FUSED)
+DEFAULT_MODE = os.environ.get("FOAMAI_MODE", MODE_TWO_STAGE)
+
+# Answers that cannot be repaired locally are sent back to the model with a
+# request to reformat them, at most this many times per answer (0 disables)
+REASK_ATTEMPTS = int(os.environ.get("FOAMAI_REASK_ATTEMPTS", "1"))
+
+# Stages whose calls can be batched, and the stage of the multi-snippet prompt for each.
+# Batching is off unless enable_batching is called (the API does on startup)
+BATCHED_STAGES = {"detect": "batch_detect", "fused": "batch_fused"}
+_batcher = None
+
+# Chain calls in flight, shared by identical calls of every analysis
+_inflight_calls = SingleFlight("call")
+
+# Prompt Templates with structured output format. The PromptTemplate objects
+# (detect_prompt, fix_prompt, fused_prompt, repair_prompt) are built on first use by _prompts()
+DETECT_TEMPLATE = """Analyze this Python code for common bugs:
 
 {code}
 
@@ -50,7 +106,7 @@ Identify bugs such as:
 
 For each bug found, provide:
 1. Bug type
-2. Location (line number or function)
+2. Location (line number or function), counting the first line of the code above as line 1
 3. Description of the issue
 
 Format your response as a JSON array of objects with the following structure:
@@ -65,17 +121,15 @@ Format your response as a JSON array of objects with the following structure:
 
 If no bugs are found, return an empty array: []
 """
-)
 
-fix_prompt = PromptTemplate(
-    input_variables=["bugs"],
-    template="""Given these detected bugs:
+FIX_TEMPLATE = """Given these detected bugs, each identified by an "id":
 
 {bugs}
 
-Suggest fixes for each bug. Format your response as a JSON array of objects with the following structure:
+Suggest a fix for each bug. Format your response as a JSON array with one object per bug, using the following structure:
 [
   {{
+    "bug_id": "id of the bug this fix is for",
     "bug": "brief description of the bug",
     "suggestion": "detailed fix instructions"
   }},
@@ -84,86 +138,1299 @@ Suggest fixes for each bug. Format your response as a JSON array of objects with
 
 If no fixes are needed, return an empty array: []
 """
-)
 
-# Create chains using the LangChain structure
-detect_chain = detect_prompt | llm | StrOutputParser()
-fix_chain = fix_prompt | llm | StrOutputParser()
+FUSED_TEMPLATE = """Analyze this Python code for common bugs and suggest a fix for each one:
+
+{code}
+
+Identify bugs such as:
+- Uninitialized variables
+- Infinite loops
+- Unreachable code
+- Type errors
+- Logic errors
+
+For each bug found, provide:
+1. Bug type
+2. Location (line number or function), counting the first line of the code above as line 1
+3. Description of the issue
+4. Detailed fix instructions
+
+Format your response as a JSON array of objects with the following structure:
+[
+  {{
+    "type": "bug type",
+    "location": "line number or function",
+    "description": "detailed description",
+    "fix": "detailed fix instructions"
+  }},
+  ...
+]
+
+If no bugs are found, return an empty array: []
+"""
+
+# Multi-snippet prompts for chunks batched across concurrent analyses (see enable_batching)
+BATCH_DETECT_TEMPLATE = """Analyze each of these independent Python code snippets for common bugs:
+
+{snippets}
+
+Identify bugs such as:
+- Uninitialized variables
+- Infinite loops
+- Unreachable code
+- Type errors
+- Logic errors
+
+For each bug found, provide:
+1. The id of the snippet it is in
+2. Bug type
+3. Location (line number or function), counting the first line of its snippet as line 1
+4. Description of the issue
+
+Format your response as a JSON array of objects with the following structure:
+[
+  {{
+    "snippet": "snippet id",
+    "type": "bug type",
+    "location": "line number or function",
+    "description": "detailed description"
+  }},
+  ...
+]
+
+If no bugs are found, return an empty array: []
+"""
+
+BATCH_FUSED_TEMPLATE = """Analyze each of these independent Python code snippets for common bugs and suggest a fix for each one:
+
+{snippets}
+
+Identify bugs such as:
+- Uninitialized variables
+- Infinite loops
+- Unreachable code
+- Type errors
+- Logic errors
+
+For each bug found, provide:
+1. The id of the snippet it is in
+2. Bug type
+3. Location (line number or function), counting the first line of its snippet as line 1
+4. Description of the issue
+5. Detailed fix instructions
+
+Format your response as a JSON array of objects with the following structure:
+[
+  {{
+    "snippet": "snippet id",
+    "type": "bug type",
+    "location": "line number or function",
+    "description": "detailed description",
+    "fix": "detailed fix instructions"
+  }},
+  ...
+]
+
+If no bugs are found, return an empty array: []
+"""
+
+REPAIR_TEMPLATE = """This answer was supposed to be a JSON array, but it could not be parsed:
+
+{answer}
+
+Rewrite it as a valid JSON array of objects with the keys {keys}, keeping every item of the answer.
+Return only the JSON array, without code fences or any other text. If the answer has no items, return []
+"""
+
+# Template text and input variables per stage
+_TEMPLATES = {
+    "detect": (DETECT_TEMPLATE, ["code"]),
+    "fix": (FIX_TEMPLATE, ["bugs"]),
+    "fused": (FUSED_TEMPLATE, ["code"]),
+    "repair": (REPAIR_TEMPLATE, ["answer", "keys"]),
+    "batch_detect": (BATCH_DETECT_TEMPLATE, ["snippets"]),
+    "batch_fused": (BATCH_FUSED_TEMPLATE, ["snippets"]),
+}
+_prompts_by_stage = None
+
+def _prompts():
+    """Return the PromptTemplate for each stage, building them the first time."""
+    global detect_prompt, fix_prompt, fused_prompt, repair_prompt, _prompts_by_stage
+    if _prompts_by_stage is None:
+        from langchain_core.prompts import PromptTemplate
+
+        _prompts_by_stage = {
+            stage: PromptTemplate(input_variables=variables, template=template)
+            for stage, (template, variables) in _TEMPLATES.items()
+        }
+        detect_prompt = _prompts_by_stage["detect"]
+        fix_prompt = _prompts_by_stage["fix"]
+        fused_prompt = _prompts_by_stage["fused"]
+        repair_prompt = _prompts_by_stage["repair"]
+    return _prompts_by_stage
+
+def _has_native_async(model):
+    """True if the model implements its own async call instead of LangChain's thread fallback."""
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.runnables import Runnable
+
+    if isinstance(model, BaseChatModel):
+        return (type(model)._agenerate is not BaseChatModel._agenerate
+                or type(model)._astream is not BaseChatModel._astream)
+    return type(model).ainvoke is not Runnable.ainvoke
+
+def use_llm(model, backend=None):
+    """
+    Build (or rebuild) every chain around the given chat model.
+
+    Benchmarks use this to swap in a fake model without touching the chains.
+
+    Args:
+        model: The chat model
+        backend (str): Name that keeps this model's cached results apart from
+            other backends' (defaults to the model's _llm_type)
+    """
+    from langchain_core.output_parsers import StrOutputParser
+
+    global BACKEND, llm, llm_is_async, detect_chain, fix_chain, fused_chain, repair_chain, _chains_by_stage
+    prompts = _prompts()
+    BACKEND = backend or getattr(model, "_llm_type", type(model).__name__)
+    llm = model
+    llm_is_async = _has_native_async(model)
+    detect_chain = prompts["detect"] | llm | StrOutputParser()
+    fix_chain = prompts["fix"] | llm | StrOutputParser()
+    fused_chain = prompts["fused"] | llm | StrOutputParser()
+    repair_chain = prompts["repair"] | llm | StrOutputParser()
+    _chains_by_stage = {"detect": detect_chain, "fix": fix_chain, "fused": fused_chain, "repair": repair_chain}
+    for stage in BATCHED_STAGES.values():
+        _chains_by_stage[stage] = prompts[stage] | llm | StrOutputParser()
+
+def _chains():
+    """Return the chains by stage, creating the BACKEND model the first time."""
+    if _chains_by_stage is None:
+        from backends import create_llm
+
+        use_llm(create_llm(BACKEND, model_name=MODEL_NAME, temperature=TEMPERATURE), BACKEND)
+    return _chains_by_stage
+
+def _model_key():
+    """Model identity for cache keys; "openai" keeps the keys it had before backends were pluggable."""
+    return MODEL_NAME if BACKEND == "openai" else f"{BACKEND}:{MODEL_NAME}"
+
+def __getattr__(name):
+    # Module attributes created lazily by _prompts() and _chains()
+    if name in ("detect_prompt", "fix_prompt", "fused_prompt", "repair_prompt"):
+        _prompts()
+        return globals()[name]
+    if name in ("llm", "llm_is_async", "detect_chain", "fix_chain", "fused_chain", "repair_chain"):
+        _chains()
+        return globals()[name]
+    # Opening them touches SQLite files, so not at import either
+    if name == "result_cache":
+        return _get_result_cache()
+    if name == "similarity_index":
+        return _get_similarity_index()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _unit_chunks(code, strip_comments=False, offset=0):
+    """
+    Normalize code (see normalize.py) and split it into chunks for the LLM.
+
+    The chunks' lines refer to the original code, moved down by offset lines.
+    """
+    normalized = normalize_code(code, strip_comments)
+    return [to_original_lines(chunk, normalized.line_map, offset) for chunk in chunk_code(normalized.text, CHUNK_SIZE)]
+
+def _renumber(chunk, numbers, first_line):
+    """
+    Move a chunk of text made of non-contiguous lines of a file to the file's lines.
+
+    Args:
+        chunk (Chunk): A chunk of the text
+        numbers (tuple): The file line of every line of the text
+        first_line (int): The first line the chunk is for; lines above it only give context
+    """
+    lines = tuple(numbers[line - 1] for line in chunk.lines or range(chunk.start_line, chunk.end_line + 1))
+    return Chunk(chunk.text, max(numbers[chunk.start_line - 1], first_line), lines)
+
+def _prepare_chunks(code_snippet, strip_comments=False):
+    """Canonicalize the code, optionally without comments and docstrings, and split it into chunks for the LLM."""
+    with STAGE_DURATION.time(stage="chunking"):
+        # Comments are optionally stripped to avoid biasing the LLM
+        chunks = _unit_chunks(code_snippet, strip_comments)
+    ANALYSIS_CHUNKS.observe(len(chunks))
+    return chunks
+
+def _static_report(code_snippet):
+    """Run the static analyzer over the whole file."""
+    with STAGE_DURATION.time(stage="static_analysis"):
+        return analyze_code(code_snippet)
+
+def _parse_json(raw, stage):
+    """
+    Extract the items of an LLM answer and keep those matching the stage's schema.
+
+    Formatting problems are repaired locally (see json_extract.py); failures,
+    repairs and rejected items are counted for the stage's chain.
+
+    Raises:
+        ExtractionError: If the answer holds no array, or none of its items are valid
+    """
+    with STAGE_DURATION.time(stage="parse"):
+        try:
+            items, repaired = extract_json_array(raw)
+        except ExtractionError:
+            JSON_PARSE_FAILURES.inc(chain=stage)
+            raise
+        valid, rejected = validate_items(items, stage)
+    if repaired:
+        JSON_REPAIRS.inc(chain=stage, method="local")
+    if rejected:
+        LLM_ITEMS_REJECTED.inc(rejected, chain=stage)
+        if not valid:
+            JSON_PARSE_FAILURES.inc(chain=stage)
+            raise ExtractionError(f"None of the {rejected} items match the {stage} schema")
+    return valid
+
+async def _parse_answer(raw, stage, calls, use_cache=True):
+    """
+    Parse an LLM answer like _parse_json, asking the model to reformat it as a last resort.
+
+    An answer that cannot be repaired locally is sent to the repair chain,
+    together with the keys its items need, up to REASK_ATTEMPTS times.
+    """
+    required, optional = SCHEMAS[stage]
+    for attempt in range(REASK_ATTEMPTS + 1):
+        try:
+            items = _parse_json(raw, stage)
+        except ExtractionError:
+            if attempt == REASK_ATTEMPTS:
+                raise
+        else:
+            if attempt:
+                JSON_REPAIRS.inc(chain=stage, method="reask")
+            return items
+        try:
+            raw = await calls.invoke("repair", {"answer": raw, "keys": ", ".join(required + optional)}, use_cache)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            raise ExtractionError(f"Re-asking the model failed: {str(e)}") from e
+
+def _is_usable(text):
+    """True if an answer holds a JSON array, i.e. is worth caching."""
+    try:
+        extract_json_array(text)
+        return True
+    except ExtractionError:
+        return False
+
+def _get_sync_executor():
+    global _sync_executor
+    if _sync_executor is None:
+        _sync_executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="foamai-llm")
+    return _sync_executor
+
+def _get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter.from_env()
+    return _rate_limiter
+
+def _get_result_cache():
+    # Not a None check: None means caching is disabled
+    if "result_cache" not in globals():
+        globals()["result_cache"] = ResultCache.from_env()
+    return globals()["result_cache"]
+
+def _get_similarity_index():
+    if "similarity_index" not in globals():
+        globals()["similarity_index"] = SimilarityIndex.from_env()
+    return globals()["similarity_index"]
+
+def _get_document_store():
+    global _document_store
+    if _document_store is None:
+        _document_store = DocumentStore.from_env()
+    return _document_store
+
+def _token_usage(response):
+    """Return (prompt tokens, completion tokens) reported in an LLMResult."""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if not (prompt_tokens or completion_tokens) and response.llm_output:
+        # Older integrations only report usage here
+        usage = response.llm_output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+_usage_recorders = {}
+
+def _usage_recorder(stage):
+    """Return the callback handler that counts the tokens used by a stage's calls."""
+    if stage not in _usage_recorders:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class UsageRecorder(BaseCallbackHandler):
+            run_inline = True
+
+            def on_llm_end(self, response, **kwargs):
+                _record_usage(stage, *_token_usage(response))
+
+        _usage_recorders[stage] = UsageRecorder()
+    return _usage_recorders[stage]
+
+def _record_usage(stage, prompt_tokens, completion_tokens):
+    LLM_TOKENS.inc(prompt_tokens, chain=stage, direction="prompt")
+    LLM_TOKENS.inc(completion_tokens, chain=stage, direction="completion")
+
+async def _astream_answer(stage, inputs):
+    """
+    Stream a stage's answer, stopping as soon as it holds a complete JSON array.
+
+    Models like to follow the array with explanations nobody reads; closing
+    the stream early saves the time and completion tokens they take. The
+    model is streamed directly rather than through the chain, because
+    closing a chain's stream early leaves the model's HTTP response open.
+
+    Token usage is taken from the chunks themselves: after the array, the
+    stream is read on while it only carries metadata, since that is where
+    usage arrives (e.g. OpenAI's final chunk). If the model goes on writing
+    text instead, the stream is closed and usage is estimated from the
+    text's length.
+    """
+    prompt = await _prompts()[stage].ainvoke(inputs)
+    scanner = ArrayScanner()
+    usage = None
+    stream = llm.astream(prompt)
+    try:
+        async for message in stream:
+            if message.usage_metadata:
+                usage = usage or {"input_tokens": 0, "output_tokens": 0}
+                usage["input_tokens"] += message.usage_metadata.get("input_tokens", 0)
+                usage["output_tokens"] += message.usage_metadata.get("output_tokens", 0)
+            text = message.content if isinstance(message.content, str) else ""
+            if scanner.done:
+                if text.strip():
+                    break
+            elif text:
+                scanner.feed(text)
+    finally:
+        await stream.aclose()
+    if usage is not None:
+        _record_usage(stage, usage["input_tokens"], usage["output_tokens"])
+    else:
+        # About 4 characters per token
+        _record_usage(stage, len(prompt.to_string()) // 4, len(scanner.text) // 4)
+    return scanner.text[:scanner.end] if scanner.done else scanner.text
+
+async def _call_llm(stage, inputs):
+    """
+    Make one chain call for a stage, within the process-wide rate limits
+    (retrying throttled and transient failures, see ratelimit.py).
+
+    Models with a native async implementation are streamed (see
+    _astream_answer); blocking ones run on the shared pool of SYNC_WORKERS
+    threads, with their token usage counted by _usage_recorder.
+    """
+    chain = _chains()[stage]
+
+    async def call():
+        if llm_is_async:
+            return await _astream_answer(stage, inputs)
+        # Blocking backend: keep it off the event loop, on a pool of bounded size
+        config = {"callbacks": [_usage_recorder(stage)]}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_sync_executor(),
+                                          functools.partial(chain.invoke, inputs, config=config))
+
+    # About 4 characters per token
+    prompt_tokens = (len(_TEMPLATES[stage][0]) + sum(len(str(value)) for value in inputs.values())) // 4
+    started = time.perf_counter()
+    try:
+        result = await _get_rate_limiter().call(call, prompt_tokens, stage)
+    except Exception:
+        LLM_CALL_DURATION.observe(time.perf_counter() - started, chain=stage)
+        LLM_CALLS.inc(chain=stage, outcome="error")
+        raise
+    LLM_CALL_DURATION.observe(time.perf_counter() - started, chain=stage)
+    LLM_CALLS.inc(chain=stage, outcome="ok")
+    return result
+
+def _snippet_id(index):
+    return f"S{index + 1}"
+
+async def _run_batch(stage, batch):
+    """
+    Answer the inputs of several calls of a stage with one multi-snippet prompt.
+
+    The answer is split by snippet ID into one answer per call, in the
+    format of the stage's own prompt. If it holds nothing usable, every
+    snippet is sent on its own instead.
+
+    Args:
+        stage (str): "detect" or "fused"
+        batch (list): The inputs of each call
+
+    Returns:
+        list: One answer (or exception) per call
+    """
+    if len(batch) == 1:
+        return [await _call_llm(stage, batch[0])]
+    batch_stage = BATCHED_STAGES[stage]
+    LLM_BATCH_SIZE.observe(len(batch), chain=stage)
+    snippets = "\n\n".join(
+        f'<snippet id="{_snippet_id(index)}">\n{inputs["code"]}\n</snippet>' for index, inputs in enumerate(batch)
+    )
+    try:
+        raw = await _call_llm(batch_stage, {"snippets": snippets})
+        items = _parse_json(raw, batch_stage)
+    except (ExtractionError, CassetteMiss):
+        # Nothing usable, or a grouping the replayed cassette never recorded: send each snippet on its own
+        return await asyncio.gather(*(_call_llm(stage, inputs) for inputs in batch), return_exceptions=True)
+
+    answers = {_snippet_id(index): [] for index in range(len(batch))}
+    unknown = 0
+    for item in items:
+        snippet = item.pop("snippet").strip()
+        # Tolerate "1" for "S1"
+        snippet = _snippet_id(int(snippet) - 1) if snippet.isdigit() else snippet.upper()
+        if snippet in answers:
+            answers[snippet].append(item)
+        else:
+            unknown += 1
+    if unknown:
+        LLM_ITEMS_REJECTED.inc(unknown, chain=batch_stage)
+    return [json.dumps(answers[_snippet_id(index)]) for index in range(len(batch))]
+
+def enable_batching(window=None, max_size=None, max_chars=None):
+    """
+    Batch detect and fused calls made at about the same time, e.g. by concurrent API requests.
+
+    Calls arriving within window seconds of the first are packed into one
+    multi-snippet prompt, up to max_size snippets and max_chars characters
+    of code, and its answer is split back per call (see _run_batch). A
+    call that arrives alone is made as usual.
+
+    Args:
+        window (float): Seconds to wait for more calls (defaults to
+            FOAMAI_BATCH_WINDOW_MS / 1000, default 10 ms; 0 turns batching off)
+        max_size (int): Most calls per batch (defaults to FOAMAI_BATCH_MAX_SIZE, default 8)
+        max_chars (int): Most characters of code per batch (defaults to
+            FOAMAI_BATCH_MAX_CHARS, default twice FOAMAI_CHUNK_SIZE)
+    """
+    global _batcher
+    if window is None:
+        window = float(os.environ.get("FOAMAI_BATCH_WINDOW_MS", "10")) / 1000
+    if max_size is None:
+        max_size = int(os.environ.get("FOAMAI_BATCH_MAX_SIZE", "8"))
+    if max_chars is None:
+        max_chars = int(os.environ.get("FOAMAI_BATCH_MAX_CHARS", str(2 * CHUNK_SIZE)))
+    if window <= 0 or max_size <= 1:
+        _batcher = None
+        return
+    _batcher = MicroBatcher(_run_batch, window, max_size, max_chars, size=lambda inputs: len(inputs["code"]))
+
+async def _ainvoke(stage, inputs, semaphore, use_cache=True):
+    """
+    Invoke the chain for a stage ("detect", "fix" or "fused") asynchronously
+    while holding one of the concurrency slots (see _call_llm). With
+    batching enabled, detect and fused calls may share one prompt with
+    other calls made at the same time (see enable_batching).
+
+    Completions are looked up in and stored to result_cache, keyed on the
+    inputs, the prompt template and the model settings. The same key and
+    use_cache coalesce identical calls in flight at the same time (see
+    singleflight.py): a call that would cache its answer never waits on one
+    that won't, so joining a flight never leaves an answer uncached.
+    A detect or fused call that misses the cache may reuse the answer for
+    a near-duplicate chunk from similarity_index instead.
+    """
+    key = make_cache_key(inputs, _TEMPLATES[stage][0], _model_key(), TEMPERATURE)
+    cache = _get_result_cache() if use_cache else None
+    similar = _get_similarity_index() if use_cache and stage in SIMILARITY_STAGES else None
+    if cache is not None:
+        # The stores are SQLite databases; their queries and commits stay off the event loop
+        cached = await asyncio.to_thread(cache.get, key)
+        CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+    if similar is not None:
+        # Entries are only shared by calls with the same prompt template and model
+        scope = make_cache_key({}, _TEMPLATES[stage][0], _model_key(), TEMPERATURE)
+        with STAGE_DURATION.time(stage="similarity"):
+            reused, outcome = await asyncio.to_thread(similar.reuse, scope, inputs["code"])
+        SIMILARITY_LOOKUPS.inc(chain=stage, result=outcome)
+        if reused is not None:
+            return reused
+
+    async def call():
+        async with semaphore:
+            if _batcher is not None and stage in BATCHED_STAGES:
+                result = await _batcher.submit(stage, inputs)
+            else:
+                result = await _call_llm(stage, inputs)
+        # Only cache answers we can use; a malformed completion deserves a retry
+        if _is_usable(result):
+            if cache is not None:
+                await asyncio.to_thread(cache.set, key, result)
+            if similar is not None:
+                await asyncio.to_thread(similar.add, scope, inputs["code"], result)
+        return result
+
+    # An identical call already in flight (from any analysis) is joined instead of repeated
+    return await _inflight_calls.do((key, use_cache), call)
+
+class DeadlineExceeded(TimeoutError):
+    """The deadline of the analysis passed before a chain call could finish."""
+
+class CallGroup:
+    """
+    The LLM calls made on behalf of one or more analyses.
+
+    Every call in the group shares one concurrency limit. With dedupe=True,
+    identical chain calls are made once and every caller gets the result,
+    which is how a batch analyzes each distinct chunk only once. With a
+    deadline, calls still running when it passes are cancelled and raise
+    DeadlineExceeded, as do calls made after it.
+
+    Args:
+        max_concurrency (int): Maximum number of LLM calls in flight at once
+            (defaults to FOAMAI_MAX_CONCURRENCY)
+        dedupe (bool): Whether to share the results of identical calls
+        deadline (float): time.monotonic() by which every call must be done, or None
+    """
+
+    def __init__(self, max_concurrency=None, dedupe=False, deadline=None):
+        self.semaphore = asyncio.Semaphore(max_concurrency or MAX_CONCURRENCY)
+        self.pending = {} if dedupe else None
+        self.requested = 0
+        self.deadline = deadline
+        self.expired = False  # Set once a call was cut short by the deadline
+
+    async def invoke(self, stage, inputs, use_cache=True):
+        """Invoke a stage's chain through the group, within its deadline; see _ainvoke."""
+        if self.deadline is None:
+            return await self._invoke(stage, inputs, use_cache)
+        remaining = self.deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            return await asyncio.wait_for(self._invoke(stage, inputs, use_cache), remaining)
+        except asyncio.TimeoutError:
+            self.expired = True
+            DEADLINE_EXCEEDED.inc(chain=stage)
+            raise DeadlineExceeded(f"Deadline passed before the {stage} call finished") from None
+
+    async def _invoke(self, stage, inputs, use_cache):
+        self.requested += 1
+        if self.pending is None:
+            return await _ainvoke(stage, inputs, self.semaphore, use_cache)
+
+        key = (make_cache_key(inputs, _TEMPLATES[stage][0], _model_key(), TEMPERATURE), use_cache)
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(_ainvoke(stage, inputs, self.semaphore, use_cache))
+            self.pending[key] = task
+        # Shielded so that one caller giving up does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    @property
+    def unique(self):
+        """Number of distinct calls made so far (all of them when not deduplicating)."""
+        return self.requested if self.pending is None else len(self.pending)
+
+    def close(self):
+        """Cancel shared calls nobody is waiting for any more."""
+        for task in (self.pending or {}).values():
+            if not task.done():
+                task.cancel()
+
+# An LLM bug spanning at most this many lines is about the same code as a static finding it overlaps
+_SAME_FINDING_LINES = 3
+
+# Names a static finding quotes ('total', `while i < 10`)
+_QUOTED = re.compile(r"'([^']+)'|`([^`]+)`")
+
+def _finding_names(static_bug):
+    """The identifiers quoted in a static finding's description."""
+    names = set()
+    for match in _QUOTED.finditer(static_bug.get("description", "")):
+        names.update(name for name in re.findall(r"[A-Za-z_]\w*", match.group(1) or match.group(2))
+                     if not keyword.iskeyword(name))
+    return names
+
+def _same_finding(static_bug, bug):
+    """
+    Whether an LLM bug repeats a static finding.
+
+    It must have the finding's type and overlap its lines, and either span
+    only a few lines or name an identifier the finding quotes; a bug
+    reported for a broad range may be about other code in it.
+    """
+    if str(bug.get("type", "")).lower() != static_bug["type"].lower():
+        return False
+    static_lines = location_lines(static_bug["location"])
+    lines = location_lines(bug.get("location", ""))
+    if static_lines is None or lines is None:
+        return static_bug["location"] == bug.get("location")
+    if not (lines[0] <= static_lines[1] and static_lines[0] <= lines[1]):
+        return False
+    if lines[1] - lines[0] < _SAME_FINDING_LINES:
+        return True
+    text = f"{bug.get('location', '')} {bug.get('description', '')}"
+    return any(re.search(rf"\b{re.escape(name)}\b", text) for name in _finding_names(static_bug))
+
+def _merge_findings(static_pairs, llm_pairs):
+    """Combine static and LLM (bug, fix) pairs, dropping LLM bugs the static pass already reported."""
+    merged = list(static_pairs)
+    for bug, fix in llm_pairs:
+        if not any(_same_finding(static_bug, bug) for static_bug, _ in static_pairs):
+            merged.append((bug, fix))
+    return merged
+
+def cache_stats():
+    """Return the result cache hit/miss counters, or None if caching is disabled."""
+    cache = _get_result_cache()
+    return cache.stats() if cache is not None else None
+
+# Marks bugs that should not be sent to the fix stage (pipeline errors, unparseable output)
+_NO_FIX = object()
+
+def _incomplete_chunk(i, chunk):
+    """The (bug, fix) pair standing in for a chunk the deadline cut short."""
+    return ({
+        "type": "Incomplete",
+        "location": relocate_location("", chunk),
+        "description": f"Chunk {i+1} was not analyzed: the deadline passed first"
+    }, _NO_FIX)
+
+async def _detect_chunk(i, chunk, calls, use_cache=True, report=None, static_mode=STATIC_OFF,
+                        mode=MODE_TWO_STAGE):
+    """
+    Detect bugs in a single chunk.
+
+    When a static report is given, its findings for the chunk are included,
+    and the LLM is skipped for chunks the static pass considers clean (or,
+    in "trust" mode, already explained by its findings). In fused mode the
+    fused_chain returns each bug together with its fix.
+
+    Returns:
+        list: (bug, fix) pairs; fix is None when the fix stage should suggest one
+    """
+    fused = mode == MODE_FUSED
+    static_pairs = []
+    if report is not None:
+        findings = report.findings_between(chunk.start_line, chunk.end_line)
+        if not findings and report.is_clean(chunk.start_line, chunk.end_line):
+            return []
+        if findings and static_mode == STATIC_TRUST:
+            return [(finding.to_bug(), finding.to_fix()) for finding in findings]
+        # A fused call cannot be asked to fix static findings, so use the static suggestions
+        static_pairs = [(finding.to_bug(), finding.to_fix() if fused else None) for finding in findings]
+
+    try:
+        bugs_raw = await calls.invoke("fused" if fused else "detect", {"code": chunk.text}, use_cache)
+    except DeadlineExceeded:
+        return static_pairs + [_incomplete_chunk(i, chunk)]
+    except Exception as e:
+        error_msg = f"Error processing chunk {i+1}: {str(e)}"
+        return static_pairs + [({
+            "type": "Error",
+            "location": relocate_location("", chunk),
+            "description": error_msg
+        }, _NO_FIX)]
+
+    # Extract the bugs, repairing the answer's format if needed
+    try:
+        llm_bugs = await _parse_answer(bugs_raw, "fused" if fused else "detect", calls, use_cache)
+    except DeadlineExceeded:
+        return static_pairs + [_incomplete_chunk(i, chunk)]
+    except ExtractionError:
+        # Fallback if JSON parsing fails - log error but don't print in API mode
+        error_msg = f"Could not parse bugs as JSON. Raw output: {bugs_raw[:100]}..."
+        return static_pairs + [({
+            "type": "Unknown",
+            "location": relocate_location("", chunk),
+            "description": f"Error parsing output: {error_msg}"
+        }, _NO_FIX)]
+
+    llm_pairs = []
+    for bug in llm_bugs:
+        # Map chunk-relative locations, and lines the text refers to, back to lines of the original code
+        bug["location"] = relocate_location(bug.get("location", ""), chunk)
+        for field in ("description", "fix"):
+            if field in bug:
+                bug[field] = relocate_text(bug[field], chunk)
+        fix = None
+        if fused and bug.get("fix"):
+            fix = {"bug": bug.get("description", ""), "suggestion": bug.pop("fix")}
+        bug.pop("fix", None)
+        llm_pairs.append((bug, fix))
+    return _merge_findings(static_pairs, llm_pairs)
+
+def _fix_batches(bugs):
+    """Split bugs into batches that fit the fix_chain budget, keeping their order."""
+    batches = []
+    current = []
+    current_chars = 0
+    for bug in bugs:
+        size = len(json.dumps(bug))
+        if current and (current_chars + size > FIX_BATCH_CHARS or len(current) >= FIX_BATCH_SIZE):
+            batches.append(current)
+            current = []
+            current_chars = 0
+        current.append(bug)
+        current_chars += size
+    if current:
+        batches.append(current)
+    return batches
+
+def _incomplete_fixes(batch):
+    """The fix entry standing in for a fix batch the deadline cut short."""
+    ids = ", ".join(bug["id"] for bug in batch)
+    return {"bug": "Incomplete", "suggestion": f"No fixes were generated for {ids}: the deadline passed first"}
+
+async def _fix_batch(batch, calls, use_cache=True):
+    """
+    Ask fix_chain for fixes to a batch of bugs.
+
+    Returns:
+        list: Fix dicts, each linked to its bug through "bug_id" when the model provided one
+    """
+    bugs_json = json.dumps(
+        [{key: bug.get(key) for key in ("id", "type", "location", "description")} for bug in batch],
+        indent=2
+    )
+    try:
+        fixes_raw = await calls.invoke("fix", {"bugs": bugs_json}, use_cache)
+    except DeadlineExceeded:
+        return [_incomplete_fixes(batch)]
+    except Exception as e:
+        return [{"bug": "Error", "suggestion": f"Error generating fixes: {str(e)}"}]
+
+    # Extract the fixes, repairing the answer's format if needed
+    try:
+        fixes = await _parse_answer(fixes_raw, "fix", calls, use_cache)
+    except DeadlineExceeded:
+        return [_incomplete_fixes(batch)]
+    except ExtractionError:
+        # Fallback if JSON parsing fails - log error but don't print in API mode
+        error_msg = f"Could not parse fixes as JSON. Raw output: {fixes_raw[:100]}..."
+        return [{"bug": "Unknown", "suggestion": f"Error parsing output: {error_msg}"}]
+
+    known_ids = {bug["id"] for bug in batch}
+    for fix in fixes:
+        if fix.get("bug_id") not in known_ids:
+            fix["bug_id"] = None
+    return fixes
+
+def _number_bugs(i, pairs):
+    """
+    Give the bugs found in chunk i their IDs and link the fixes already known.
+
+    Returns:
+        tuple: (bugs, fixes linked to them, bugs that still need a fix)
+    """
+    bugs = []
+    fixes = []
+    to_fix = []
+    for number, (bug, fix) in enumerate(pairs, 1):
+        # IDs depend only on the chunk and position, not on completion order
+        bug["id"] = f"B{i + 1}.{number}"
+        bugs.append(bug)
+        if fix is None:
+            to_fix.append(bug)
+        elif fix is not _NO_FIX:
+            fix["bug_id"] = bug["id"]
+            fixes.append(fix)
+    return bugs, fixes, to_fix
+
+def _collect_result(bugs_by_chunk, fixes):
+    """Order bugs by chunk and fixes by bug, followed by any the model did not link to a bug."""
+    all_bugs = [bug for chunk in sorted(bugs_by_chunk) for bug in bugs_by_chunk[chunk]]
+
+    fixes_by_id = {}
+    for fix in fixes:
+        fixes_by_id.setdefault(fix.get("bug_id"), []).append(fix)
+    all_fixes = [fix for bug in all_bugs for fix in fixes_by_id.get(bug["id"], [])]
+    all_fixes.extend(fixes_by_id.get(None, []))
+
+    return {"bugs": all_bugs, "fixes": all_fixes}
+
+def _resolve_modes(static_analysis, mode):
+    """Apply defaults to the static analysis and pipeline modes and validate them."""
+    static_mode = static_analysis or STATIC_ANALYSIS
+    if static_mode not in STATIC_MODES:
+        raise ValueError(f"Unknown static analysis mode: {static_mode}")
+    mode = mode or DEFAULT_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode: {mode}")
+    return static_mode, mode
+
+async def stream_detect_bugs(code_snippet, strip_comments=False, max_concurrency=None, use_cache=True,
+                             static_analysis=None, mode=None, call_group=None, deadline=None):
+    """
+    Detect bugs and suggest fixes, yielding results as soon as they are ready.
+
+    Chunks are analyzed concurrently. Each chunk's bugs are yielded when its
+    detection finishes, and fix batches start as soon as enough bugs have
+    accumulated to fill one, so fixes also arrive while other chunks are
+    still being analyzed. Closing the generator early cancels all
+    outstanding chunk and fix work.
+
+    Takes the same arguments as detect_bugs_async.
+
+    Yields:
+        dict: Events, in this order:
+            {"event": "start", "chunks": n}
+            {"event": "bugs", "chunk": k, "lines": [start, end], "bugs": [...]} once per chunk
+            {"event": "fixes", "fixes": [...]} whenever fixes are ready
+            {"event": "summary", "chunks": n, "bugs": count, "fixes": count, "elapsed": seconds,
+             "incomplete": true if the deadline cut any chunk or fix batch short}
+    """
+    static_mode, mode = _resolve_modes(static_analysis, mode)
+    started = time.perf_counter()
+
+    chunks = _prepare_chunks(code_snippet, strip_comments)
+    calls = call_group or CallGroup(max_concurrency, deadline=deadline)
+    # Analyze the original code: chunks map their lines back to it, so findings line up with chunks
+    report = _static_report(code_snippet) if static_mode != STATIC_OFF else None
+
+    yield {"event": "start", "chunks": len(chunks)}
+
+    detect_tasks = {
+        asyncio.ensure_future(_detect_chunk(i, chunk, calls, use_cache, report, static_mode, mode)): i
+        for i, chunk in enumerate(chunks)
+    }
+    fix_tasks = set()
+    outstanding = set(detect_tasks)
+    to_fix = []
+    bug_count = 0
+    fix_count = 0
+
+    try:
+        while outstanding:
+            done, _ = await asyncio.wait(outstanding, return_when=asyncio.FIRST_COMPLETED)
+            outstanding -= done
+            for task in done:
+                if task in fix_tasks:
+                    fixes = task.result()
+                    fix_count += len(fixes)
+                    yield {"event": "fixes", "fixes": fixes}
+                    continue
+
+                i = detect_tasks.pop(task)
+                chunk = chunks[i]
+                bugs, known_fixes, unfixed = _number_bugs(i, task.result())
+                to_fix.extend(unfixed)
+                bug_count += len(bugs)
+                yield {"event": "bugs", "chunk": i + 1, "lines": [chunk.start_line, chunk.end_line], "bugs": bugs}
+                if known_fixes:
+                    fix_count += len(known_fixes)
+                    yield {"event": "fixes", "fixes": known_fixes}
+
+            # Start every full fix batch now; the last, partial one waits for detection to finish
+            batches = _fix_batches(to_fix)
+            if detect_tasks and batches:
+                batches, remainder = batches[:-1], batches[-1]
+            else:
+                remainder = []
+            to_fix = list(remainder)
+            for batch in batches:
+                task = asyncio.ensure_future(_fix_batch(batch, calls, use_cache))
+                fix_tasks.add(task)
+                outstanding.add(task)
+    finally:
+        for task in list(detect_tasks) + list(fix_tasks):
+            if not task.done():
+                task.cancel()
+
+    yield {
+        "event": "summary",
+        "chunks": len(chunks),
+        "bugs": bug_count,
+        "fixes": fix_count,
+        "elapsed": round(time.perf_counter() - started, 3),
+        "incomplete": calls.expired
+    }
 
 # Main function
-def detect_bugs(code_snippet, strip_comments=False):
+async def detect_bugs_async(code_snippet, strip_comments=False, max_concurrency=None, use_cache=True,
+                            static_analysis=None, mode=None, call_group=None, deadline=None):
     """
     Detect bugs in Python code and suggest fixes.
-    
+
+    Detection runs on all chunks concurrently. In two-stage mode the parsed
+    bugs from every chunk are numbered and sent to the fix stage in batches,
+    so a file with N chunks costs about N + 1 LLM calls. In fused mode each
+    chunk's single call also returns the fixes, so it costs N.
+
     Args:
         code_snippet (str): The Python code to analyze
         strip_comments (bool): Whether to strip comments before analysis to avoid bias
-        
+        max_concurrency (int): Maximum number of LLM calls in flight at once
+            (defaults to FOAMAI_MAX_CONCURRENCY)
+        use_cache (bool): Whether to reuse and store cached chain results
+        static_analysis (str): Static pre-analysis mode, "off", "prefilter" or "trust"
+            (defaults to FOAMAI_STATIC_ANALYSIS)
+        mode (str): "two_stage" or "fused" (defaults to FOAMAI_MODE)
+        call_group (CallGroup): Group to make the LLM calls through, shared with
+            other analyses (max_concurrency and deadline are then ignored)
+        deadline (float): time.monotonic() by which the analysis must be done. Chain
+            calls still running then are cancelled; their chunks get an "Incomplete"
+            bug entry and their bugs an "Incomplete" fix entry instead of results
+
     Returns:
-        dict: A dictionary containing detected bugs and suggested fixes
+        dict: A dictionary containing detected bugs and suggested fixes; every bug
+        has an "id" and every fix a "bug_id" linking it to its bug. "incomplete"
+        is True if the deadline cut the analysis short
     """
-    # Optionally strip comments to avoid biasing the LLM
-    if strip_comments:
-        # Remove single-line comments
-        code_without_comments = re.sub(r'#.*$', '', code_snippet, flags=re.MULTILINE)
-        # Remove multi-line comments (docstrings)
-        code_without_comments = re.sub(r'""".*?"""', '', code_without_comments, flags=re.DOTALL)
-        code_without_comments = re.sub(r"'''.*?'''", '', code_without_comments, flags=re.DOTALL)
-        chunks = chunk_code(code_without_comments)
-    else:
-        chunks = chunk_code(code_snippet)
-        
-    all_bugs = []
-    all_fixes = []
+    bugs_by_chunk = {}
+    fixes = []
+    incomplete = False
+    async for event in stream_detect_bugs(code_snippet, strip_comments, max_concurrency, use_cache,
+                                          static_analysis, mode, call_group, deadline):
+        if event["event"] == "bugs":
+            bugs_by_chunk[event["chunk"]] = event["bugs"]
+        elif event["event"] == "fixes":
+            fixes.extend(event["fixes"])
+        elif event["event"] == "summary":
+            incomplete = event["incomplete"]
+
+    result = _collect_result(bugs_by_chunk, fixes)
+    if incomplete:
+        result["incomplete"] = True
+    return result
+
+async def detect_bugs_resumable(code_snippet, checkpoint, strip_comments=False, max_concurrency=None,
+                                use_cache=True, static_analysis=None, mode=None):
+    """
+    Detect bugs like detect_bugs_async, saving progress so an interrupted run can resume.
+
+    Each chunk's results are saved to the checkpoint as soon as the chunk is
+    analyzed, and each fix batch's as soon as its fixes arrive. Running again
+    with the same checkpoint only sends the missing chunks and fix batches to
+    the LLM. Saved work is reused only if its chunk boundaries (or batch
+    contents) still match, so a changed chunk size cannot mix up results.
+
+    Args:
+        code_snippet (str): The Python code to analyze
+        checkpoint: Progress store with
+            chunks / fix_batches: dicts of saved records by index,
+            and the coroutine methods begin(stage, total, done), awaited for
+            the "detect" and "fix" stages, save_chunk(i, record) and
+            save_fix_batch(k, record)
+        Other arguments are the same as for detect_bugs_async.
+
+    Returns:
+        dict: The same result as detect_bugs_async
+    """
+    static_mode, mode = _resolve_modes(static_analysis, mode)
+    chunks = _prepare_chunks(code_snippet, strip_comments)
+    calls = CallGroup(max_concurrency)
 
+    records = {}
     for i, chunk in enumerate(chunks):
-        # Run the chains on each chunk
+        record = checkpoint.chunks.get(i)
+        if record is not None and record["lines"] == [chunk.start_line, chunk.end_line]:
+            records[i] = record
+    await checkpoint.begin("detect", len(chunks), len(records))
+
+    report = None
+    if static_mode != STATIC_OFF and len(records) < len(chunks):
+        report = _static_report(code_snippet)
+
+    async def detect(i):
+        pairs = await _detect_chunk(i, chunks[i], calls, use_cache, report, static_mode, mode)
+        bugs, fixes, to_fix = _number_bugs(i, pairs)
+        records[i] = {
+            "lines": [chunks[i].start_line, chunks[i].end_line],
+            "bugs": bugs,
+            "fixes": fixes,
+            "to_fix": [bug["id"] for bug in to_fix],
+        }
+        await checkpoint.save_chunk(i, records[i])
+
+    await asyncio.gather(*(detect(i) for i in range(len(chunks)) if i not in records))
+
+    bugs_by_chunk = {i: record["bugs"] for i, record in records.items()}
+    fixes = [fix for i in sorted(records) for fix in records[i]["fixes"]]
+    bugs_by_id = {bug["id"]: bug for bugs in bugs_by_chunk.values() for bug in bugs}
+    to_fix = [bugs_by_id[bug_id] for i in sorted(records) for bug_id in records[i]["to_fix"]]
+
+    batches = []
+    batch_fixes = {}
+    for k, batch in enumerate(_fix_batches(to_fix)):
+        bug_ids = [bug["id"] for bug in batch]
+        saved = checkpoint.fix_batches.get(k)
+        if saved is not None and saved["bug_ids"] == bug_ids:
+            batch_fixes[k] = saved["fixes"]
+        else:
+            batches.append((k, batch))
+    await checkpoint.begin("fix", len(batch_fixes) + len(batches), len(batch_fixes))
+
+    async def fix(k, batch):
+        batch_fixes[k] = await _fix_batch(batch, calls, use_cache)
+        await checkpoint.save_fix_batch(k, {"bug_ids": [bug["id"] for bug in batch], "fixes": batch_fixes[k]})
+
+    await asyncio.gather(*(fix(k, batch) for k, batch in batches))
+
+    fixes.extend(fix for k in sorted(batch_fixes) for fix in batch_fixes[k])
+    return _collect_result(bugs_by_chunk, fixes)
+
+async def _detect_units(units, selected, calls, use_cache=True, report=None, static_mode=STATIC_OFF,
+                        mode=MODE_TWO_STAGE, strip_comments=False):
+    """
+    Detect bugs in the selected units (indices into units).
+
+    Returns:
+        dict: (bug, fix) pairs of every selected unit, by index
+    """
+    async def analyze(unit):
+        # Units are prepared like a file; their chunks keep their lines in the whole file
+        if unit.header:
+            # A method goes with its class line, which then maps back to where it is in the file
+            numbers = unit.header_lines + tuple(range(unit.start_line, unit.end_line + 1))
+            chunks = [_renumber(chunk, numbers, unit.start_line)
+                      for chunk in _unit_chunks(f"{unit.header}\n{unit.text}", strip_comments)]
+        else:
+            chunks = _unit_chunks(unit.text, strip_comments, unit.start_line - 1)
+        ANALYSIS_CHUNKS.observe(len(chunks))
+        results = await asyncio.gather(*(
+            _detect_chunk(k, chunk, calls, use_cache, report, static_mode, mode) for k, chunk in enumerate(chunks)
+        ))
+        return [pair for pairs in results for pair in pairs]
+
+    return dict(zip(selected, await asyncio.gather(*(analyze(units[i]) for i in selected))))
+
+async def _fix_all(to_fix, calls, use_cache=True):
+    """
+    Run the fix stage for a list of bugs, in batches.
+
+    Returns:
+        tuple: (fixes, IDs of the bugs whose fix call failed)
+    """
+    batches = _fix_batches(to_fix)
+    fixes = []
+    failed_ids = set()
+    for batch, batch_fixes in zip(batches, await asyncio.gather(*(_fix_batch(batch, calls, use_cache)
+                                                                   for batch in batches))):
+        fixes.extend(batch_fixes)
+        # Fixes from the model always get a bug_id key; the error entries of a failed call do not
+        if any("bug_id" not in fix for fix in batch_fixes):
+            failed_ids.update(bug["id"] for bug in batch)
+    return fixes, failed_ids
+
+def _reuse_unit(i, record, offset):
+    """Renumber the saved bugs of a unit as unit i and move them down by offset lines."""
+    new_ids = {}
+    bugs = []
+    for number, saved in enumerate(record["bugs"], 1):
+        bug = dict(saved, id=f"B{i + 1}.{number}", location=shift_location(saved["location"], offset),
+                   description=shift_text(saved.get("description"), offset))
+        new_ids[saved["id"]] = bug["id"]
+        bugs.append(bug)
+    fixes = [dict(fix, bug_id=new_ids[fix["bug_id"]], bug=shift_text(fix.get("bug"), offset),
+                  suggestion=shift_text(fix.get("suggestion"), offset))
+             for fix in record["fixes"]]
+    return bugs, fixes
+
+def _unit_record(bugs, fixes_by_id, offset):
+    """Build the saved record of a unit, moving its bugs up by offset lines."""
+    return {
+        "bugs": [dict(bug, location=shift_location(bug["location"], -offset),
+                      description=shift_text(bug.get("description"), -offset)) for bug in bugs],
+        "fixes": [dict(fix, bug=shift_text(fix.get("bug"), -offset),
+                       suggestion=shift_text(fix.get("suggestion"), -offset))
+                  for bug in bugs for fix in fixes_by_id.get(bug["id"], [])],
+    }
+
+async def detect_bugs_incremental(code_snippet, document_id, store=None, strip_comments=False,
+                                  max_concurrency=None, use_cache=True, static_analysis=None, mode=None,
+                                  deadline=None):
+    """
+    Detect bugs like detect_bugs_async, reusing the results of the document's last analysis.
+
+    The code is split into its top-level functions and classes, with large
+    classes split into their methods (see incremental.py), and only the
+    units whose normalized source changed since document_id was last
+    analyzed are sent to the LLM. Bugs and fixes
+    of the other units are reused, with their line numbers moved to where
+    the unit is now. The results of every unit are then saved for the next
+    call; units whose analysis failed are not, so they are retried.
+
+    Args:
+        code_snippet (str): The Python code to analyze
+        document_id (str): Identifies the document across submissions, e.g. its path
+        store (DocumentStore): Where results are kept between calls
+            (defaults to the store at FOAMAI_DOCUMENTS_PATH)
+        Other arguments are the same as for detect_bugs_async. Units the
+        deadline cut short are not saved, so the next call analyzes them.
+
+    Returns:
+        dict: The same result as detect_bugs_async (with bug IDs numbered per
+        unit instead of per chunk), plus "units": {"total", "analyzed", "reused"}
+    """
+    static_mode, mode = _resolve_modes(static_analysis, mode)
+    store = store or _get_document_store()
+    with STAGE_DURATION.time(stage="chunking"):
+        units = split_units(code_snippet, CHUNK_SIZE)
+    # Saved results are only valid for analyses made the same way
+    options = json.dumps([_model_key(), TEMPERATURE, CHUNK_SIZE, strip_comments, static_mode, mode])
+    saved = await asyncio.to_thread(store.load, document_id, options)
+    changed = [i for i, unit in enumerate(units) if unit.fingerprint not in saved]
+
+    calls = CallGroup(max_concurrency, deadline=deadline)
+    report = _static_report(code_snippet) if static_mode != STATIC_OFF and changed else None
+
+    pairs_by_unit = await _detect_units(units, changed, calls, use_cache, report, static_mode, mode, strip_comments)
+
+    bugs_by_unit = {}
+    fixes = []
+    to_fix = []
+    for i, unit in enumerate(units):
+        if i in pairs_by_unit:
+            bugs, unit_fixes, unfixed = _number_bugs(i, pairs_by_unit[i])
+            to_fix.extend(unfixed)
+        else:
+            bugs, unit_fixes = _reuse_unit(i, saved[unit.fingerprint], unit.anchor_line - 1)
+        bugs_by_unit[i] = bugs
+        fixes.extend(unit_fixes)
+
+    new_fixes, failed_ids = await _fix_all(to_fix, calls, use_cache)
+    fixes.extend(new_fixes)
+
+    fixes_by_id = {}
+    for fix in fixes:
+        fixes_by_id.setdefault(fix.get("bug_id"), []).append(fix)
+    records = {}
+    for i, unit in enumerate(units):
+        if i in pairs_by_unit and (any(fix is _NO_FIX for _, fix in pairs_by_unit[i])
+                                   or any(bug["id"] in failed_ids for bug in bugs_by_unit[i])):
+            continue
+        records[unit.fingerprint] = _unit_record(bugs_by_unit[i], fixes_by_id, unit.anchor_line - 1)
+    await asyncio.to_thread(store.save, document_id, options, records)
+
+    result = _collect_result(bugs_by_unit, fixes)
+    result["units"] = {"total": len(units), "analyzed": len(changed), "reused": len(units) - len(changed)}
+    if calls.expired:
+        result["incomplete"] = True
+    return result
+
+async def detect_bugs_changed(code_snippet, changed_lines, strip_comments=False, max_concurrency=None,
+                              use_cache=True, static_analysis=None, mode=None, call_group=None):
+    """
+    Detect bugs only in the parts of the code that contain changed lines.
+
+    The code is split into its top-level functions and classes, with large
+    classes split into their methods (see incremental.py), and only the
+    units containing one of changed_lines are sent to the LLM, so a small
+    edit to a large file costs a few calls.
+
+    Args:
+        code_snippet (str): The Python code to analyze (the new version)
+        changed_lines (iterable): 1-based line numbers in code_snippet that changed
+        Other arguments are the same as for detect_bugs_async.
+
+    Returns:
+        dict: Bugs and fixes of the changed units like detect_bugs_async (with bug
+        IDs numbered per unit), plus "units": {"total", "analyzed"}
+    """
+    static_mode, mode = _resolve_modes(static_analysis, mode)
+    with STAGE_DURATION.time(stage="chunking"):
+        units = split_units(code_snippet, CHUNK_SIZE)
+    changed_lines = set(changed_lines)
+    # A change to a class line also concerns the methods analyzed with it
+    selected = [i for i, unit in enumerate(units)
+                if any(line in changed_lines
+                       for line in unit.header_lines + tuple(range(unit.start_line, unit.end_line + 1)))]
+
+    calls = call_group or CallGroup(max_concurrency)
+    report = _static_report(code_snippet) if static_mode != STATIC_OFF and selected else None
+    pairs_by_unit = await _detect_units(units, selected, calls, use_cache, report, static_mode, mode,
+                                        strip_comments)
+
+    bugs_by_unit = {}
+    fixes = []
+    to_fix = []
+    for i in selected:
+        bugs, unit_fixes, unfixed = _number_bugs(i, pairs_by_unit[i])
+        bugs_by_unit[i] = bugs
+        fixes.extend(unit_fixes)
+        to_fix.extend(unfixed)
+    new_fixes, _ = await _fix_all(to_fix, calls, use_cache)
+    fixes.extend(new_fixes)
+
+    result = _collect_result(bugs_by_unit, fixes)
+    result["units"] = {"total": len(units), "analyzed": len(selected)}
+    return result
+
+async def detect_bugs_batch(items, max_concurrency=None):
+    """
+    Detect bugs in several code snippets at once.
+
+    All snippets are chunked and analyzed together under one concurrency
+    limit. Identical chunks, within a snippet or across snippets, are sent
+    to the LLM only once. A snippet that fails gets an error entry instead
+    of failing the batch.
+
+    Args:
+        items (list): Dicts with "code" and optionally the keyword arguments of
+            detect_bugs_async (a per-item max_concurrency is ignored)
+        max_concurrency (int): Maximum number of LLM calls in flight for the whole batch
+
+    Returns:
+        dict: "results" holds one entry per item, in order, either {"bugs", "fixes"}
+        or {"error": message}; "llm_calls" and "unique_llm_calls" count the chain
+        calls requested and actually made
+    """
+    group = CallGroup(max_concurrency, dedupe=True)
+
+    async def analyze(item):
+        options = dict(item)
+        code_snippet = options.pop("code")
+        options.pop("max_concurrency", None)
         try:
-            bugs_raw = detect_chain.invoke({"code": chunk})
-            
-            # Try to parse as JSON
-            try:
-                bugs = json.loads(bugs_raw)
-                # Add chunk information to location
-                for bug in bugs:
-                    if "location" in bug:
-                        bug["location"] = f"chunk {i+1}: {bug['location']}"
-                    else:
-                        bug["location"] = f"chunk {i+1}"
-                all_bugs.extend(bugs)
-            except json.JSONDecodeError:
-                # Fallback if JSON parsing fails - log error but don't print in API mode
-                error_msg = f"Could not parse bugs as JSON. Raw output: {bugs_raw[:100]}..."
-                all_bugs.append({
-                    "type": "Unknown",
-                    "location": f"chunk {i+1}",
-                    "description": f"Error parsing output: {error_msg}"
-                })
-            
-            # Only get fixes if we found bugs
-            if all_bugs:
-                fixes_raw = fix_chain.invoke({"bugs": bugs_raw})
-                
-                # Try to parse as JSON
-                try:
-                    fixes = json.loads(fixes_raw)
-                    all_fixes.extend(fixes)
-                except json.JSONDecodeError:
-                    # Fallback if JSON parsing fails - log error but don't print in API mode
-                    error_msg = f"Could not parse fixes as JSON. Raw output: {fixes_raw[:100]}..."
-                    all_fixes.append({
-                        "bug": "Unknown",
-                        "suggestion": f"Error parsing output: {error_msg}"
-                    })
+            return await detect_bugs_async(code_snippet, call_group=group, **options)
         except Exception as e:
-            error_msg = f"Error processing chunk {i+1}: {str(e)}"
-            all_bugs.append({
-                "type": "Error",
-                "location": f"chunk {i+1}",
-                "description": error_msg
-            })
+            return {"error": f"Error detecting bugs: {str(e)}"}
 
-    return {"bugs": all_bugs, "fixes": all_fixes}
+    try:
+        results = await asyncio.gather(*(analyze(item) for item in items))
+    finally:
+        group.close()
+    return {"results": list(results), "llm_calls": group.requested, "unique_llm_calls": group.unique}
+
+def detect_bugs(code_snippet, strip_comments=False, max_concurrency=None, use_cache=True, static_analysis=None,
+                mode=None):
+    """
+    Detect bugs in Python code and suggest fixes.
+
+    Synchronous wrapper around detect_bugs_async for the CLI and scripts.
+    Code that already runs inside an event loop (such as the API) should
+    await detect_bugs_async instead.
+
+    Args:
+        code_snippet (str): The Python code to analyze
+        strip_comments (bool): Whether to strip comments before analysis to avoid bias
+        max_concurrency (int): Maximum number of LLM calls in flight at once
+        use_cache (bool): Whether to reuse and store cached chain results
+        static_analysis (str): Static pre-analysis mode, "off", "prefilter" or "trust"
+        mode (str): "two_stage" or "fused"
+
+    Returns:
+        dict: A dictionary containing detected bugs and suggested fixes
+    """
+    return asyncio.run(detect_bugs_async(code_snippet, strip_comments, max_concurrency, use_cache,
+                                         static_analysis, mode))
 
 # Run the bug detection if this script is executed directly
 if __name__ == "__main__":
@@ -173,8 +1440,84 @@ if __name__ == "__main__":
     parser.add_argument("-f", "--file", help="Path to Python file to analyze")
     parser.add_argument("-c", "--code", help="Python code string to analyze")
     parser.add_argument("--strip-comments", action="store_true", help="Strip comments before analysis to avoid bias")
+    parser.add_argument("--max-concurrency", type=int, help="Maximum number of concurrent LLM calls")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the result cache")
+    parser.add_argument("--static-analysis", choices=STATIC_MODES, help="Static pre-analysis mode (default: prefilter)")
+    parser.add_argument("--backend", help="Chat model backend, e.g. openai or fake (default: FOAMAI_BACKEND or openai)")
+    parser.add_argument("--mode", choices=PIPELINE_MODES, help="Detect and fix in two stages or in one fused call (default: two_stage)")
+    parser.add_argument("--document-id", help="Only re-analyze the functions and classes changed since the last run with this ID")
+    parser.add_argument("--path", help="Directory to scan; results are written as JSON lines")
+    parser.add_argument("--include", action="append", help="With --path: glob of files to analyze (repeatable, default: *.py)")
+    parser.add_argument("--exclude", action="append", help="With --path: glob of files or directories to skip (repeatable)")
+    parser.add_argument("--workers", type=int, default=4, help="With --path, --base or --diff: number of files analyzed at once")
+    parser.add_argument("-o", "--output", help="With --path: JSONL file to write (default: stdout)")
+    parser.add_argument("--resume", action="store_true", help="With --path: append to --output, skipping files it already has")
+    parser.add_argument("--base", help="Only analyze functions changed since this git ref (in the repository at --path, default .)")
+    parser.add_argument("--head", help="With --base: git ref with the new code (default: the working tree)")
+    parser.add_argument("--diff", help="Only analyze functions changed by this unified diff file (- for stdin), applied to the working tree at --path (default: the root of the current git repository)")
     args = parser.parse_args()
     
+    if args.backend:
+        BACKEND = args.backend
+
+    if args.path or args.base or args.diff:
+        import sys
+        # scan.py and git_diff.py import this module as "main"; let them use this instance (and its settings)
+        sys.modules.setdefault("main", sys.modules[__name__])
+
+    if args.base or args.diff:
+        from git_diff import (analyze_changes, file_reader, git_changes, parse_unified_diff, repository_root,
+                              working_tree_reader)
+        from scan import print_progress
+
+        repo = args.path or "."
+        if args.diff:
+            if args.diff == "-":
+                changes = parse_unified_diff(sys.stdin.read())
+            else:
+                with open(args.diff, "r") as f:
+                    changes = parse_unified_diff(f.read())
+            # Paths in the diff are relative to the repository root, not the current directory
+            read_file = working_tree_reader(args.path or repository_root())
+        else:
+            changes = git_changes(repo, args.base, args.head)
+            read_file = file_reader(repo, args.head)
+        output = open(args.output, "w") if args.output else sys.stdout
+        try:
+            counts = asyncio.run(analyze_changes(
+                changes, read_file, output, include=args.include, exclude=args.exclude, workers=args.workers,
+                max_concurrency=args.max_concurrency, progress=print_progress,
+                strip_comments=args.strip_comments, use_cache=not args.no_cache,
+                static_analysis=args.static_analysis, mode=args.mode
+            ))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        print(f"{counts['files']} changed files: {counts['units']} functions or classes analyzed, "
+              f"{counts['failed']} failed", file=sys.stderr)
+        sys.exit(1 if counts["failed"] else 0)
+
+    if args.path:
+        from scan import load_completed, print_progress, scan_directory
+
+        if args.resume and not args.output:
+            parser.error("--resume needs --output")
+        completed = load_completed(args.output) if args.resume else {}
+        output = open(args.output, "a" if args.resume else "w") if args.output else sys.stdout
+        try:
+            counts = asyncio.run(scan_directory(
+                args.path, output, include=args.include, exclude=args.exclude, workers=args.workers,
+                max_concurrency=args.max_concurrency, completed=completed, progress=print_progress,
+                strip_comments=args.strip_comments, use_cache=not args.no_cache,
+                static_analysis=args.static_analysis, mode=args.mode
+            ))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        print(f"{counts['files']} files: {counts['analyzed']} analyzed, {counts['skipped']} skipped, "
+              f"{counts['failed']} failed", file=sys.stderr)
+        sys.exit(1 if counts["failed"] else 0)
+
     code_to_analyze = None
     
     if args.file:
@@ -204,12 +1547,23 @@ if __name__ == "__main__":
         print(code_to_analyze)
     
     # Run the bug detection
-    result = detect_bugs(code_to_analyze, strip_comments=args.strip_comments)
+    if args.document_id:
+        result = asyncio.run(detect_bugs_incremental(
+            code_to_analyze, args.document_id, strip_comments=args.strip_comments,
+            max_concurrency=args.max_concurrency, use_cache=not args.no_cache,
+            static_analysis=args.static_analysis, mode=args.mode
+        ))
+        units = result["units"]
+        print(f"Units: {units['analyzed']} analyzed, {units['reused']} reused of {units['total']}")
+    else:
+        result = detect_bugs(code_to_analyze, strip_comments=args.strip_comments,
+                             max_concurrency=args.max_concurrency, use_cache=not args.no_cache,
+                             static_analysis=args.static_analysis, mode=args.mode)
     
     # Print the results - only in CLI mode
     print("\nDetected Bugs:")
     for i, bug in enumerate(result["bugs"], 1):
-        print(f"Bug #{i}:")
+        print(f"Bug #{i} ({bug['id']}):")
         print(f"  Type: {bug['type']}")
         print(f"  Location: {bug['location']}")
         print(f"  Description: {bug['description']}")
@@ -218,6 +1572,10 @@ if __name__ == "__main__":
     print("Suggested Fixes:")
     for i, fix in enumerate(result["fixes"], 1):
         print(f"Fix #{i}:")
-        print(f"  Bug: {fix['bug']}")
+        print(f"  Bug: {fix['bug']}" + (f" ({fix['bug_id']})" if fix.get("bug_id") else ""))
         print(f"  Suggestion: {fix['suggestion']}")
         print()
+
+    stats = cache_stats()
+    if stats is not None:
+        print(f"Cache: {stats['memory_hits'] + stats['disk_hits']} hits, {stats['misses']} misses")
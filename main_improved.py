@@ -1,22 +1,16 @@
-import os
 from dotenv import load_dotenv
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
 import json
 import re
+from backends import create_llm
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Verify the API key is available
-api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables")
-
-# Now create the OpenAI instance with the key from environment variables
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.3)
+# Create the chat model for the backend chosen by FOAMAI_BACKEND (default "openai")
+llm = create_llm(model_name="gpt-3.5-turbo", temperature=0.3)
 
 # Chunking function
 def chunk_code(code, max_length=500):
@@ -0,0 +1,223 @@
+"""
+Counters and histograms exposed in the Prometheus text format.
+
+A deliberately small, dependency-free subset of what prometheus_client
+offers: labelled counters, gauges and cumulative histograms, collected in one
+registry and rendered by render(). The metrics the pipeline and the API
+record are defined at the bottom of this module.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; suits everything from a cache lookup to a slow LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            for key, value in series:
+                lines.extend(self._render_series(key, value))
+        return lines
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. a number of calls."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+class Gauge(_Metric):
+    """A value that can go up and down, e.g. a current limit."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._series.get(self._key(labels), ([0], 0.0))
+            return counts[-1]
+
+    def _render_series(self, key, value):
+        counts, total = value
+        lines = [
+            f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(bound))])} {count}"
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+class Registry:
+    """The set of metrics rendered together on /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Content type of render()'s output
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def render():
+    return REGISTRY.render()
+
+# Metrics recorded by main.py, ratelimit.py, singleflight.py and api.py
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "foamai_http_request_duration_seconds", "HTTP request latency (until the response starts).",
+    ["method", "path", "status"]
+))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "foamai_stage_duration_seconds",
+    "Time spent in each non-LLM pipeline stage: chunking, static_analysis, similarity, parse, response.",
+    ["stage"]
+))
+ANALYSIS_CHUNKS = REGISTRY.register(Histogram(
+    "foamai_analysis_chunks", "Number of chunks each analysis was split into.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+))
+LLM_CALL_DURATION = REGISTRY.register(Histogram(
+    "foamai_llm_call_duration_seconds",
+    "Latency of LLM chain calls, including rate limit waits and retries (excluding cache hits).", ["chain"]
+))
+LLM_BATCH_SIZE = REGISTRY.register(Histogram(
+    "foamai_llm_batch_size", "Calls answered by each multi-snippet prompt, per batched chain.", ["chain"],
+    buckets=(2, 3, 4, 6, 8, 12, 16, 32)
+))
+LLM_CALLS = REGISTRY.register(Counter(
+    "foamai_llm_calls_total", "LLM chain calls by outcome (ok or error).", ["chain", "outcome"]
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "foamai_llm_tokens_total",
+    "Tokens reported by the model (estimated for answers cut short before usage arrived), by direction "
+    "(prompt or completion).",
+    ["chain", "direction"]
+))
+JSON_PARSE_FAILURES = REGISTRY.register(Counter(
+    "foamai_json_parse_failures_total", "LLM answers that could not be parsed as JSON.", ["chain"]
+))
+JSON_REPAIRS = REGISTRY.register(Counter(
+    "foamai_json_repairs_total", "LLM answers that were usable only after a repair, by method (local or reask).",
+    ["chain", "method"]
+))
+LLM_ITEMS_REJECTED = REGISTRY.register(Counter(
+    "foamai_llm_items_rejected_total", "Items of LLM answers dropped for not matching the bug or fix schema.", ["chain"]
+))
+DEADLINE_EXCEEDED = REGISTRY.register(Counter(
+    "foamai_deadline_exceeded_total", "LLM chain calls cancelled or skipped because the analysis deadline passed.",
+    ["chain"]
+))
+COALESCED = REGISTRY.register(Counter(
+    "foamai_coalesced_total",
+    "Analyses (level request) and LLM calls (level call) that joined an identical one in flight.", ["level"]
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "foamai_cache_lookups_total", "Result cache lookups by result (hit or miss).", ["result"]
+))
+
+LLM_RETRIES = REGISTRY.register(Counter(
+    "foamai_llm_retries_total", "LLM chain calls retried, by reason (throttle or transient).", ["chain", "reason"]
+))
+RATE_LIMIT_WAIT = REGISTRY.register(Histogram(
+    "foamai_rate_limit_wait_seconds", "Time LLM calls waited for the shared request and token budgets."
+))
+LLM_CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "foamai_llm_concurrency_limit", "Current adaptive limit on LLM calls in flight in this process."
+))
+SIMILARITY_LOOKUPS = REGISTRY.register(Counter(
+    "foamai_similarity_lookups_total",
+    "Near-duplicate lookups for chunks the cache missed, by result (reused, miss, or unmappable when the "
+    "near duplicate differs in more than names).", ["chain", "result"]
+))
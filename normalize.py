@@ -0,0 +1,156 @@
+"""
+Canonical form of Python source sent to the LLM.
+
+normalize_code makes one tokenize pass over the code (plus an ast parse
+to find docstrings when they are stripped) and produces a canonical
+version: four-space indentation, no trailing whitespace and no blank
+lines, optionally without comments and docstrings. Equivalent code then
+looks the same to the result cache, and the prompt carries fewer tokens.
+
+Because lines are removed, the result comes with a line map from its
+lines to the lines of the original source, so locations reported for the
+normalized code can be translated back.
+"""
+import ast
+import io
+import tokenize
+from typing import List, NamedTuple
+
+from chunking import Chunk
+
+INDENT = "    "
+
+class NormalizedCode(NamedTuple):
+    text: str
+    line_map: List[int]  # line_map[k] is the original line of line k + 1 of text
+
+def _docstrings(code, lines):
+    """Return {first line: (column, last line, whether it is the only statement of its body)} of every docstring."""
+    docstrings = {}
+    for node in ast.walk(ast.parse(code)):
+        if not isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        first = node.body[0] if node.body else None
+        if not (isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant)
+                and isinstance(first.value.value, str)):
+            continue
+        # Only docstrings with nothing but a comment after them on their last line
+        rest = lines[first.end_lineno - 1].encode("utf-8")[first.end_col_offset:].decode("utf-8").strip()
+        if not rest or rest.startswith("#"):
+            # ast columns count UTF-8 bytes
+            column = len(lines[first.lineno - 1].encode("utf-8")[:first.col_offset].decode("utf-8"))
+            docstrings[first.lineno] = (column, first.end_lineno,
+                                        len(node.body) == 1 and not isinstance(node, ast.Module))
+    return docstrings
+
+def _identity(lines):
+    """Fallback for code that does not tokenize: only trailing whitespace and blank lines go."""
+    kept = [(number, line.rstrip()) for number, line in enumerate(lines, 1) if line.strip()]
+    return NormalizedCode("\n".join(line for _, line in kept), [number for number, _ in kept])
+
+def normalize_code(code, strip_comments=False):
+    """
+    Canonicalize Python source for analysis.
+
+    Indentation is rewritten as four spaces per level, trailing whitespace
+    and blank lines are removed, and line endings are unified. With
+    strip_comments, comments and docstrings are removed too (a docstring
+    that is the only statement of its body becomes "..."). Text inside
+    strings is never changed. Code that cannot be tokenized only loses
+    trailing whitespace and blank lines.
+
+    Args:
+        code (str): The Python code
+        strip_comments (bool): Whether to remove comments and docstrings
+
+    Returns:
+        NormalizedCode: The canonical text and its line map
+    """
+    code = code.replace("\r\n", "\n").replace("\r", "\n")
+    lines = code.split("\n")
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+        docstrings = _docstrings(code, lines) if strip_comments else {}
+    except (tokenize.TokenError, SyntaxError):
+        return _identity(lines)
+
+    text = {number: line for number, line in enumerate(lines, 1)}
+    depth_of = {}  # First line of each logical line -> indentation depth
+    verbatim = set()  # Lines inside multi-line strings, kept exactly
+    keep_tail = set()  # Lines whose end is inside a string, so trailing whitespace matters
+    depth = 0
+    at_line_start = True
+    for token in tokens:
+        kind, string, (start_row, start_col), (end_row, _), _ = token
+        if kind == tokenize.INDENT:
+            depth += 1
+            continue
+        if kind == tokenize.DEDENT:
+            depth -= 1
+            continue
+        if kind in (tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER):
+            at_line_start = at_line_start or kind == tokenize.NEWLINE
+            continue
+        if kind == tokenize.COMMENT:
+            if strip_comments:
+                # A comment runs to the end of its line
+                text[start_row] = text[start_row][:start_col]
+            continue
+        if at_line_start:
+            depth_of[start_row] = depth
+            at_line_start = False
+        if end_row > start_row:
+            keep_tail.update(range(start_row, end_row))
+            verbatim.update(range(start_row + 1, end_row + 1))
+
+    for first, (column, last, alone) in docstrings.items():
+        if not (first in depth_of and (last == first or last in verbatim)):
+            continue
+        line = text[first]
+        # A docstring on the line of its def or class keeps the header before it
+        header = line[:column].rstrip() if column > len(line) - len(line.lstrip()) else ""
+        for number in range(first, last + 1):
+            text[number] = ""
+            verbatim.discard(number)
+        keep_tail.discard(first)
+        if alone:
+            text[first] = header + " ..." if header else "..."
+        else:
+            text[first] = header
+
+    kept = []
+    for number in range(1, len(lines) + 1):
+        line = text[number]
+        if number in verbatim:
+            if number not in keep_tail:
+                line = line.rstrip()
+            kept.append((number, line))
+            continue
+        if number not in keep_tail:
+            line = line.rstrip()
+        if not line.strip():
+            continue
+        if number in depth_of:
+            line = INDENT * depth_of[number] + line.lstrip()
+        kept.append((number, line))
+    return NormalizedCode("\n".join(line for _, line in kept), [number for number, _ in kept])
+
+def to_original_lines(chunk, line_map, offset=0):
+    """
+    Translate a chunk of normalized code into the coordinates of the original source.
+
+    Args:
+        chunk (Chunk): A chunk of NormalizedCode.text
+        line_map (list): The NormalizedCode's line map
+        offset (int): Added to every original line, for code that starts
+            further down a larger file
+
+    Returns:
+        Chunk: The same text, with start_line and lines set to original lines
+    """
+    if not line_map:
+        # Nothing but blank lines and comments was left
+        return Chunk(chunk.text, 1 + offset)
+    numbers = chunk.lines or range(chunk.start_line, chunk.end_line + 1)
+    lines = tuple(line_map[number - 1] + offset for number in numbers)
+    return Chunk(chunk.text, line_map[chunk.start_line - 1] + offset, lines)
@@ -0,0 +1,303 @@
+"""
+Rate limiting, adaptive concurrency and retries for LLM calls.
+
+Every chain call in main.py goes through RateLimiter.call, which
+
+- waits for room in two token buckets, requests per minute and tokens per
+  minute. The buckets live in SQLite, so every process on the host (e.g.
+  all uvicorn workers) draws from the same budget;
+- holds a slot of an adaptive concurrency limit, adjusted AIMD-style: it
+  is halved when the provider throttles us or latency spikes, and grows
+  back by one slot per limit's worth of successful calls;
+- retries throttled and transient failures with exponential backoff and
+  full jitter, honouring Retry-After when the provider sends it.
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from metrics import LLM_CONCURRENCY_LIMIT, LLM_RETRIES, RATE_LIMIT_WAIT
+
+# HTTP statuses worth retrying besides 429
+TRANSIENT_STATUSES = {408, 409, 500, 502, 503, 504}
+
+def _status(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def classify_error(error):
+    """Return "throttle", "transient" or None (not worth retrying) for an exception from a chain call."""
+    status = _status(error)
+    name = type(error).__name__
+    if status == 429 or "RateLimit" in name:
+        return "throttle"
+    if status in TRANSIENT_STATUSES or name in ("APIConnectionError", "APITimeoutError", "InternalServerError"):
+        return "transient"
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return "transient"
+    return None
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, from a Retry-After header, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBuckets:
+    """
+    Token buckets shared by every process using the same SQLite file.
+
+    Each bucket holds up to its per-minute limit and refills continuously at
+    limit / 60 per second. A limit of 0 disables the bucket.
+
+    Args:
+        limits (dict): Per-minute limit by bucket name, e.g. {"requests": 500, "tokens": 90000}
+        path (str): SQLite database file (":memory:" to share only within this process)
+    """
+
+    def __init__(self, limits, path=".foamai_ratelimit.sqlite"):
+        self.limits = {name: limit for name, limit in limits.items() if limit}
+        self._lock = threading.Lock()
+        self._db = None
+        if not self.limits:
+            return
+        # Transactions are explicit (BEGIN IMMEDIATE) so concurrent processes serialize their updates
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _update(self, change):
+        """Refill every bucket, then apply change(levels) -> (new levels or None, result) atomically."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                stored = dict((name, (level, updated)) for name, level, updated in
+                              self._db.execute("SELECT name, level, updated FROM buckets"))
+                levels = {}
+                for name, limit in self.limits.items():
+                    level, updated = stored.get(name, (limit, now))
+                    levels[name] = min(limit, level + (now - updated) * limit / 60)
+                new_levels, result = change(levels)
+                if new_levels is not None:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                        [(name, level, now) for name, level in new_levels.items()]
+                    )
+                self._db.execute("COMMIT")
+                return result
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def try_acquire(self, amounts):
+        """
+        Take amounts (by bucket name) if every bucket has enough.
+
+        Returns:
+            float: 0 if taken, otherwise the seconds until there should be enough
+        """
+        def change(levels):
+            wait = 0.0
+            for name, amount in amounts.items():
+                if name in levels:
+                    limit = self.limits[name]
+                    # A single request larger than the bucket waits for a full bucket
+                    missing = min(amount, limit) - levels[name]
+                    if missing > 0:
+                        wait = max(wait, missing * 60 / limit)
+            if wait:
+                return None, wait
+            return {name: level - amounts.get(name, 0) for name, level in levels.items()}, 0.0
+        return self._update(change) if self.limits else 0.0
+
+    def adjust(self, amounts):
+        """Add (negative: return) amounts to what was taken, e.g. once the actual token usage is known."""
+        if self.limits:
+            self._update(lambda levels: ({name: level - amounts.get(name, 0) for name, level in levels.items()}, None))
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted by additive increase, multiplicative decrease.
+
+    Only the first congestion signal from calls started under the current
+    limit lowers it, so one burst of 429s halves the limit once, not once
+    per failed call.
+
+    Args:
+        initial (int): Starting limit
+        minimum (int): Lowest limit
+        maximum (int): Highest limit
+        decrease (float): Factor applied on congestion
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64, decrease=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.epoch = 0
+        self._waiters = []
+        LLM_CONCURRENCY_LIMIT.set(int(self.limit))
+
+    async def acquire(self):
+        """Wait for a slot; returns the epoch to pass to on_congestion."""
+        while self.in_flight >= int(self.limit):
+            # Futures of the running loop, so the limiter works across asyncio.run calls
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        return self.epoch
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        LLM_CONCURRENCY_LIMIT.set(int(self.limit))
+        self._wake()
+
+    def on_congestion(self, epoch):
+        if epoch != self.epoch:
+            return
+        self.epoch += 1
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        LLM_CONCURRENCY_LIMIT.set(int(self.limit))
+
+    def _wake(self):
+        # Waiters re-check the limit themselves. After a decrease more calls
+        # may be in flight than the limit allows, and nobody is woken
+        for waiter in self._waiters[:max(0, int(self.limit) - self.in_flight)]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+class RateLimiter:
+    """
+    The budget, concurrency and retry policy shared by all LLM calls of a process.
+
+    Args:
+        requests_per_minute (int): Request budget shared on the host (0 for none)
+        tokens_per_minute (int): Token budget shared on the host (0 for none)
+        path (str): SQLite file of the shared budgets
+        max_concurrency (int): Highest (and starting) number of calls in flight in this process
+        retries (int): Retries of a throttled or transient failure
+        backoff_base (float): First backoff ceiling in seconds, doubled on every retry
+        backoff_max (float): Largest backoff in seconds
+        expected_completion_tokens (int): Completion tokens reserved per call until the actual count is known
+        latency_spike (float): A call this many times slower than the recent average counts as congestion
+    """
+
+    # Calls to observe before latency spikes are trusted
+    WARMUP_CALLS = 20
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, path=".foamai_ratelimit.sqlite",
+                 max_concurrency=64, retries=3, backoff_base=1.0, backoff_max=30.0,
+                 expected_completion_tokens=500, latency_spike=3.0):
+        self.buckets = TokenBuckets({"requests": requests_per_minute, "tokens": tokens_per_minute}, path)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, maximum=max_concurrency)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.expected_completion_tokens = expected_completion_tokens
+        self.latency_spike = latency_spike
+        self._latency = None
+        self._calls = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the limiter configured by environment variables.
+
+        FOAMAI_RPM and FOAMAI_TPM set the per-minute budgets (default 0, unlimited),
+        shared through FOAMAI_RATE_LIMIT_PATH. FOAMAI_LLM_MAX_CONCURRENCY caps the
+        calls in flight per process (default 64). FOAMAI_LLM_RETRIES,
+        FOAMAI_RETRY_BASE and FOAMAI_RETRY_MAX control retries.
+        """
+        return cls(
+            requests_per_minute=int(os.environ.get("FOAMAI_RPM", "0")),
+            tokens_per_minute=int(os.environ.get("FOAMAI_TPM", "0")),
+            path=os.environ.get("FOAMAI_RATE_LIMIT_PATH", ".foamai_ratelimit.sqlite") or ":memory:",
+            max_concurrency=int(os.environ.get("FOAMAI_LLM_MAX_CONCURRENCY", "64")),
+            retries=int(os.environ.get("FOAMAI_LLM_RETRIES", "3")),
+            backoff_base=float(os.environ.get("FOAMAI_RETRY_BASE", "1")),
+            backoff_max=float(os.environ.get("FOAMAI_RETRY_MAX", "30"))
+        )
+
+    async def _wait_for_budget(self, amounts):
+        if not self.buckets.limits:
+            return
+        started = time.perf_counter()
+        while True:
+            # BEGIN IMMEDIATE may wait up to its timeout for other processes, so not on the event loop
+            wait = await asyncio.to_thread(self.buckets.try_acquire, amounts)
+            if not wait:
+                break
+            # Small jitter so waiting callers do not all retry at the same moment
+            await asyncio.sleep(wait + random.uniform(0, 0.05))
+        RATE_LIMIT_WAIT.observe(time.perf_counter() - started)
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        hinted = retry_after(error)
+        return max(delay, min(hinted, self.backoff_max)) if hinted is not None else delay
+
+    def _observe_latency(self, latency, epoch):
+        self._calls += 1
+        if self._latency is not None and self._calls > self.WARMUP_CALLS and latency > self.latency_spike * self._latency:
+            self.concurrency.on_congestion(epoch)
+        else:
+            self.concurrency.on_success()
+        self._latency = latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+
+    async def call(self, invoke, prompt_tokens, chain):
+        """
+        Run invoke() (a coroutine function making one chain call) under the limits.
+
+        Args:
+            invoke (callable): Makes the call and returns its text
+            prompt_tokens (int): Estimated prompt size, for the token budget
+            chain (str): Chain name for metrics
+
+        Returns:
+            The result of invoke()
+        """
+        reserved = prompt_tokens + self.expected_completion_tokens
+        for attempt in range(self.retries + 1):
+            await self._wait_for_budget({"requests": 1, "tokens": reserved})
+            epoch = await self.concurrency.acquire()
+            started = time.perf_counter()
+            try:
+                result = await invoke()
+            except Exception as e:
+                if self.buckets.limits:
+                    # A failed call produced no tokens, so return them; the request still counted with the provider
+                    await asyncio.to_thread(self.buckets.adjust, {"tokens": -reserved})
+                reason = classify_error(e)
+                if reason == "throttle":
+                    self.concurrency.on_congestion(epoch)
+                if reason is None or attempt == self.retries:
+                    raise
+                LLM_RETRIES.inc(chain=chain, reason=reason)
+                delay = self._backoff(attempt, e)
+            else:
+                self._observe_latency(time.perf_counter() - started, epoch)
+                if isinstance(result, str) and self.buckets.limits:
+                    # Settle the reservation with the tokens actually used (about 4 characters each)
+                    await asyncio.to_thread(self.buckets.adjust, {"tokens": prompt_tokens + len(result) // 4 - reserved})
+                return result
+            finally:
+                self.concurrency.release()
+            await asyncio.sleep(delay)
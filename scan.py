@@ -0,0 +1,165 @@
+"""
+Scan a directory tree in one process.
+
+Files matching the include globs (and none of the exclude globs) are
+analyzed by a pool of asyncio workers that make their LLM calls through
+one shared CallGroup, so the concurrency limit holds for the whole scan
+rather than per file. Every finished file is appended to a JSONL output
+as soon as it is done; a resumed scan skips the files already in the
+output whose content has not changed since.
+"""
+import asyncio
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+
+from main import CallGroup, detect_bugs_async
+
+DEFAULT_INCLUDE = ["*.py"]
+# Directories that are never worth scanning
+DEFAULT_EXCLUDE = [".git", ".hg", ".svn", "__pycache__", ".venv", "venv", "node_modules", ".tox", ".nox", "*.egg-info"]
+
+def path_matches(relative_path, patterns):
+    """True if the path, or any of its components, matches one of the glob patterns."""
+    parts = relative_path.split("/")
+    return any(
+        fnmatch.fnmatch(relative_path, pattern) or any(fnmatch.fnmatch(part, pattern) for part in parts)
+        for pattern in patterns
+    )
+
+def find_files(root, include=None, exclude=None):
+    """
+    List the files under root to scan.
+
+    Patterns are shell globs matched against the path relative to root
+    (with "/" separators) and against each of its components, so "*.py"
+    matches every Python file and "tests" excludes every tests directory.
+
+    Args:
+        root (str): Directory to walk
+        include (list): Globs a file must match (defaults to DEFAULT_INCLUDE)
+        exclude (list): Globs of files and directories to skip, in addition to DEFAULT_EXCLUDE
+
+    Returns:
+        list: Relative paths, sorted
+    """
+    include = include or DEFAULT_INCLUDE
+    exclude = DEFAULT_EXCLUDE + list(exclude or [])
+    found = []
+    for directory, subdirectories, files in os.walk(root):
+        relative_directory = os.path.relpath(directory, root).replace(os.sep, "/")
+        prefix = "" if relative_directory == "." else relative_directory + "/"
+        # Prune excluded directories instead of walking into them
+        subdirectories[:] = [name for name in subdirectories if not path_matches(prefix + name, exclude)]
+        for name in files:
+            path = prefix + name
+            if path_matches(path, include) and not path_matches(path, exclude):
+                found.append(path)
+    return sorted(found)
+
+def _digest(code):
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+def load_completed(output_path):
+    """
+    Return {path: sha256} of the files an earlier scan finished without an error.
+
+    A line cut short by an interrupted scan is ignored.
+    """
+    completed = {}
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in record:
+                completed[record["path"]] = record.get("sha256")
+    return completed
+
+async def scan_directory(root, output, include=None, exclude=None, workers=4, max_concurrency=None,
+                         completed=None, progress=None, **options):
+    """
+    Analyze every matching file under root, writing one JSON line per file.
+
+    Args:
+        root (str): Directory to scan
+        output: Text file the JSONL records are written to; each record is
+            {"path", "sha256", "bugs", "fixes"} or {"path", "error"}
+        include (list): Globs of files to analyze (defaults to DEFAULT_INCLUDE)
+        exclude (list): Globs of files and directories to skip
+        workers (int): Number of files analyzed at the same time
+        max_concurrency (int): Maximum number of LLM calls in flight for the whole scan
+            (defaults to FOAMAI_MAX_CONCURRENCY)
+        completed (dict): {path: sha256} of files to skip while their content is unchanged
+            (see load_completed)
+        progress (callable): Called as progress(done, total, path, record) after each file
+        options: Keyword arguments for detect_bugs_async
+
+    Returns:
+        dict: Counts of "files" found, "skipped", "analyzed" and "failed"
+    """
+    completed = completed or {}
+    paths = find_files(root, include, exclude)
+    calls = CallGroup(max_concurrency)
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+    counts = {"files": len(paths), "skipped": 0, "analyzed": 0, "failed": 0}
+    done = 0
+
+    def finish(path, record):
+        nonlocal done
+        done += 1
+        if record is not None:
+            output.write(json.dumps(record) + "\n")
+            # Flush every record so an interrupted scan loses at most the files in progress
+            output.flush()
+        if progress is not None:
+            progress(done, len(paths), path, record)
+
+    async def worker():
+        while not queue.empty():
+            path = queue.get_nowait()
+            try:
+                with open(os.path.join(root, path), "r", encoding="utf-8") as f:
+                    code = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                counts["failed"] += 1
+                finish(path, {"path": path, "error": f"Error reading file: {str(e)}"})
+                continue
+
+            sha256 = _digest(code)
+            if completed.get(path) == sha256:
+                counts["skipped"] += 1
+                finish(path, None)
+                continue
+
+            try:
+                if code.strip():
+                    result = await detect_bugs_async(code, call_group=calls, **options)
+                else:
+                    result = {"bugs": [], "fixes": []}
+                record = {"path": path, "sha256": sha256, **result}
+                counts["analyzed"] += 1
+            except Exception as e:
+                record = {"path": path, "error": f"Error detecting bugs: {str(e)}"}
+                counts["failed"] += 1
+            finish(path, record)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    return counts
+
+def print_progress(done, total, path, record):
+    """progress callback for the CLI: one line per file on stderr."""
+    if record is None:
+        status = "unchanged, skipped"
+    elif "error" in record:
+        status = record["error"]
+    else:
+        status = f"{len(record['bugs'])} bugs"
+    print(f"[{done}/{total}] {path}: {status}", file=sys.stderr, flush=True)
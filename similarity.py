@@ -0,0 +1,330 @@
+"""
+Reuse of findings for near-duplicate code.
+
+The result cache only helps when a chunk comes back unchanged, but much of
+what gets analyzed is copy-pasted code with renamed variables. This index
+remembers the detection answers of analyzed chunks under a MinHash
+signature of their token shingles, with every identifier that is not a
+keyword, builtin or attribute replaced by a placeholder. Chunks sharing a
+band of the signature (locality-sensitive hashing) are candidates; a
+candidate whose shingles overlap the new chunk's by at least the
+threshold (Jaccard similarity) is a near duplicate.
+
+Its answer is reused only if, after aligning the two token sequences,
+every line of each chunk has a counterpart with the same tokens in the
+other and the identifiers correspond one to one, i.e. the code differs
+in names, string literals, comments and formatting but not in what it
+does. Line numbers in locations are then moved to the matching lines of
+the new chunk, and the identifiers its locations and quoted code
+mention are renamed to the ones the new chunk uses. A near duplicate with any line added, removed or
+edited is "unmappable", and the chunk goes to the LLM as usual.
+"""
+import builtins
+import difflib
+import hashlib
+import io
+import json
+import keyword
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import tokenize
+from typing import List, NamedTuple, Optional
+
+from chunking import _map_lines
+from json_extract import ExtractionError, extract_json_array
+
+# Tokens per shingle
+SHINGLE_SIZE = 5
+
+# MinHash signature length, split into BANDS bands of NUM_PERM // BANDS values each
+NUM_PERM = 64
+BANDS = 16
+
+# Chunks with fewer shingles are too short to compare reliably
+MIN_SHINGLES = 8
+
+# Candidates compared exactly per lookup, most shared bands first
+MAX_CANDIDATES = 8
+
+# Code quoted in the prose of an answer: `...`, '...' or "..." (not an apostrophe)
+_CODE_SPAN = re.compile(r"`[^`\n]*`|(?<!\w)'[^'\n]*'(?!\w)|(?<!\w)\"[^\"\n]*\"(?!\w)")
+
+# Names that mean the same in any code, so they are kept in the tokens
+_KEPT_NAMES = set(dir(builtins)) | set(keyword.kwlist) | {"self", "cls"}
+
+_MERSENNE = (1 << 61) - 1
+_random = random.Random(0x5eed)
+_PERMUTATIONS = [(_random.randrange(1, _MERSENNE), _random.randrange(_MERSENNE)) for _ in range(NUM_PERM)]
+
+_SKIPPED = {tokenize.ENCODING, tokenize.ENDMARKER, tokenize.COMMENT, tokenize.NL}
+
+class CodeTokens(NamedTuple):
+    tokens: List[str]  # Identifiers are "ID", strings "STR"
+    lines: List[int]  # 1-based line of each token
+    names: List[Optional[str]]  # The identifier behind each "ID" token, else None
+
+def code_tokens(code):
+    """
+    Tokenize code with identifiers and string literals replaced by placeholders.
+
+    Returns:
+        CodeTokens: The tokens, or None if the code cannot be tokenized
+    """
+    tokens, lines, names = [], [], []
+    previous = None
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type in _SKIPPED:
+                continue
+            text, name = token.string, None
+            if token.type == tokenize.NAME and text not in _KEPT_NAMES and previous != ".":
+                text, name = "ID", token.string
+            elif token.type == tokenize.STRING:
+                text = "STR"
+            elif token.type == tokenize.NEWLINE:
+                text = "NEWLINE"
+            elif token.type in (tokenize.INDENT, tokenize.DEDENT):
+                text = tokenize.tok_name[token.type]
+            tokens.append(text)
+            lines.append(token.start[0])
+            names.append(name)
+            previous = token.string
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    return CodeTokens(tokens, lines, names)
+
+def shingles(tokens):
+    """The set of hashes of every SHINGLE_SIZE consecutive tokens."""
+    return {
+        int.from_bytes(hashlib.blake2b("\x1f".join(tokens[i:i + SHINGLE_SIZE]).encode("utf-8"),
+                                       digest_size=8).digest(), "big")
+        for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 0))
+    }
+
+def minhash(hashes):
+    """MinHash signature (NUM_PERM values) of a set of shingle hashes."""
+    return [min((a * value + b) % _MERSENNE for value in hashes) for a, b in _PERMUTATIONS]
+
+def band_keys(signature, scope):
+    """The LSH bucket of each band of a signature; similar code shares at least one with high probability."""
+    rows = NUM_PERM // BANDS
+    return [
+        f"{scope[:16]}:{band}:" + hashlib.blake2b(
+            repr(signature[band * rows:(band + 1) * rows]).encode("ascii"), digest_size=8
+        ).hexdigest()
+        for band in range(BANDS)
+    ]
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def _line_tokens(code):
+    """The tokens of each line of CodeTokens."""
+    by_line = {}
+    for token, line in zip(code.tokens, code.lines):
+        by_line.setdefault(line, []).append(token)
+    return by_line
+
+def remap_answer(items, source, target):
+    """
+    Move the findings of an answer for source code onto near-duplicate target code.
+
+    The answer is only valid for the target if the two differ in nothing
+    but names (and formatting): every line of either chunk must have a
+    counterpart with the same tokens in the other, and the names must
+    correspond one to one. A line added, removed or edited anywhere may
+    add or remove a bug, even where the answer reports none.
+
+    Args:
+        items (list): Bug dicts reported for the source code
+        source (CodeTokens): Tokens of the code the answer is for
+        target (CodeTokens): Tokens of the code to reuse it for
+
+    Returns:
+        list: The items with their lines and identifiers translated, or None if
+            the code differs in more than names
+    """
+    source_lines = _line_tokens(source)
+    target_lines = _line_tokens(target)
+    matcher = difflib.SequenceMatcher(None, source.tokens, target.tokens, autojunk=False)
+    line_map = {}
+    renames, renamed_from = {}, {}
+    for block in matcher.get_matching_blocks():
+        for offset in range(block.size):
+            s, t = block.a + offset, block.b + offset
+            line_map.setdefault(source.lines[s], target.lines[t])
+            name, renamed = source.names[s], target.names[t]
+            if name is None:
+                continue
+            # x + y renamed to a + a (or the reverse) is a different computation
+            if renames.setdefault(name, renamed) != renamed or renamed_from.setdefault(renamed, name) != name:
+                return None
+    matched = {line_map[line] for line in source_lines
+               if line in line_map and source_lines[line] == target_lines.get(line_map[line])}
+    if len(matched) != len(source_lines) or matched != set(target_lines):
+        return None
+
+    renames = {name: renamed for name, renamed in renames.items() if renamed != name}
+    pattern = re.compile(r"\b(" + "|".join(map(re.escape, sorted(renames, key=len, reverse=True))) + r")\b") \
+        if renames else None
+
+    def rename(text):
+        return pattern.sub(lambda match: renames[match.group()], text) if pattern is not None else text
+
+    def rename_code(text):
+        # Only code spans: a rename of "a" must not touch "a TypeError" in the prose
+        return _CODE_SPAN.sub(lambda match: rename(match.group()), text)
+
+    def translate(line):
+        # KeyError: a line the model made up
+        return line_map[line]
+
+    remapped = []
+    for item in items:
+        item = dict(item)
+        try:
+            item["location"] = _map_lines(item.get("location", ""), translate)
+        except KeyError:
+            return None
+        item["location"] = rename(item["location"])
+        for field in ("description", "fix"):
+            if isinstance(item.get(field), str):
+                item[field] = rename_code(item[field])
+        remapped.append(item)
+    return remapped
+
+class SimilarityIndex:
+    """
+    Detection answers of analyzed chunks, searchable by near-duplicate code.
+
+    Entries are kept per scope (stage, prompt template and model, see
+    main._ainvoke), so an answer is only reused for the same kind of call.
+
+    Args:
+        path (str): SQLite database file, or None to keep the index in memory
+        threshold (float): Least Jaccard similarity of a reused chunk's shingles
+        max_entries (int): Most chunks kept; the oldest are dropped first
+    """
+
+    # Run eviction after this many writes instead of on every write
+    EVICT_EVERY = 100
+
+    def __init__(self, path=None, threshold=0.9, max_entries=10000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " code TEXT NOT NULL,"
+            " answer TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_code ON chunks (scope, code)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS bands (key TEXT NOT NULL, chunk INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands (key)")
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the index configured by environment variables.
+
+        FOAMAI_SIMILARITY_THRESHOLD enables it (e.g. 0.9); unset or 0 disables it (returns None).
+        FOAMAI_SIMILARITY_PATH sets the SQLite file; an empty value keeps the index in memory.
+        FOAMAI_SIMILARITY_MAX_ENTRIES bounds its size.
+        """
+        threshold = float(os.environ.get("FOAMAI_SIMILARITY_THRESHOLD", "0") or 0)
+        if threshold <= 0:
+            return None
+        return cls(
+            path=os.environ.get("FOAMAI_SIMILARITY_PATH", ".foamai_similarity.sqlite") or None,
+            threshold=threshold,
+            max_entries=int(os.environ.get("FOAMAI_SIMILARITY_MAX_ENTRIES", "10000"))
+        )
+
+    def add(self, scope, code, answer):
+        """Remember the answer given for code; code too short to compare is skipped."""
+        tokens = code_tokens(code)
+        if tokens is None:
+            return
+        hashes = shingles(tokens.tokens)
+        if len(hashes) < MIN_SHINGLES:
+            return
+        keys = band_keys(minhash(hashes), scope)
+        with self._lock:
+            self._db.execute("DELETE FROM bands WHERE chunk IN (SELECT id FROM chunks WHERE scope = ? AND code = ?)",
+                             (scope, code))
+            self._db.execute("DELETE FROM chunks WHERE scope = ? AND code = ?", (scope, code))
+            cursor = self._db.execute("INSERT INTO chunks (scope, code, answer, created) VALUES (?, ?, ?, ?)",
+                                      (scope, code, answer, time.time()))
+            self._db.executemany("INSERT INTO bands (key, chunk) VALUES (?, ?)",
+                                 [(key, cursor.lastrowid) for key in keys])
+            self._db.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.EVICT_EVERY:
+                self._evict()
+
+    def reuse(self, scope, code):
+        """
+        Return the answer of a near duplicate of code, translated to code.
+
+        Returns:
+            tuple: (answer as a JSON array string or None, "reused", "miss" or "unmappable")
+        """
+        target = code_tokens(code)
+        if target is None:
+            return None, "miss"
+        hashes = shingles(target.tokens)
+        if len(hashes) < MIN_SHINGLES:
+            return None, "miss"
+        keys = band_keys(minhash(hashes), scope)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chunks.code, chunks.answer FROM chunks JOIN ("
+                f" SELECT chunk, COUNT(*) AS shared FROM bands WHERE key IN ({', '.join('?' * len(keys))})"
+                " GROUP BY chunk ORDER BY shared DESC LIMIT ?"
+                ") AS candidates ON chunks.id = candidates.chunk ORDER BY candidates.shared DESC",
+                keys + [MAX_CANDIDATES]
+            ).fetchall()
+
+        best = None
+        for source_code, answer in rows:
+            source = code_tokens(source_code)
+            if source is None:
+                continue
+            similarity = jaccard(hashes, shingles(source.tokens))
+            if similarity >= self.threshold and (best is None or similarity > best[0]):
+                best = (similarity, source, answer)
+        if best is None:
+            return None, "miss"
+
+        _, source, answer = best
+        try:
+            items, _ = extract_json_array(answer)
+        except ExtractionError:
+            return None, "miss"
+        items = remap_answer([item for item in items if isinstance(item, dict)], source, target)
+        if items is None:
+            return None, "unmappable"
+        return json.dumps(items), "reused"
+
+    def _evict(self):
+        # Caller holds the lock
+        self._writes_since_evict = 0
+        count = self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM chunks WHERE id IN (SELECT id FROM chunks ORDER BY created ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            self._db.execute("DELETE FROM bands WHERE chunk NOT IN (SELECT id FROM chunks)")
+            self._db.commit()
@@ -0,0 +1,67 @@
+"""
+Single-flight coalescing of identical work in progress.
+
+While a call for a key is running, later calls for the same key wait for
+its result instead of starting the work again. Unlike a cache, nothing is
+kept once the call finishes. Identical requests arriving together (e.g.
+several CI jobs pushing the same file) cost one analysis, and identical
+chunks cost one LLM call.
+"""
+import asyncio
+
+from metrics import COALESCED
+
+class SingleFlight:
+    """
+    Share the result of identical calls that are in flight at the same time.
+
+    The work runs in its own task. A caller that gives up does not cancel
+    it for the others; it is cancelled only when every caller has given up.
+
+    Args:
+        level (str): Label for the coalesced-calls metric, e.g. "request" or "call"
+    """
+
+    def __init__(self, level):
+        self.level = level
+        self._flights = {}  # (loop, key) -> [task, number of callers waiting]
+
+    @property
+    def in_flight(self):
+        return len(self._flights)
+
+    async def do(self, key, work):
+        """
+        Return the result of work() (a coroutine function), or of the identical call already running for key.
+
+        Args:
+            key: Hashable identity of the work
+            work (callable): Starts the work when nothing is in flight for key
+        """
+        loop = asyncio.get_running_loop()
+        # Tasks never cross event loops
+        slot = (loop, key)
+        flight = self._flights.get(slot)
+        if flight is None:
+            flight = [loop.create_task(work()), 0]
+            self._flights[slot] = flight
+            flight[0].add_done_callback(lambda _: self._finish(slot, flight))
+        else:
+            COALESCED.inc(level=self.level)
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if flight[1] == 1:
+                # The last caller gave up. Forget the flight now, so a caller
+                # arriving before the task finishes starts the work again
+                task.cancel()
+                self._finish(slot, flight)
+            raise
+        finally:
+            flight[1] -= 1
+
+    def _finish(self, slot, flight):
+        if self._flights.get(slot) is flight:
+            del self._flights[slot]
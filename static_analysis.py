@@ -0,0 +1,766 @@
+"""
+Static pre-analysis that finds common bugs without calling the LLM.
+
+A single pass over the module's AST reports the bug classes the samples are
+built around:
+
+- Uninitialized variables (names that are never defined, or locals read
+  before their first assignment)
+- Infinite loops (while loops whose condition can never change)
+- Unreachable code (statements after return/raise/break/continue or after
+  an infinite loop)
+- Type errors (adding str and numbers)
+- Syntax errors
+
+Findings use the same type/location/description shape as the LLM output.
+The report also tells the pipeline which chunks are trivially clean (imports,
+constants, stubs), so it can skip the LLM for them.
+"""
+import ast
+import builtins
+from typing import NamedTuple
+
+# Static analysis modes, selectable per request
+STATIC_OFF = "off"              # LLM only
+STATIC_PREFILTER = "prefilter"  # Merge static findings with the LLM's; skip the LLM for trivially clean chunks
+STATIC_TRUST = "trust"          # Also skip the LLM for chunks the static pass already found bugs in
+STATIC_MODES = (STATIC_OFF, STATIC_PREFILTER, STATIC_TRUST)
+
+# Names that are always available without being defined in the module
+_KNOWN_NAMES = set(dir(builtins)) | {
+    "__file__", "__name__", "__doc__", "__spec__", "__loader__", "__package__",
+    "__builtins__", "__path__", "__annotations__", "__dict__", "__module__",
+    "__qualname__", "__class__", "WindowsError",
+}
+
+# Calls whose result does not depend on hidden state, allowed in a loop condition
+_PURE_CALLS = {"len", "abs", "min", "max", "int", "float", "str", "bool", "isinstance", "range", "ord", "chr"}
+
+# Calls that leave the current loop for good
+_EXIT_CALLS = {"exit", "quit", "sys.exit", "os._exit"}
+
+# Calls that can create module-level names invisible to the AST
+_DYNAMIC_NAME_CALLS = {"globals", "exec"}
+
+# Calls that cannot end a `while True` loop by raising
+_HARMLESS_CALLS = {"print"}
+
+_NUMBER_CALLS = {"len", "int", "float", "sum", "abs", "round", "ord"}
+_STRING_CALLS = {"str", "repr", "chr", "format", "input"}
+
+_SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+_TERMINATORS = (ast.Return, ast.Raise, ast.Break, ast.Continue)
+
+class Finding(NamedTuple):
+    line: int
+    type: str
+    description: str
+    suggestion: str
+
+    def to_bug(self):
+        """Return the finding as a bug dict in the BugInfo shape."""
+        return {"type": self.type, "location": f"line {self.line}", "description": self.description}
+
+    def to_fix(self):
+        """Return the finding's suggestion as a fix dict in the FixInfo shape."""
+        return {"bug": f"{self.type} at line {self.line}", "suggestion": self.suggestion}
+
+class StaticReport:
+    """
+    Result of analyzing a whole module.
+
+    Args:
+        tree (ast.Module): The parsed module, or None if it does not parse
+        findings (list): Finding tuples sorted by line
+    """
+
+    def __init__(self, tree, findings):
+        self.tree = tree
+        self.findings = findings
+
+    def findings_between(self, start, end):
+        """Return the findings reported on lines start..end (inclusive)."""
+        return [finding for finding in self.findings if start <= finding.line <= end]
+
+    def is_clean(self, start, end):
+        """
+        Return True if lines start..end contain only trivially correct code.
+
+        Trivial code is imports, docstrings, pass, assignments of literals or
+        names, and classes/functions made only of those (such as stubs and
+        simple getters). Code that does not parse is never clean.
+        """
+        if self.tree is None or self.findings_between(start, end):
+            return False
+        return all(
+            _is_trivial(node) for node in _statements_in_range(self.tree.body, start, end)
+        )
+
+def analyze_code(code):
+    """
+    Run the static analyzer over a module.
+
+    Args:
+        code (str): The Python code to analyze
+
+    Returns:
+        StaticReport: Findings (with lines relative to code) and the parsed tree
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        finding = Finding(
+            e.lineno or 1,
+            "Syntax error",
+            f"The code does not parse: {e.msg}",
+            "Fix the syntax error; nothing in this file can run until it parses."
+        )
+        return StaticReport(None, [finding])
+
+    # Every check works from the same per-scope node lists, so the tree is walked once
+    scopes = _build_scopes(tree)
+    findings = []
+    findings.extend(_check_names(scopes))
+    infinite_loops = _check_loops(scopes, findings)
+    findings.extend(_check_unreachable(scopes, infinite_loops))
+    findings.extend(_check_types(scopes))
+    findings.sort(key=lambda finding: finding.line)
+    return StaticReport(tree, findings)
+
+# ---------------------------------------------------------------------------
+# Scopes and name binding
+# ---------------------------------------------------------------------------
+
+def _walk_scope(nodes):
+    """
+    Yield every node in nodes without entering nested function or class bodies.
+
+    The nested def/class nodes themselves are yielded, along with the parts
+    evaluated in the enclosing scope (decorators, defaults, bases).
+    """
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            children = node.decorator_list + node.args.defaults + [d for d in node.args.kw_defaults if d]
+        elif isinstance(node, ast.ClassDef):
+            children = node.decorator_list + node.bases + [keyword.value for keyword in node.keywords]
+        else:
+            children = list(ast.iter_child_nodes(node))
+        stack.extend(reversed(children))
+
+def _arguments(args):
+    return [arg.arg for arg in args.posonlyargs + args.args + args.kwonlyargs] + [
+        arg.arg for arg in (args.vararg, args.kwarg) if arg
+    ]
+
+def _bound_names(nodes):
+    """Return the names bound directly in a scope made of nodes."""
+    return _bindings(_walk_scope(nodes))
+
+def _bindings(walked):
+    """Return the names bound by an already walked sequence of nodes."""
+    names = set()
+    for node in walked:
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, _SCOPE_NODES):
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, ast.Lambda):
+            # Lambda parameters are treated as part of the enclosing scope
+            names.update(_arguments(node.args))
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+class _Scope:
+    """A module, function or class body, walked once and shared by every check."""
+
+    def __init__(self, node, parent):
+        self.node = node  # None for the module
+        self.parent = parent
+        self.body = node.body
+        self.nodes = list(_walk_scope(self.body))
+        self.is_class = isinstance(node, ast.ClassDef)
+        self.parameters = _arguments(node.args) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) else []
+        self.bound = _bindings(self.nodes) | set(self.parameters)
+        self.declared = set()
+        for child in self.nodes:
+            if isinstance(child, (ast.Global, ast.Nonlocal)):
+                self.declared.update(child.names)
+        # Names that are really local to this scope
+        self.locals = self.bound - self.declared
+        # Names nested functions and lambdas refer to, which they may change
+        # (through nonlocal, or by mutating the object); completed by _build_scopes
+        self.captured = {
+            name.id for child in self.nodes if isinstance(child, ast.Lambda)
+            for name in ast.walk(child.body) if isinstance(name, ast.Name)
+        }
+
+def _build_scopes(tree):
+    """Return the module scope followed by every nested scope, parents first."""
+    module = _Scope(tree, None)
+    module.node = None
+    scopes = [module]
+    for scope in scopes:
+        for child in scope.nodes:
+            if isinstance(child, _SCOPE_NODES):
+                scopes.append(_Scope(child, scope))
+    # Innermost first, so each scope's free names include those of the scopes nested in it
+    for scope in reversed(scopes):
+        if scope.parent is not None:
+            used = {node.id for node in scope.nodes if isinstance(node, ast.Name)} | scope.declared
+            scope.parent.captured |= (used | scope.captured) - scope.locals
+    return scopes
+
+def _check_names(scopes):
+    """Report names that are never defined and locals read before assignment."""
+    findings = []
+    module_names = set(scopes[0].bound)
+    # Star imports and globals()/exec() tricks can define names we cannot see
+    dynamic = False
+    for scope in scopes:
+        # "global x" inside a function defines x at module level
+        for child in scope.nodes:
+            if isinstance(child, ast.Global):
+                module_names.update(child.names)
+            elif isinstance(child, ast.ImportFrom) and any(alias.name == "*" for alias in child.names):
+                dynamic = True
+            elif isinstance(child, ast.Call) and _call_name(child) in _DYNAMIC_NAME_CALLS:
+                dynamic = True
+
+    visible = {}
+    enclosing = {}
+    for scope in scopes:
+        if scope.parent is None:
+            enclosing[scope] = set()
+        elif scope.parent.is_class:
+            # Class bodies are not visible from the methods defined in them
+            enclosing[scope] = enclosing[scope.parent]
+        else:
+            enclosing[scope] = visible[scope.parent]
+        visible[scope] = enclosing[scope] | scope.bound
+
+        if not dynamic:
+            reported = set()
+            for node in scope.nodes:
+                if (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+                        and node.id not in visible[scope] and node.id not in module_names
+                        and node.id not in _KNOWN_NAMES and node.id not in reported):
+                    reported.add(node.id)
+                    findings.append(Finding(
+                        node.lineno,
+                        "Uninitialized variable",
+                        f"'{node.id}' is used but never defined or assigned, so this raises NameError.",
+                        f"Define or assign '{node.id}' before it is used, or pass it in as a parameter."
+                    ))
+
+        if not scope.is_class:
+            findings.extend(_UseBeforeAssignment(scope).run())
+    return findings
+
+class _UseBeforeAssignment(ast.NodeVisitor):
+    """
+    Walk a scope in evaluation order and report locals read before any assignment.
+
+    Branches are over-approximated (an assignment on any path counts) and
+    names assigned anywhere in a loop count as assigned throughout it, so
+    only reads that fail on every path are reported.
+    """
+
+    def __init__(self, scope):
+        self.body = scope.body
+        self.locals = set(scope.locals)
+        if scope.node is None:
+            # Builtins and module dunders exist before module code rebinds them
+            self.locals -= _KNOWN_NAMES
+        self.assigned = set(scope.parameters)
+        # A global read before assignment raises NameError, a local one UnboundLocalError
+        self.error = "NameError" if scope.node is None else "UnboundLocalError"
+        self.reported = set()
+        self.findings = []
+
+    def run(self):
+        for statement in self.body:
+            self.visit(statement)
+        return self.findings
+
+    def _assign_all(self, nodes):
+        self.assigned.update(_bound_names(nodes))
+
+    def visit_Import(self, node):
+        self._assign_all([node])
+
+    visit_ImportFrom = visit_Import
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.assigned.add(node.name)
+        self.generic_visit(node)
+
+    def visit_match_case(self, node):
+        self._assign_all([node.pattern])
+        self.generic_visit(node)
+
+    # Nested scopes: only the parts evaluated here are visited
+    def visit_FunctionDef(self, node):
+        for child in node.decorator_list + node.args.defaults:
+            self.visit(child)
+        self.assigned.add(node.name)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        for child in node.decorator_list + node.bases:
+            self.visit(child)
+        self.assigned.add(node.name)
+
+    def visit_Lambda(self, node):
+        self.assigned.update(_arguments(node.args))
+        self.visit(node.body)
+
+    # Right-hand sides are evaluated before their targets
+    def visit_Assign(self, node):
+        self.visit(node.value)
+        for target in node.targets:
+            self.visit(target)
+
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self.visit(node.value)
+            self.visit(node.target)
+
+    def visit_AugAssign(self, node):
+        self.visit(node.value)
+        if isinstance(node.target, ast.Name):
+            self._load(node.target)
+        self.visit(node.target)
+
+    def visit_NamedExpr(self, node):
+        self.visit(node.value)
+        self.visit(node.target)
+
+    def _visit_comprehension(self, node, *elements):
+        for generator in node.generators:
+            self.visit(generator.iter)
+            self.visit(generator.target)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for element in elements:
+            self.visit(element)
+
+    def visit_ListComp(self, node):
+        self._visit_comprehension(node, node.elt)
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._visit_comprehension(node, node.key, node.value)
+
+    # Loops: anything assigned in the body may come from an earlier iteration
+    def visit_For(self, node):
+        self.visit(node.iter)
+        self._assign_all([node.target] + node.body + node.orelse)
+        self.generic_visit(node)
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node):
+        self._assign_all(node.body + node.orelse)
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self._load(node)
+        else:
+            self.assigned.add(node.id)
+
+    def _load(self, node):
+        if node.id in self.locals and node.id not in self.assigned and node.id not in self.reported:
+            self.reported.add(node.id)
+            self.findings.append(Finding(
+                node.lineno,
+                "Uninitialized variable",
+                f"'{node.id}' is read before it is assigned, so this raises {self.error}.",
+                f"Initialize '{node.id}' (for example to 0 or an empty value) before it is first used."
+            ))
+
+# ---------------------------------------------------------------------------
+# Loops and control flow
+# ---------------------------------------------------------------------------
+
+def _call_name(node):
+    """Return a dotted name for a call's function (e.g. 'sys.exit'), or None."""
+    func = node.func
+    parts = []
+    while isinstance(func, ast.Attribute):
+        parts.append(func.attr)
+        func = func.value
+    if isinstance(func, ast.Name):
+        parts.append(func.id)
+        return ".".join(reversed(parts))
+    return None
+
+def _is_truthy_constant(node):
+    return isinstance(node, ast.Constant) and bool(node.value)
+
+def _loop_exits(body):
+    """Return (has_break, has_other_exit) for a loop body, ignoring nested loops and scopes."""
+    has_break = False
+    has_other_exit = False
+    stack = list(body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        if isinstance(node, ast.Break):
+            has_break = True
+        elif isinstance(node, (ast.Return, ast.Raise, ast.Yield, ast.YieldFrom, ast.Await)):
+            has_other_exit = True
+        elif isinstance(node, ast.Call) and _call_name(node) in _EXIT_CALLS:
+            has_other_exit = True
+        if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            # A break inside a nested loop only leaves that loop
+            has_other_exit = has_other_exit or _loop_exits(node.body)[1]
+            stack.extend(node.orelse)
+            continue
+        stack.extend(ast.iter_child_nodes(node))
+    return has_break, has_other_exit
+
+def _condition_names(test):
+    """
+    Return the variable names a loop condition depends on, or None if the
+    condition may change for reasons invisible to a local analysis.
+    """
+    names = []
+    for node in ast.walk(test):
+        if isinstance(node, (ast.Attribute, ast.Await, ast.NamedExpr, ast.Yield, ast.YieldFrom)):
+            return None
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in _PURE_CALLS:
+                return None
+        elif isinstance(node, ast.Name) and node.id not in names:
+            names.append(node.id)
+    # Functions called in the condition are not loop variables
+    called = {node.func.id for node in ast.walk(test) if isinstance(node, ast.Call)}
+    return [name for name in names if name not in called]
+
+def _method_aliases(nodes):
+    """
+    Return {alias: names} for the locals bound to an attribute of other names.
+
+    Calling an alias such as ``pop = stack.pop`` calls a method of stack.
+    """
+    aliases = {}
+    for node in nodes:
+        if not isinstance(node, ast.Assign):
+            continue
+        for target in node.targets:
+            pairs = [(target, node.value)]
+            if isinstance(target, ast.Tuple) and isinstance(node.value, ast.Tuple):
+                pairs = zip(target.elts, node.value.elts)
+            for name, value in pairs:
+                if isinstance(name, ast.Name) and isinstance(value, ast.Attribute):
+                    aliases.setdefault(name.id, set()).update(_root_names(value.value))
+    return aliases
+
+def _modified_names(body, aliases=None):
+    """
+    Return the names a loop body may modify, or None if it may modify anything.
+
+    Besides assignments, a name counts as modified when one of its methods is
+    called (directly or through an alias from _method_aliases), one of its
+    items/attributes is assigned, or it is passed to a call.
+    """
+    aliases = aliases or {}
+    modified = set()
+    for node in _walk_scope(body):
+        if isinstance(node, (ast.Global, ast.Nonlocal, ast.Yield, ast.YieldFrom, ast.Await)):
+            return None
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            modified.add(node.id)
+        elif isinstance(node, (ast.Attribute, ast.Subscript)) and not isinstance(node.ctx, ast.Load):
+            modified.update(_root_names(node))
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Attribute):
+                modified.update(_root_names(node.func.value))
+            elif isinstance(node.func, ast.Name) and node.func.id in aliases:
+                modified.update(aliases[node.func.id])
+            for argument in node.args + [keyword.value for keyword in node.keywords]:
+                modified.update(_root_names(argument))
+    modified.update(_bound_names(body))
+    return modified
+
+def _root_names(node):
+    return {child.id for child in ast.walk(node) if isinstance(child, ast.Name)}
+
+def _infinite_loop(node, local_names, aliases=None):
+    """Return a Finding if the while loop node can never terminate, else None."""
+    has_break, has_other_exit = _loop_exits(node.body)
+    if has_break:
+        return None
+
+    calls = {_call_name(child) for child in _walk_scope(node.body) if isinstance(child, ast.Call)}
+    if _is_truthy_constant(node.test):
+        # Any other call could be the way out (by raising), as in server loops
+        if has_other_exit or calls - _HARMLESS_CALLS:
+            return None
+        return Finding(
+            node.lineno,
+            "Infinite loop",
+            f"`while {ast.unparse(node.test)}` has no break, return or raise, so it never exits.",
+            "Add a break (or return) once the loop's work is done, or loop on a real condition."
+        )
+
+    names = _condition_names(node.test)
+    if not names:
+        return None
+    modified = _modified_names(node.body, aliases)
+    if modified is None or modified.intersection(names):
+        return None
+    # Non-local state could be changed by any function the body calls
+    if calls and any(name not in local_names for name in names):
+        return None
+
+    variables = ", ".join(f"'{name}'" for name in names)
+    verb = "is" if len(names) == 1 else "are"
+    description = (
+        f"The condition `{ast.unparse(node.test)}` never changes: {variables} {verb} not "
+        f"modified inside the loop, so once entered it runs forever"
+    )
+    if has_other_exit:
+        description += " unless an early return happens on the first pass"
+    return Finding(
+        node.lineno,
+        "Infinite loop",
+        description + ".",
+        f"Update {variables} inside the loop body (for example, increment the index) or add a break."
+    )
+
+def _check_loops(scopes, findings):
+    """Append infinite-loop findings and return the set of infinite While nodes."""
+    infinite = set()
+
+    # Loops inside try/except may be left by an exception on purpose
+    guarded = set()
+    for scope in scopes:
+        for node in scope.nodes:
+            if isinstance(node, ast.Try) and node.handlers:
+                for statement in node.body:
+                    guarded.update(child for child in ast.walk(statement) if isinstance(child, ast.While))
+
+    for scope in scopes:
+        aliases = _method_aliases(scope.nodes)
+        for node in scope.nodes:
+            if isinstance(node, ast.While) and node not in guarded:
+                # A name a closure refers to may change whenever the loop calls something
+                finding = _infinite_loop(node, scope.locals - scope.captured, aliases)
+                if finding is not None:
+                    findings.append(finding)
+                    infinite.add(node)
+    return infinite
+
+def _statement_lists(scopes):
+    """Yield every list of statements (bodies, else/finally blocks, handlers) in the tree."""
+    for scope in scopes:
+        yield scope.body
+        for node in scope.nodes:
+            if isinstance(node, _SCOPE_NODES):
+                # Its body is yielded by its own scope
+                continue
+            for field in ("body", "orelse", "finalbody"):
+                statements = getattr(node, field, None)
+                if isinstance(statements, list) and statements and isinstance(statements[0], ast.stmt):
+                    yield statements
+
+def _check_unreachable(scopes, infinite_loops):
+    """Report the first statement after a terminator or an infinite loop in each block."""
+    findings = []
+    for statements in _statement_lists(scopes):
+        for statement, following in zip(statements, statements[1:]):
+            if isinstance(statement, _TERMINATORS):
+                keyword = type(statement).__name__.lower()
+                findings.append(Finding(
+                    following.lineno,
+                    "Unreachable code",
+                    f"This code follows the {keyword} statement on line {statement.lineno} and can never run.",
+                    f"Remove the unreachable code or move it before the {keyword} statement."
+                ))
+                break
+            if statement in infinite_loops:
+                findings.append(Finding(
+                    following.lineno,
+                    "Unreachable code",
+                    f"This code follows the infinite loop on line {statement.lineno} and can never run.",
+                    "Fix the loop so that it terminates; this code then becomes reachable."
+                ))
+                break
+    return findings
+
+# ---------------------------------------------------------------------------
+# Type errors
+# ---------------------------------------------------------------------------
+
+def _kind(node, env):
+    """Return 'str', 'number' or None for an expression, using simple local inference."""
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, str):
+            return "str"
+        if isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return "number"
+        return None
+    if isinstance(node, ast.JoinedStr):
+        return "str"
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        if node.func.id in _NUMBER_CALLS:
+            return "number"
+        if node.func.id in _STRING_CALLS:
+            return "str"
+        return None
+    if isinstance(node, ast.Name):
+        return env.get(node.id)
+    if isinstance(node, ast.BinOp):
+        left = _kind(node.left, env)
+        right = _kind(node.right, env)
+        if left == right == "number":
+            return "number"
+        if left == right == "str" and isinstance(node.op, ast.Add):
+            return "str"
+    return None
+
+def _scope_kinds(scope):
+    """
+    Infer 'str'/'number' for names in a scope whose every binding agrees.
+
+    Only plain assignments, augmented assignments and for-loops over range()
+    are understood; any other kind of binding makes the name's type unknown.
+    """
+    kinds = {}
+    unknown = set(scope.parameters)
+    understood = set()  # ids of the Name nodes whose binding was understood
+    for node in scope.nodes:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            target = node.targets[0]
+            kind = _kind(node.value, {})
+        elif (isinstance(node, (ast.For, ast.AsyncFor)) and isinstance(node.target, ast.Name)
+                and isinstance(node.iter, ast.Call) and isinstance(node.iter.func, ast.Name)
+                and node.iter.func.id == "range"):
+            target = node.target
+            kind = "number"
+        elif isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name):
+            # Keeps the type it already has; a mismatch is reported by _check_types
+            understood.add(id(node.target))
+            continue
+        else:
+            continue
+        understood.add(id(target))
+        if kind is None or kinds.get(target.id, kind) != kind:
+            unknown.add(target.id)
+        else:
+            kinds[target.id] = kind
+
+    name_bindings = set()
+    for node in scope.nodes:
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            name_bindings.add(node.id)
+            if id(node) not in understood:
+                unknown.add(node.id)
+    # Imports, defs, "except ... as" and other bindings that are not Name nodes
+    unknown.update(scope.bound - name_bindings - set(scope.parameters))
+    return {name: kind for name, kind in kinds.items() if name not in unknown}
+
+def _check_types(scopes):
+    """Report str/number arithmetic that always raises TypeError."""
+    findings = []
+    for scope in scopes:
+        env = _scope_kinds(scope)
+        for node in scope.nodes:
+            if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)):
+                left, right = _kind(node.left, env), _kind(node.right, env)
+            elif isinstance(node, ast.AugAssign) and isinstance(node.op, (ast.Add, ast.Sub)):
+                left, right = _kind(node.target, env), _kind(node.value, env)
+            else:
+                continue
+            if left is None or right is None:
+                continue
+            if left != right or (left == "str" and isinstance(node.op, ast.Sub)):
+                operation = "add" if isinstance(node.op, ast.Add) else "subtract"
+                left_name = "int" if left == "number" else left
+                right_name = "int" if right == "number" else right
+                findings.append(Finding(
+                    node.lineno,
+                    "Type error",
+                    f"Cannot {operation} {left_name} and {right_name}: `{ast.unparse(node)}` raises TypeError.",
+                    "Convert the number with str() (or use an f-string) before combining it with text."
+                ))
+    return findings
+
+# ---------------------------------------------------------------------------
+# Trivially clean code
+# ---------------------------------------------------------------------------
+
+def _is_simple_value(node):
+    """Return True for literals, names, attribute chains and containers of them."""
+    if isinstance(node, (ast.Constant, ast.Name)):
+        return True
+    if isinstance(node, ast.Attribute):
+        return _is_simple_value(node.value)
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        return all(_is_simple_value(element) for element in node.elts)
+    if isinstance(node, ast.Dict):
+        return all(_is_simple_value(part) for part in node.keys + node.values if part is not None)
+    return False
+
+def _is_trivial(node):
+    """Return True if a statement cannot plausibly contain one of the bugs we look for."""
+    if isinstance(node, (ast.Import, ast.ImportFrom, ast.Pass, ast.Global, ast.Nonlocal)):
+        return True
+    if isinstance(node, ast.Expr):
+        # Docstrings and bare ellipses
+        return isinstance(node.value, ast.Constant)
+    if isinstance(node, ast.Assign):
+        return _is_simple_value(node.value)
+    if isinstance(node, ast.AnnAssign):
+        return node.value is None or _is_simple_value(node.value)
+    if isinstance(node, ast.Return):
+        return node.value is None or _is_simple_value(node.value)
+    if isinstance(node, ast.Raise):
+        return node.exc is None or _is_simple_value(node.exc) or (
+            isinstance(node.exc, ast.Call) and _is_simple_value(node.exc.func)
+            and all(_is_simple_value(argument) for argument in node.exc.args)
+        )
+    if isinstance(node, ast.ClassDef):
+        return all(_is_simple_value(base) for base in node.bases) and all(
+            _is_trivial(statement) for statement in node.body
+        )
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return all(_is_trivial(statement) for statement in node.body)
+    return False
+
+def _statements_in_range(statements, start, end):
+    """
+    Yield the statements overlapping lines start..end.
+
+    A class that only partly overlaps (because the chunker split it) is
+    replaced by its overlapping members; any other partly overlapping
+    statement is yielded whole.
+    """
+    for statement in statements:
+        first = min([statement.lineno] + [d.lineno for d in getattr(statement, "decorator_list", [])])
+        last = statement.end_lineno
+        if last < start or first > end:
+            continue
+        if isinstance(statement, ast.ClassDef) and (first < start or last > end):
+            yield from _statements_in_range(statement.body, start, end)
+        else:
+            yield statement
@@ -0,0 +1,19 @@
+import pytest
+
+import main
+
+# Module globals that main.use_llm replaces
+_MODEL_GLOBALS = ("BACKEND", "llm", "llm_is_async", "detect_chain", "fix_chain", "fused_chain", "repair_chain",
+                  "_chains_by_stage")
+
+@pytest.fixture
+def use_llm(monkeypatch):
+    """main.use_llm for one test: the model and chains it builds are undone afterwards."""
+    def use(model, backend=None):
+        namespace = vars(main)
+        for name in _MODEL_GLOBALS:
+            # setitem, not setattr: reading a chain through main.__getattr__ would build the real model
+            monkeypatch.setitem(namespace, name, namespace.get(name))
+        main.use_llm(model, backend)
+        return model
+    return use
@@ -0,0 +1,75 @@
+"""The backend registry and the offline fake models."""
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import main
+from backends import (BACKENDS, FakeBackendError, FakeChatModel, SyncFakeChatModel, create_llm,
+                      register_backend)
+
+NAME = "def greet(name):\n    return 'Hello ' + nam\n"
+
+@pytest.fixture(autouse=True)
+def no_cassette(monkeypatch):
+    monkeypatch.delenv("FOAMAI_CASSETTE", raising=False)
+    monkeypatch.delenv("FOAMAI_CASSETTE_MODE", raising=False)
+    monkeypatch.delenv("FOAMAI_BACKEND", raising=False)
+
+def test_create_llm_builds_registered_backends(monkeypatch):
+    monkeypatch.setitem(BACKENDS, "test", None)
+    register_backend("test")(lambda model_name, temperature: (model_name, temperature))
+
+    assert create_llm("test", model_name="m", temperature=0.5) == ("m", 0.5)
+    monkeypatch.setenv("FOAMAI_BACKEND", "test")
+    assert create_llm() == ("gpt-3.5-turbo", 0.3)
+    monkeypatch.setenv("FOAMAI_FAKE_LATENCY", "0")
+    assert isinstance(create_llm("fake"), FakeChatModel)
+
+def test_create_llm_rejects_unknown_backends_and_cassette_modes(tmp_path, monkeypatch):
+    with pytest.raises(ValueError, match="Unknown backend: nope"):
+        create_llm("nope")
+
+    monkeypatch.setenv("FOAMAI_CASSETTE", str(tmp_path / "calls.jsonl.gz"))
+    monkeypatch.setenv("FOAMAI_CASSETTE_MODE", "rewind")
+    with pytest.raises(ValueError, match="Unknown cassette mode: rewind"):
+        create_llm("fake")
+
+def test_fake_model_tells_stages_apart():
+    snippets = '<snippet id="S1">\n' + NAME + '\n</snippet>'
+    assert FakeChatModel.stage(main.DETECT_TEMPLATE.format(code=NAME)) == "detect"
+    assert FakeChatModel.stage(main.FUSED_TEMPLATE.format(code=NAME)) == "fused"
+    assert FakeChatModel.stage(main.FIX_TEMPLATE.format(bugs="[]")) == "fix"
+    assert FakeChatModel.stage(main.BATCH_DETECT_TEMPLATE.format(snippets=snippets)) == "batch_detect"
+    assert FakeChatModel.stage(main.BATCH_FUSED_TEMPLATE.format(snippets=snippets)) == "batch_fused"
+    assert FakeChatModel.stage(main.REPAIR_TEMPLATE.format(answer="[", keys="type")) == "repair"
+
+def test_fake_model_answers_from_the_static_analyzer_and_counts_calls():
+    model = FakeChatModel(latency=0, tokens_per_second=1e9)
+    answer = json.loads(model.respond(main.DETECT_TEMPLATE.format(code=NAME)))
+    assert [(bug["type"], bug["location"]) for bug in answer] == [("Uninitialized variable", "line 2")]
+
+    bugs = json.dumps([{"id": 1, "type": "Uninitialized variable", "description": "nam is undefined"}])
+    message = model.invoke([HumanMessage(content=main.FIX_TEMPLATE.format(bugs=bugs))])
+    fixes = json.loads(message.content)
+    assert fixes == [{"bug_id": 1, "bug": "nam is undefined", "suggestion": "Fix the uninitialized variable."}]
+    assert model.stats["calls"] == 1 and model.stats["prompt_tokens"] > 0
+    assert message.usage_metadata["output_tokens"] == model.stats["completion_tokens"]
+
+def test_fake_model_canned_responses_and_injected_failures():
+    prompt = [HumanMessage(content=main.DETECT_TEMPLATE.format(code=NAME))]
+    assert FakeChatModel(latency=0, responses={"detect": "[]"}).invoke(prompt).content == "[]"
+
+    failing = FakeChatModel(latency=0, failure_rate=1.0)
+    with pytest.raises(FakeBackendError):
+        asyncio.run(failing.ainvoke(prompt))
+    assert failing.stats["calls"] == 1 and failing.stats["failures"] == 1
+
+def test_sync_fake_model_answers_async_calls_through_its_blocking_path():
+    model = SyncFakeChatModel(latency=0, tokens_per_second=1e9)
+    prompt = [HumanMessage(content=main.DETECT_TEMPLATE.format(code=NAME))]
+
+    assert SyncFakeChatModel._agenerate is not FakeChatModel._agenerate
+    assert asyncio.run(model.ainvoke(prompt)).content == model.invoke(prompt).content
+    assert model.stats["calls"] == 2
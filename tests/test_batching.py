@@ -0,0 +1,107 @@
+"""When MicroBatcher sends a batch, and how main._run_batch splits a multi-snippet answer back out."""
+import asyncio
+import json
+import time
+
+import pytest
+
+import main
+from batching import MicroBatcher
+
+def recording_batcher(**options):
+    batches = []
+
+    async def run_batch(key, items):
+        batches.append(list(items))
+        return [item.upper() if item != "fail" else ValueError(item) for item in items]
+
+    return MicroBatcher(run_batch, **options), batches
+
+def test_a_full_batch_is_sent_without_waiting_for_the_window():
+    batcher, batches = recording_batcher(window=10, max_size=3)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit("k", item) for item in "abc")), 1)
+
+    assert asyncio.run(run()) == ["A", "B", "C"]
+    assert batches == [["a", "b", "c"]]
+
+def test_an_item_that_would_exceed_max_chars_starts_a_new_batch():
+    batcher, batches = recording_batcher(window=0.01, max_size=8, max_chars=6)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit("k", item) for item in ("aa", "bb", "ccc", "dddddd")))
+
+    assert asyncio.run(run()) == ["AA", "BB", "CCC", "DDDDDD"]
+    # An item as large as the budget goes alone, at once
+    assert batches == [["aa", "bb"], ["ccc"], ["dddddd"]]
+
+def test_the_window_collects_items_per_key():
+    batcher, batches = recording_batcher(window=0.05, max_size=8)
+
+    async def run():
+        started = time.monotonic()
+        first = asyncio.ensure_future(batcher.submit("k", "a"))
+        await asyncio.sleep(0.01)
+        results = await asyncio.gather(first, batcher.submit("k", "b"), batcher.submit("other", "c"))
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(run())
+    assert results == ["A", "B", "C"]
+    assert sorted(batches) == [["a", "b"], ["c"]]
+    assert 0.05 <= elapsed < 0.5
+
+def test_a_failed_item_only_fails_its_caller():
+    batcher, _ = recording_batcher(window=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit("k", item) for item in ("a", "fail", "b")),
+                                    return_exceptions=True)
+
+    first, failed, last = asyncio.run(run())
+    assert (first, last) == ("A", "B") and isinstance(failed, ValueError)
+
+@pytest.fixture
+def llm_answers(monkeypatch):
+    """Replace main._call_llm with canned answers by stage; a code of "boom" fails its call."""
+    answers = {}
+    calls = []
+
+    async def call_llm(stage, inputs):
+        calls.append(stage)
+        if inputs.get("code") == "boom":
+            raise RuntimeError("backend down")
+        return answers[stage] if stage in answers else json.dumps([{"type": "Bug", "location": "line 1",
+                                                                   "description": inputs["code"]}])
+
+    monkeypatch.setattr(main, "_call_llm", call_llm)
+    return answers, calls
+
+def bug(snippet, description):
+    return {"snippet": snippet, "type": "Bug", "location": "line 1", "description": description}
+
+def test_a_batched_answer_is_split_by_snippet_id(llm_answers):
+    answers, calls = llm_answers
+    answers["batch_detect"] = json.dumps([
+        bug("S1", "first"), bug("2", "second, bare number"), bug(3, "third, number"), bug(" s2 ", "second again"),
+        bug("S9", "unknown snippet"), bug("0", "no snippet 0"),
+        {"type": "Bug", "location": "line 1", "description": "no snippet at all"},
+    ])
+    batch = [{"code": "a"}, {"code": "b"}, {"code": "c"}, {"code": "d"}]
+
+    results = [json.loads(result) for result in asyncio.run(main._run_batch("detect", batch))]
+
+    assert calls == ["batch_detect"]
+    assert [[item["description"] for item in result] for result in results] == [
+        ["first"], ["second, bare number", "second again"], ["third, number"], []]
+    assert all("snippet" not in item for result in results for item in result)
+
+def test_an_unusable_batched_answer_falls_back_to_one_call_per_snippet(llm_answers):
+    answers, calls = llm_answers
+    answers["batch_detect"] = "Sorry, I cannot help with that."
+
+    first, failed, last = asyncio.run(main._run_batch("detect", [{"code": "a"}, {"code": "boom"}, {"code": "c"}]))
+
+    assert calls == ["batch_detect", "detect", "detect", "detect"]
+    assert json.loads(first)[0]["description"] == "a" and json.loads(last)[0]["description"] == "c"
+    assert isinstance(failed, RuntimeError)
@@ -0,0 +1,57 @@
+import pytest
+
+import cache
+from cache import ResultCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.time for the cache module."""
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+def test_memory_tier_drops_the_least_recently_used(clock):
+    results = ResultCache(memory_size=2)
+    results.set("a", "1")
+    results.set("b", "2")
+    assert results.get("a") == "1"
+    results.set("c", "3")
+    assert results.get("b") is None
+    assert results.get("a") == "1" and results.get("c") == "3"
+    assert results.stats()["memory_entries"] == 2
+
+def test_entries_expire_after_max_age(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    results = ResultCache(path, max_age=60)
+    results.set("old", "1")
+    clock[0] += 30
+    results.set("new", "2")
+    clock[0] += 40
+    # Expired in memory and on disk
+    assert results.get("old") is None
+    assert results.get("new") == "2"
+
+    # Opening the database evicts what expired meanwhile
+    clock[0] += 60
+    reopened = ResultCache(path, max_age=60)
+    assert reopened.stats()["disk_entries"] == 0
+    assert reopened.stats()["evictions"] == 2
+
+def test_disk_tier_keeps_the_most_recently_used(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    results = ResultCache(path, memory_size=1, max_entries=3)
+    results.EVICT_EVERY = 5
+    for key in ("k0", "k1", "k2"):
+        clock[0] += 1
+        results.set(key, key)
+    clock[0] += 1
+    # Read from disk, which marks k0 as used
+    assert results.get("k0") == "k0"
+    for key in ("k3", "k4"):
+        clock[0] += 1
+        results.set(key, key)
+    assert results.stats()["disk_entries"] == 3
+    assert results.stats()["evictions"] == 2
+
+    reopened = ResultCache(path, memory_size=1, max_entries=3)
+    assert [reopened.get(key) for key in ("k0", "k1", "k2", "k3", "k4")] == ["k0", None, None, "k3", "k4"]
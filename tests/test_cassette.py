@@ -0,0 +1,66 @@
+"""Recording completions to a cassette and replaying them without a backend."""
+import asyncio
+
+import pytest
+
+import main
+from backends import CassetteChatModel, FakeChatModel, create_llm
+from cassette import Cassette, CassetteMiss
+from metrics import LLM_BATCH_SIZE
+
+SNIPPETS = [
+    "def count():\n    i = 0\n    while i < 10:\n        print('counting')\n    return i\n",
+    "def greet(name):\n    return 'Hello ' + nam\n",
+]
+
+@pytest.fixture(autouse=True)
+def no_reuse(monkeypatch):
+    # Every call must reach the cassette
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    monkeypatch.setitem(vars(main), "_batcher", None)
+
+def analyze_all():
+    async def run():
+        return await asyncio.gather(*(main.detect_bugs_async(code, static_analysis="off") for code in SNIPPETS))
+    return asyncio.run(run())
+
+def record(path, use_llm):
+    inner = FakeChatModel(latency=0, tokens_per_second=1e9)
+    cassette = Cassette(path)
+    use_llm(CassetteChatModel(cassette=cassette, inner=inner), backend="fake")
+    results = analyze_all()
+    cassette.compact()
+    return results, inner
+
+def test_replay_returns_the_recorded_answers(tmp_path, monkeypatch, use_llm):
+    path = str(tmp_path / "calls.jsonl.gz")
+    recorded, inner = record(path, use_llm)
+    assert inner.stats["calls"] == 4  # detect and fix for each snippet
+
+    monkeypatch.setenv("FOAMAI_CASSETTE", path)
+    monkeypatch.delenv("FOAMAI_CASSETTE_MODE", raising=False)
+    replayer = create_llm("no-such-backend")
+    # Replaying needs no backend
+    assert isinstance(replayer, CassetteChatModel) and replayer.inner is None
+    assert len(replayer.cassette) == 4
+    use_llm(replayer, backend="fake")
+    assert analyze_all() == recorded
+
+def test_an_unrecorded_prompt_raises_cassette_miss(tmp_path):
+    replayer = CassetteChatModel(cassette=Cassette(str(tmp_path / "empty.jsonl.gz")))
+    with pytest.raises(CassetteMiss, match="No completion recorded"):
+        replayer.invoke("Analyze this Python code")
+    with pytest.raises(CassetteMiss):
+        asyncio.run(replayer.ainvoke("Analyze this Python code"))
+
+def test_a_missing_batch_is_replayed_snippet_by_snippet(tmp_path, use_llm):
+    path = str(tmp_path / "calls.jsonl.gz")
+    recorded, _ = record(path, use_llm)
+
+    use_llm(CassetteChatModel(cassette=Cassette(path)), backend="fake")
+    main.enable_batching(window=0.05, max_size=8)
+    batches = LLM_BATCH_SIZE.count(chain="detect")
+    assert analyze_all() == recorded
+    # The two detect calls were sent as one batch first, which the cassette never saw
+    assert LLM_BATCH_SIZE.count(chain="detect") == batches + 1
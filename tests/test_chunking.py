@@ -0,0 +1,93 @@
+import dataclasses
+import datetime
+import heapq
+
+from chunking import Chunk, chunk_code, relocate_location, relocate_text, shift_text
+from normalize import normalize_code, to_original_lines
+
+BODY = "\n".join(f"        total += item * {i}" for i in range(40))
+CODE = f'''import os
+
+class Report:
+    """A report."""
+
+    def total(self,
+              items):
+        total = 0
+{BODY}
+        return total
+
+    def name(self):
+        return "report"
+'''
+
+def test_later_pieces_repeat_enclosing_headers():
+    first, middle, last = chunk_code(CODE, 600)
+    # total() is split to fill the first chunk
+    assert first.start_line == 1 and "def total(self," in first.text
+    # Inside total(): the class line and the whole signature come first
+    assert middle.text.startswith("class Report:\n    def total(self,\n              items):\n")
+    assert middle.lines[:4] == (3, 6, 7, middle.start_line)
+
+def test_small_remainder_goes_without_headers():
+    *_, last = chunk_code(CODE, 600)
+    assert last.lines == ()
+    assert last.text.startswith("        total += item * ")
+    assert last.text.endswith('        return "report"\n')
+
+def test_every_line_is_analyzed_once():
+    chunks = chunk_code(CODE, 600)
+    own = []
+    for chunk in chunks:
+        numbers = chunk.lines or range(chunk.start_line, chunk.end_line + 1)
+        own.extend(number for number in numbers if number >= chunk.start_line)
+    assert sorted(own) == list(range(1, len(CODE.split("\n")) + 1))
+
+def test_lines_map_back_through_headers():
+    lines = CODE.split("\n")
+    for chunk in chunk_code(CODE, 600):
+        for number, text in enumerate(chunk.text.split("\n"), 1):
+            assert lines[chunk.original_line(number) - 1] == text
+    chunk = next(chunk for chunk in chunk_code(CODE, 600) if chunk.lines)
+    # Line 4 of the chunk is its first own line
+    assert relocate_location("line 4", chunk) == f"line {chunk.start_line}"
+    assert relocate_location("off-by-one", chunk) == f"lines {chunk.start_line}-{chunk.end_line}: off-by-one"
+
+def test_normalized_chunks_keep_headers_mapped():
+    code = CODE.replace("        total = 0\n", "        total = 0\n\n\n")
+    normalized = normalize_code(code)
+    original = code.split("\n")
+    for chunk in chunk_code(normalized.text, 600):
+        chunk = to_original_lines(chunk, normalized.line_map)
+        for number, text in enumerate(chunk.text.split("\n"), 1):
+            assert original[chunk.original_line(number) - 1].strip() == text.strip()
+
+def test_line_references_in_text_are_relocated():
+    # Normalization dropped blank lines: chunk lines 1-3 are lines 1, 5 and 9
+    chunk = Chunk("a\nb\nc", 1, (1, 5, 9))
+    text = "follows the infinite loop on line 3 (lines 1-2), retried 3 times"
+    assert relocate_text(text, chunk) == "follows the infinite loop on line 9 (lines 1-5), retried 3 times"
+    assert shift_text("see line 9", -8) == "see line 1"
+    assert relocate_text(None, chunk) is None
+
+def _assert_within_budget(code, max_length):
+    lines = code.split("\n")
+    for chunk in chunk_code(code, max_length):
+        if len(chunk.text) > max_length:
+            # Only a single line longer than the budget on its own may overflow
+            own = [number for number in chunk.lines or (chunk.start_line,) if number >= chunk.start_line]
+            assert own == [chunk.start_line] and chunk.end_line == chunk.start_line
+            assert len(lines[chunk.start_line - 1]) > max_length
+
+def test_chunks_stay_within_budget_under_long_comments():
+    comments = "\n".join(f"# Note {i}: {'x' * 60}" for i in range(60))
+    code = f"{comments}\nclass Report:\n{BODY}\n" + "# " + "y" * 700 + "\ndef name():\n    return 1\n"
+    for max_length in (500, 2000):
+        _assert_within_budget(code, max_length)
+
+def test_stdlib_modules_stay_within_budget():
+    for module in (dataclasses, datetime, heapq):
+        with open(module.__file__, encoding="utf-8") as source:
+            code = source.read()
+        for max_length in (500, 2000):
+            _assert_within_budget(code, max_length)
@@ -0,0 +1,48 @@
+"""Chain calls cut short by a deadline must stop, not finish (and spend tokens) in the background."""
+import asyncio
+import time
+
+import pytest
+from pydantic import PrivateAttr
+
+import main
+from backends import FakeChatModel
+
+class TimedFakeChatModel(FakeChatModel):
+    """FakeChatModel that notes when each call finishes."""
+
+    _finished: list = PrivateAttr(default_factory=list)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+        self._finished.append(time.monotonic())
+        return result
+
+@pytest.fixture
+def slow_model(monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    monkeypatch.setattr(main, "_batcher", None)
+    return use_llm(TimedFakeChatModel(latency=0.5), backend="fake")
+
+def snippet(i):
+    return f"def f{i}(x):\n    return x / 0\n"
+
+async def analyze_all(count, budget):
+    deadline = time.monotonic() + budget
+    results = await asyncio.gather(*(
+        main.detect_bugs_async(snippet(i), static_analysis="off", deadline=deadline) for i in range(count)
+    ))
+    # Long enough for an abandoned call to have finished
+    await asyncio.sleep(1)
+    return deadline, results
+
+@pytest.mark.parametrize("batching", [False, True])
+def test_no_call_finishes_after_the_deadline(slow_model, batching):
+    if batching:
+        main.enable_batching(window=0.01, max_size=8)
+    deadline, results = asyncio.run(analyze_all(4, 0.2))
+
+    assert all(result["incomplete"] for result in results)
+    assert slow_model.stats["calls"] == (1 if batching else 4)
+    assert [finished for finished in slow_model._finished if finished > deadline] == []
@@ -0,0 +1,146 @@
+"""The HTTP API on top of the pipeline, with the fake backend."""
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import main
+import metrics
+from backends import FakeChatModel
+
+LOOP = "def count():\n    i = 0\n    while i < 10:\n        print('counting')\n    return i\n"
+NAME = "def greet(name):\n    return 'Hello ' + nam\n"
+
+@pytest.fixture
+def model(monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    monkeypatch.setitem(vars(main), "_batcher", None)
+    return use_llm(FakeChatModel(latency=0, tokens_per_second=1e9), backend="fake")
+
+@pytest.fixture
+def client():
+    # Without the lifespan: no job workers and no batching
+    return TestClient(api.app)
+
+def test_batch_analyzes_identical_items_once(model, client):
+    items = [{"code": code, "static_analysis": "off"} for code in (LOOP, NAME, LOOP)]
+    response = client.post("/detect-bugs/batch", json={"items": items})
+
+    assert response.status_code == 200
+    body = response.json()
+    first, second, third = body["results"]
+    assert first == third and first != second
+    assert [bug["type"] for bug in first["bugs"]] == ["Infinite loop", "Unreachable code"]
+    # detect and fix per item, but the third item's calls are the first's
+    assert body["llm_calls"] == 6 and body["unique_llm_calls"] == 4
+    assert model.stats["calls"] == 4
+
+def test_a_failed_batch_item_carries_its_own_error(model, client, monkeypatch):
+    analyze = main.detect_bugs_async
+
+    async def failing(code, **options):
+        if code == "boom":
+            raise RuntimeError("backend down")
+        return await analyze(code, **options)
+
+    monkeypatch.setattr(main, "detect_bugs_async", failing)
+    items = [{"code": NAME, "static_analysis": "off"}, {"code": "boom"}]
+    response = client.post("/detect-bugs/batch", json={"items": items})
+
+    assert response.status_code == 200
+    ok, failed = response.json()["results"]
+    assert failed == {"bugs": None, "fixes": None, "error": "Error detecting bugs: backend down"}
+    assert ok["error"] is None and [bug["type"] for bug in ok["bugs"]] == ["Uninitialized variable"]
+
+def test_stream_sends_bugs_before_their_fixes_and_ends_with_a_summary(model, client):
+    response = client.post("/detect-bugs/stream", json={"code": LOOP, "static_analysis": "off"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["start", "bugs", "fixes", "summary"]
+    assert [bug["id"] for bug in events[1]["bugs"]] == [fix["bug_id"] for fix in events[2]["fixes"]]
+    assert events[3]["bugs"] == 2 and events[3]["fixes"] == 2 and not events[3]["incomplete"]
+
+class _DisconnectingRequest:
+    """Stands in for the HTTP request of a client that leaves after the first event."""
+
+    def __init__(self):
+        self.checks = 0
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.checks > 1
+
+def test_stream_cancels_outstanding_chunks_when_the_client_disconnects(model, monkeypatch):
+    # Several chunks: the first answers, the others never do
+    monkeypatch.setitem(vars(main), "CHUNK_SIZE", 60)
+    detect_chunk = main._detect_chunk
+    cancelled = []
+
+    async def stuck_after_first(i, *args):
+        if i == 0:
+            return await detect_chunk(i, *args)
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+
+    monkeypatch.setattr(main, "_detect_chunk", stuck_after_first)
+
+    async def stream():
+        request = api.CodeRequest(code=LOOP + "\n" + NAME, static_analysis="off")
+        response = await api.api_detect_bugs_stream(request, _DisconnectingRequest(), None)
+        return [json.loads(line) async for line in response.body_iterator]
+
+    events = asyncio.run(asyncio.wait_for(stream(), timeout=10))
+
+    assert [event["event"] for event in events] == ["start"]
+    assert sorted(cancelled) == list(range(1, len(cancelled) + 1)) and cancelled
+
+def _sample(exposition, series):
+    """The value of one series in a Prometheus text exposition, 0 if absent."""
+    for line in exposition.splitlines():
+        name, _, value = line.rpartition(" ")
+        if name == series:
+            return float(value)
+    return 0.0
+
+def test_metrics_count_the_calls_of_a_request(model, client):
+    calls = 'foamai_llm_calls_total{chain="detect",outcome="ok"}'
+    requests = 'foamai_http_request_duration_seconds_count{method="POST",path="/detect-bugs",status="200"}'
+    before = client.get("/metrics").text
+
+    assert client.post("/detect-bugs", json={"code": LOOP, "static_analysis": "off"}).status_code == 200
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    assert "# HELP foamai_llm_calls_total " in response.text
+    assert "# TYPE foamai_llm_calls_total counter" in response.text
+    assert "# TYPE foamai_http_request_duration_seconds histogram" in response.text
+    assert _sample(response.text, calls) == _sample(before, calls) + 1
+    assert _sample(response.text, requests) == _sample(before, requests) + 1
+
+@pytest.mark.parametrize("body, headers", [
+    ({"timeout": 0}, {}),
+    ({"timeout": -1}, {}),
+    ({"max_concurrency": 0}, {}),
+    ({}, {"X-Request-Timeout": "soon"}),
+    ({}, {"X-Request-Timeout": "-5"}),
+    ({}, {"X-Request-Timeout": "inf"}),
+])
+def test_invalid_timeouts_and_limits_are_rejected(model, client, body, headers):
+    for path in ("/detect-bugs", "/detect-bugs/stream"):
+        response = client.post(path, json={"code": NAME, **body}, headers=headers)
+        assert response.status_code == 422, path
+    assert model.stats["calls"] == 0
+
+def test_batch_rejects_a_zero_concurrency_limit(model, client):
+    batch = {"items": [{"code": NAME}], "max_concurrency": 0}
+    assert client.post("/detect-bugs/batch", json=batch).status_code == 422
+    assert model.stats["calls"] == 0
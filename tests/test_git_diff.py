@@ -0,0 +1,198 @@
+"""Hunk-to-line mapping of git_diff.parse_unified_diff, and what a change costs in LLM calls."""
+import asyncio
+import io
+import subprocess
+import threading
+import time
+
+from pydantic import PrivateAttr
+
+import main
+from backends import FakeChatModel
+from git_diff import analyze_changes, parse_unified_diff, repository_root, working_tree_reader
+
+def diff(*lines):
+    return "\n".join(lines) + "\n"
+
+def test_added_lines_are_numbered_in_the_new_version():
+    changes = parse_unified_diff(diff(
+        "diff --git a/app.py b/app.py",
+        "--- a/app.py",
+        "+++ b/app.py",
+        "@@ -10,3 +10,5 @@ def main():",
+        " context",
+        "+added one",
+        "+added two",
+        " context",
+        " context",
+    ))
+    assert changes == {"app.py": {11, 12}}
+
+def test_pure_removal_marks_the_lines_around_it():
+    # Lines 5 and 6 of the old file removed; old line 7 is now line 5
+    changes = parse_unified_diff(diff(
+        "--- a/app.py",
+        "+++ b/app.py",
+        "@@ -5,2 +4,0 @@",
+        "-gone",
+        "-gone too",
+    ))
+    assert changes == {"app.py": {4, 5}}
+
+def test_removal_at_the_top_of_the_file_ignores_line_zero():
+    changes = parse_unified_diff(diff(
+        "--- a/app.py",
+        "+++ b/app.py",
+        "@@ -1 +0,0 @@",
+        "-import os",
+    ))
+    assert changes == {"app.py": {1}}
+
+def test_replaced_lines():
+    changes = parse_unified_diff(diff(
+        "--- a/app.py",
+        "+++ b/app.py",
+        "@@ -3,2 +3,2 @@",
+        "-old three",
+        "-old four",
+        "+new three",
+        "+new four",
+    ))
+    # The removal also marks the line before it
+    assert changes == {"app.py": {2, 3, 4}}
+
+def test_hunk_counts_default_to_one():
+    changes = parse_unified_diff(diff(
+        "--- a/app.py",
+        "+++ b/app.py",
+        "@@ -7 +7 @@",
+        "-x = 1",
+        "+x = 2",
+    ))
+    assert changes == {"app.py": {6, 7}}
+
+def test_no_newline_marker_is_not_a_line():
+    changes = parse_unified_diff(diff(
+        "--- a/app.py",
+        "+++ b/app.py",
+        "@@ -2,2 +2,2 @@",
+        " keep",
+        "-last",
+        "\\ No newline at end of file",
+        "+last",
+        "\\ No newline at end of file",
+        "--- a/other.py",
+        "+++ b/other.py",
+        "@@ -1,0 +2 @@",
+        "+added",
+    ))
+    assert changes == {"app.py": {2, 3}, "other.py": {2}}
+
+def test_hunk_lines_that_look_like_headers():
+    # A removed "-- note" and an added "++ x" line read like file headers
+    changes = parse_unified_diff(diff(
+        "--- a/app.py",
+        "+++ b/app.py",
+        "@@ -4,2 +4,2 @@",
+        "--- note",
+        "+++ x",
+        " context",
+    ))
+    assert changes == {"app.py": {3, 4}}
+
+def test_new_and_deleted_files():
+    changes = parse_unified_diff(diff(
+        "diff --git a/new.py b/new.py",
+        "new file mode 100644",
+        "--- /dev/null",
+        "+++ b/new.py",
+        "@@ -0,0 +1,2 @@",
+        "+a = 1",
+        "+b = 2",
+        "diff --git a/old.py b/old.py",
+        "deleted file mode 100644",
+        "--- a/old.py",
+        "+++ /dev/null",
+        "@@ -1,2 +0,0 @@",
+        "-a = 1",
+        "-b = 2",
+    ))
+    assert changes == {"new.py": {1, 2}}
+
+def test_paths_without_prefix_and_with_timestamps():
+    changes = parse_unified_diff(diff(
+        "--- app.py\t2024-01-01 00:00:00",
+        "+++ app.py\t2024-01-02 00:00:00",
+        "@@ -1,1 +1,2 @@",
+        " a = 1",
+        "+b = 2",
+    ))
+    assert changes == {"app.py": {2}}
+
+class PromptRecorder(FakeChatModel):
+    """FakeChatModel that keeps every prompt it is sent."""
+
+    _prompts: list = PrivateAttr(default_factory=list)
+
+    def _call(self, messages):
+        self._prompts.append("\n".join(str(message.content) for message in messages))
+        return super()._call(messages)
+
+def test_a_method_change_analyzes_only_that_method(monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    model = use_llm(PromptRecorder(latency=0, tokens_per_second=1e9), backend="fake")
+    methods = "".join(
+        f"\n    def method_{i}(self, value):\n        total = value + {i}\n        return total * self.scale\n"
+        for i in range(40)
+    )
+    code = f"import math\n\n\nclass Big:\n    scale = 2\n{methods}"
+    line = code.split("\n").index("    def method_20(self, value):") + 2
+
+    result = asyncio.run(main.detect_bugs_changed(code, {line}, static_analysis="off"))
+
+    assert result["units"] == {"total": 42, "analyzed": 1}
+    assert model.stats["calls"] == 1
+    # The method is sent with its class line, not the whole class
+    assert "class Big:\n    def method_20(self, value):" in model._prompts[0]
+    assert "method_19" not in model._prompts[0] and "method_21" not in model._prompts[0]
+
+def test_repository_root_from_a_subdirectory(tmp_path):
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "m.py").write_text("x = 1\n")
+    root = repository_root(str(tmp_path / "pkg"))
+    assert working_tree_reader(root)("pkg/m.py") == "x = 1\n"
+    # Outside a repository the path is used as it is
+    outside = tmp_path.parent / "not_a_repo"
+    outside.mkdir(exist_ok=True)
+    assert repository_root(str(outside)) == str(outside)
+
+def test_files_are_read_off_the_event_loop_a_few_at_a_time(monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    use_llm(FakeChatModel(latency=0, tokens_per_second=1e9), backend="fake")
+    lock = threading.Lock()
+    reading = []
+    most = [0]
+    threads = set()
+
+    def read_file(path):
+        # Blocks like git show does
+        with lock:
+            reading.append(path)
+            most[0] = max(most[0], len(reading))
+            threads.add(threading.current_thread())
+        time.sleep(0.02)
+        with lock:
+            reading.remove(path)
+        return "def f(x):\n    return x + 1\n"
+
+    changes = {f"m{i}.py": {2} for i in range(6)}
+    output = io.StringIO()
+    counts = asyncio.run(analyze_changes(changes, read_file, output, workers=2, static_analysis="off"))
+
+    assert counts == {"files": 6, "failed": 0, "units": 6}
+    assert len(output.getvalue().splitlines()) == 6
+    assert most[0] == 2
+    assert threading.main_thread() not in threads
@@ -0,0 +1,89 @@
+"""Which units detect_bugs_incremental re-sends after an edit, and how reused results follow them."""
+import asyncio
+
+import pytest
+from pydantic import PrivateAttr
+
+import main
+from backends import FakeChatModel
+from incremental import DocumentStore, split_units
+
+class PromptRecorder(FakeChatModel):
+    """FakeChatModel that keeps every prompt it is sent."""
+
+    _prompts: list = PrivateAttr(default_factory=list)
+
+    def _call(self, messages):
+        self._prompts.append("\n".join(str(message.content) for message in messages))
+        return super()._call(messages)
+
+FIRST = '''import os
+
+
+def first(value):
+    return value + 1
+'''
+
+REST = '''
+
+def wait(limit):
+    i = 0
+    while i < limit:
+        print("waiting")
+    return i
+
+
+def last(items):
+    return len(items)
+'''
+
+@pytest.fixture
+def model(monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    return use_llm(PromptRecorder(latency=0, tokens_per_second=1e9), backend="fake")
+
+def analyze(code, store, document_id="doc", **options):
+    return asyncio.run(main.detect_bugs_incremental(code, document_id, store=store, static_analysis="off",
+                                                    **options))
+
+def test_units_cover_the_module():
+    units = split_units(FIRST + REST)
+    assert [unit.name for unit in units] == ["<module>", "first", "wait", "last"]
+    assert units[2].anchor_line == 8 and units[2].start_line == 6
+
+def test_only_the_edited_unit_is_sent_again(model):
+    store = DocumentStore(":memory:")
+    analyze(FIRST + REST, store)
+    sent = len(model._prompts)
+
+    edited = FIRST.replace("    return value + 1\n", "    value *= 2\n    value -= 3\n    return value + 1\n")
+    result = analyze(edited + REST, store)
+
+    assert result["units"] == {"total": 4, "analyzed": 1, "reused": 3}
+    prompt, = model._prompts[sent:]
+    assert "value *= 2" in prompt and "def wait" not in prompt
+
+def test_reused_bugs_and_fixes_follow_the_unit(model):
+    store = DocumentStore(":memory:")
+    first = analyze(FIRST + REST, store)
+    assert [bug["location"] for bug in first["bugs"]] == ["line 10", "line 12"]
+
+    edited = FIRST.replace("    return value + 1\n", "    value *= 2\n    value -= 3\n    return value + 1\n")
+    reused = analyze(edited + REST, store)
+    # The same as analyzing the edited code from scratch
+    fresh = analyze(edited + REST, DocumentStore(":memory:"), "other")
+
+    assert [bug["location"] for bug in reused["bugs"]] == ["line 12", "line 14"]
+    assert "infinite loop on line 12" in reused["bugs"][1]["description"]
+    for key in ("bugs", "fixes"):
+        assert reused[key] == fresh[key]
+    assert {fix["bug_id"] for fix in reused["fixes"]} == {bug["id"] for bug in reused["bugs"]}
+
+def test_changed_options_invalidate_the_record(model):
+    store = DocumentStore(":memory:")
+    analyze(FIRST + REST, store)
+    assert analyze(FIRST + REST, store)["units"]["reused"] == 4
+
+    assert analyze(FIRST + REST, store, mode="fused")["units"] == {"total": 4, "analyzed": 4, "reused": 0}
+    assert analyze(FIRST + REST, store, mode="fused", strip_comments=True)["units"]["analyzed"] == 4
@@ -0,0 +1,130 @@
+"""Claims and leases of jobs.JobStore shared by several processes, and WorkerPool's handling of database errors."""
+import asyncio
+import multiprocessing
+import sqlite3
+import time
+
+import main
+from backends import FakeChatModel
+from jobs import JOB_DONE, JOB_QUEUED, JobStore, WorkerPool
+
+def _claim_all(path, start, results):
+    store = JobStore(path)
+    claimed = []
+    time.sleep(max(0.0, start - time.time()))
+    while True:
+        job = store.claim()
+        if job is None:
+            break
+        claimed.append(job[0])
+    results.put(claimed)
+
+def test_each_job_is_claimed_once_across_processes(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    store = JobStore(path)
+    submitted = {store.submit({"code": f"x = {i}"}) for i in range(100)}
+
+    results = multiprocessing.Queue()
+    start = time.time() + 0.5
+    processes = [multiprocessing.Process(target=_claim_all, args=(path, start, results)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    claimed = [job_id for _ in processes for job_id in results.get(timeout=30)]
+    for process in processes:
+        process.join()
+
+    assert sorted(claimed) == sorted(submitted)
+
+def test_running_jobs_are_only_taken_over_once_their_lease_lapses(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    first, second = JobStore(path, lease=0.3), JobStore(path, lease=0.3)
+    job_id = first.submit({"code": "x = 1"})
+    assert first.claim()[0] == job_id
+
+    assert second.claim() is None
+    time.sleep(0.2)
+    first.renew()
+    time.sleep(0.2)
+    assert second.claim() is None
+
+    time.sleep(0.4)
+    assert second.claim()[0] == job_id
+    # The first store lost the job; its late result does not count
+    first.finish(job_id, {"bugs": [], "fixes": []})
+    assert first.get(job_id)["status"] == "running"
+
+def test_release_requeues_only_own_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    first, second = JobStore(path), JobStore(path)
+    first.submit({"code": "x = 1"})
+    second.submit({"code": "x = 2"})
+    mine, theirs = first.claim()[0], second.claim()[0]
+
+    assert first.release() == 1
+    assert first.get(mine)["status"] == JOB_QUEUED
+    assert first.get(theirs)["status"] == "running"
+
+def test_steps_count_once_and_only_for_the_owner(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    first, second = JobStore(path, lease=0.1), JobStore(path, lease=0.1)
+    job_id = first.submit({"code": "x = 1"})
+    first.claim()
+    first._set_stage(job_id, "detect", 2, 0)
+    first._save_step(job_id, "chunk", 0, {"n": 1})
+    first._save_step(job_id, "chunk", 0, {"n": 2})
+    assert first.get(job_id)["progress"]["done"] == 1
+    assert first._load_steps(job_id, "chunk") == {0: {"n": 2}}
+
+    time.sleep(0.2)
+    assert second.claim()[0] == job_id
+    first._save_step(job_id, "chunk", 1, {"n": 3})
+    assert second._load_steps(job_id, "chunk") == {0: {"n": 2}}
+    assert second.get(job_id)["progress"]["done"] == 1
+
+class FlakyJobStore(JobStore):
+    """JobStore whose claim, finish and renew fail the first time with "database is locked"."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failed = set()
+
+    def _fail_once(self, name):
+        if name not in self.failed:
+            self.failed.add(name)
+            raise sqlite3.OperationalError("database is locked")
+
+    def claim(self):
+        self._fail_once("claim")
+        return super().claim()
+
+    def finish(self, job_id, result):
+        self._fail_once("finish")
+        super().finish(job_id, result)
+
+    def renew(self, job_ids=None):
+        self._fail_once("renew")
+        super().renew(job_ids)
+
+def test_workers_outlive_database_errors(tmp_path, monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    use_llm(FakeChatModel(latency=0.2), backend="fake")
+    store = FlakyJobStore(str(tmp_path / "jobs.sqlite"), lease=0.3)
+    pool = WorkerPool(store, workers=1, poll_interval=0.05)
+
+    async def run():
+        pool.start()
+        job_id = store.submit({"code": "def f(x):\n    return x / 0\n", "static_analysis": "off"})
+        pool.notify()
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if store.get(job_id)["status"] == JOB_DONE:
+                break
+        alive = [not task.done() for task in pool._tasks]
+        await pool.stop()
+        return job_id, alive
+
+    job_id, alive = asyncio.run(run())
+    assert store.failed == {"claim", "finish", "renew"}
+    assert store.get(job_id)["status"] == JOB_DONE
+    assert all(alive)
@@ -0,0 +1,72 @@
+"""Repair cases of json_extract: extract_json_array, ArrayScanner and validate_items."""
+import pytest
+
+from json_extract import ArrayScanner, ExtractionError, extract_json_array, validate_items
+
+BUG = {"type": "TypeError", "location": "line 3", "description": "str + int"}
+
+def test_bare_json_needs_no_repair():
+    assert extract_json_array('[{"type": "TypeError", "location": "line 3", "description": "str + int"}]') \
+        == ([BUG], False)
+    assert extract_json_array("[]") == ([], False)
+
+@pytest.mark.parametrize("answer", [
+    # Code fence
+    '```json\n[{"type": "TypeError", "location": "line 3", "description": "str + int"}]\n```',
+    # Prose around the array, with brackets in the prose after it
+    'Here are the bugs:\n[{"type": "TypeError", "location": "line 3", "description": "str + int"}]\n'
+    'Let me know [if] you need more.',
+    # Trailing commas
+    '[{"type": "TypeError", "location": "line 3", "description": "str + int",},]',
+    # Python literal
+    "[{'type': 'TypeError', 'location': 'line 3', 'description': 'str + int'}]",
+    # Smart quotes
+    '[{“type”: “TypeError”, “location”: “line 3”, “description”: “str + int”}]',
+    # Wrapper object
+    '{"bugs": [{"type": "TypeError", "location": "line 3", "description": "str + int"}]}',
+])
+def test_repairs(answer):
+    items, _ = extract_json_array(answer)
+    assert items == [BUG]
+
+def test_single_object_in_prose():
+    items, repaired = extract_json_array('The bug: {"type": "TypeError", "location": "line 3", '
+                                         '"description": "str + int"} -- that is all.')
+    assert items == [BUG]
+    assert repaired
+
+def test_truncated_array_keeps_complete_items():
+    answer = ('[{"type": "TypeError", "location": "line 3", "description": "str + int"}, '
+              '{"type": "NameError", "location": "line 5", "descr')
+    assert extract_json_array(answer) == ([BUG], True)
+
+def test_brackets_inside_strings_do_not_end_the_array():
+    answer = 'Bugs: [{"type": "IndexError", "location": "line 2", "description": "items[0] on [] \\"]\\""}] done'
+    items, _ = extract_json_array(answer)
+    assert items[0]["description"] == 'items[0] on [] "]"'
+
+@pytest.mark.parametrize("answer", ["", "No bugs found.", "[{\"type\": ", "{not json}"])
+def test_nothing_recoverable(answer):
+    with pytest.raises(ExtractionError):
+        extract_json_array(answer)
+
+def test_scanner_finds_the_end_of_a_streamed_array():
+    scanner = ArrayScanner()
+    pieces = ["Sure:\n[", '{"type": "TypeError", "location": "line 3",', ' "description": "a ] b"}', "]", "\nThanks"]
+    done = [scanner.feed(piece) for piece in pieces]
+    assert done == [False, False, False, True, True]
+    assert scanner.text[:scanner.end].endswith("}]")
+    assert scanner.array == [{"type": "TypeError", "location": "line 3", "description": "a ] b"}]
+
+def test_validate_items_drops_items_without_required_keys():
+    items = [BUG, {"type": "NameError", "location": "line 1"}, "not an object",
+             {"type": "ValueError", "location": 4, "description": "bad", "extra": 1}]
+    valid, rejected = validate_items(items, "detect")
+    assert valid == [BUG, {"type": "ValueError", "location": "4", "description": "bad"}]
+    assert rejected == 2
+
+def test_validate_items_keeps_optional_keys():
+    valid, rejected = validate_items([{"bug": "b", "suggestion": "s", "bug_id": None},
+                                      {"bug": "b", "suggestion": "s", "bug_id": "B1.1"}], "fix")
+    assert valid == [{"bug": "b", "suggestion": "s"}, {"bug": "b", "suggestion": "s", "bug_id": "B1.1"}]
+    assert rejected == 0
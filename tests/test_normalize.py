@@ -0,0 +1,29 @@
+import textwrap
+
+from normalize import normalize_code
+from static_analysis import analyze_code
+
+CODE = textwrap.dedent('''
+    class NotFound(Exception): """Raised when a key is missing."""
+
+    def lookup(table, key):  """Return table[key].
+    Raises NotFound."""
+
+    def find(table, key):
+        """Find key."""  # in table
+        if key not in table:
+            raise NotFound(key)
+        return table[key]
+''')
+
+def test_docstring_on_the_header_line_keeps_the_header():
+    normalized = normalize_code(CODE, strip_comments=True)
+    assert normalized.text.split("\n")[:3] == [
+        "class NotFound(Exception): ...",
+        "def lookup(table, key): ...",
+        "def find(table, key):",
+    ]
+    assert normalized.line_map[:4] == [2, 4, 7, 9]
+
+def test_stripped_code_still_defines_its_names():
+    assert analyze_code(normalize_code(CODE, strip_comments=True).text).findings == []
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from ratelimit import AdaptiveConcurrency, RateLimiter
+
+class Throttled(Exception):
+    status_code = 429
+
+def test_failed_calls_return_their_tokens():
+    limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=10000, path=":memory:", retries=2,
+                          backoff_base=0.001, expected_completion_tokens=500)
+    attempts = []
+
+    async def invoke():
+        attempts.append(1)
+        raise Throttled()
+
+    with pytest.raises(Throttled):
+        asyncio.run(limiter.call(invoke, 1500, "detect"))
+    assert len(attempts) == 3
+    levels = limiter.buckets._update(lambda levels: (None, levels))
+    # Every attempt's 2000 tokens are back; the three requests stay spent
+    assert levels["tokens"] == pytest.approx(10000, abs=1)
+    assert levels["requests"] == pytest.approx(97, abs=0.1)
+
+def test_congestion_halves_the_limit_once_per_epoch():
+    concurrency = AdaptiveConcurrency(16)
+    epoch = concurrency.epoch
+    concurrency.on_congestion(epoch)
+    # Later failures of calls started under the old limit do not lower it again
+    concurrency.on_congestion(epoch)
+    assert concurrency.limit == 8
+    concurrency.on_congestion(concurrency.epoch)
+    assert concurrency.limit == 4
+
+def test_success_grows_the_limit_by_about_one_per_window():
+    concurrency = AdaptiveConcurrency(4, maximum=6)
+    for _ in range(4):
+        concurrency.on_success()
+    assert 4.9 < concurrency.limit < 5
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.limit == 6
+
+def test_waiters_are_woken_in_order():
+    async def run():
+        concurrency = AdaptiveConcurrency(1)
+        order = []
+        await concurrency.acquire()
+
+        async def call(name):
+            await concurrency.acquire()
+            order.append(name)
+            await asyncio.sleep(0)
+            concurrency.release()
+
+        tasks = [asyncio.ensure_future(call(name)) for name in "abc"]
+        await asyncio.sleep(0)
+        concurrency.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["a", "b", "c"]
+
+def test_no_waiter_is_woken_while_over_a_lowered_limit():
+    async def run():
+        concurrency = AdaptiveConcurrency(4)
+        for _ in range(4):
+            await concurrency.acquire()
+        waiters = [asyncio.ensure_future(concurrency.acquire()) for _ in range(3)]
+        await asyncio.sleep(0)
+        concurrency.on_congestion(concurrency.epoch)
+        concurrency.release()
+        await asyncio.sleep(0)
+        # 3 in flight, limit 2: everybody keeps waiting
+        assert not any(waiter.done() for waiter in waiters)
+        concurrency.release()
+        concurrency.release()
+        await asyncio.sleep(0)
+        assert [waiter.done() for waiter in waiters] == [True, False, False]
+        for waiter in waiters:
+            waiter.cancel()
+
+    asyncio.run(run())
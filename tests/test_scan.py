@@ -0,0 +1,79 @@
+"""File selection of the directory scan, its JSONL output, and resuming an interrupted scan."""
+import asyncio
+import io
+import json
+
+import pytest
+
+import main
+from backends import FakeChatModel
+from scan import find_files, load_completed, scan_directory
+
+FILES = {
+    "app.py": "def main():\n    return run()\n",
+    "pkg/util.py": "def helper(x):\n    return x * 2\n",
+    "pkg/empty.py": "",
+    "pkg/tests/test_util.py": "def test_helper():\n    assert True\n",
+    "build/generated.py": "x = 1\n",
+    ".venv/lib/site.py": "y = 2\n",
+    "pkg/foamai.egg-info/setup.py": "z = 3\n",
+    "README.md": "# readme\n",
+}
+
+@pytest.fixture
+def tree(tmp_path):
+    for path, text in FILES.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(text)
+    return tmp_path
+
+@pytest.fixture
+def model(monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    return use_llm(FakeChatModel(latency=0, tokens_per_second=1e9), backend="fake")
+
+def test_default_rules_skip_tool_directories(tree):
+    assert find_files(str(tree)) == [
+        "app.py", "build/generated.py", "pkg/empty.py", "pkg/tests/test_util.py", "pkg/util.py"]
+
+def test_exclude_matches_directories_and_paths(tree):
+    assert find_files(str(tree), exclude=["tests", "build/*"]) == ["app.py", "pkg/empty.py", "pkg/util.py"]
+    assert find_files(str(tree), include=["pkg/*.py"], exclude=["empty.py"]) == [
+        "pkg/tests/test_util.py", "pkg/util.py"]
+    assert find_files(str(tree), include=["*.md"]) == ["README.md"]
+
+def scan(tree, **options):
+    output = io.StringIO()
+    counts = asyncio.run(scan_directory(str(tree), output, static_analysis="prefilter", **options))
+    return counts, [json.loads(line) for line in output.getvalue().splitlines()]
+
+def test_one_record_per_file(tree, model):
+    counts, records = scan(tree, exclude=["build"])
+    assert counts == {"files": 4, "skipped": 0, "analyzed": 4, "failed": 0}
+    assert sorted(record["path"] for record in records) == [
+        "app.py", "pkg/empty.py", "pkg/tests/test_util.py", "pkg/util.py"]
+    app, = [record for record in records if record["path"] == "app.py"]
+    assert [bug["type"] for bug in app["bugs"]] == ["Uninitialized variable"]
+
+def test_resume_skips_completed_files_after_a_truncated_line(tree, model, tmp_path):
+    _, records = scan(tree, exclude=["build", "tests"])
+    by_path = {record["path"]: record for record in records}
+    output = tmp_path / "scan.jsonl"
+    # The scan was interrupted while writing pkg/util.py; pkg/empty.py had failed
+    output.write_text(json.dumps(by_path["app.py"]) + "\n"
+                      + json.dumps({"path": "pkg/empty.py", "error": "Error detecting bugs: boom"}) + "\n"
+                      + json.dumps(by_path["pkg/util.py"])[:40])
+
+    completed = load_completed(str(output))
+    assert completed == {"app.py": by_path["app.py"]["sha256"]}
+
+    (tree / "app.py").write_text(FILES["app.py"] + "\n")
+    counts, records = scan(tree, exclude=["build", "tests"], completed=completed)
+    # app.py changed since, so it is analyzed again too
+    assert counts == {"files": 3, "skipped": 0, "analyzed": 3, "failed": 0}
+
+    (tree / "app.py").write_text(FILES["app.py"])
+    counts, records = scan(tree, exclude=["build", "tests"], completed=completed)
+    assert counts == {"files": 3, "skipped": 1, "analyzed": 2, "failed": 0}
+    assert sorted(record["path"] for record in records) == ["pkg/empty.py", "pkg/util.py"]
@@ -0,0 +1,31 @@
+from similarity import code_tokens, remap_answer
+
+SOURCE = '''def scale(a, values):
+    total = 0
+    for value in values:
+        total += a * value
+    print("scaled: " + total)
+    return total
+'''
+TARGET = SOURCE.replace("a,", "factor,").replace("a *", "factor *")
+
+def remap(item):
+    return remap_answer([item], code_tokens(SOURCE), code_tokens(TARGET))[0]
+
+def test_one_letter_name_is_renamed_in_code_only():
+    item = remap({
+        "type": "Type error",
+        "location": "line 5, in scale(a, values)",
+        "description": "Adding a string and an int raises a TypeError in a print call; `a * value` is fine.",
+        "fix": "Convert with str(): 'print(\"scaled: \" + str(total))', or pass a as an int."
+    })
+    assert item["location"] == "line 5, in scale(factor, values)"
+    assert item["description"] == ("Adding a string and an int raises a TypeError in a print call; "
+                                   "`factor * value` is fine.")
+    assert item["fix"] == "Convert with str(): 'print(\"scaled: \" + str(total))', or pass a as an int."
+
+def test_lines_follow_the_target():
+    target = TARGET.replace("    total = 0\n", "    total = 0\n\n")
+    items = remap_answer([{"type": "Type error", "location": "line 5", "description": "d"}],
+                         code_tokens(SOURCE), code_tokens(target))
+    assert items[0]["location"] == "line 6"
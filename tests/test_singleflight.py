@@ -0,0 +1,76 @@
+import asyncio
+
+import main
+from backends import FakeChatModel
+from cache import ResultCache
+from singleflight import SingleFlight
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        flights = SingleFlight("call")
+        results = await asyncio.gather(*(flights.do("key", work) for _ in range(5)), flights.do("other", work))
+        assert flights.in_flight == 0
+        # Nothing is kept once the call finished
+        return results + [await flights.do("key", work)]
+
+    assert asyncio.run(run()) == ["result"] * 7
+    assert len(calls) == 3
+
+def test_work_is_cancelled_only_when_the_last_caller_leaves():
+    started = []
+    cancelled = []
+
+    async def work():
+        started.append(1)
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "result"
+
+    async def run():
+        flights = SingleFlight("call")
+        first = asyncio.ensure_future(flights.do("key", work))
+        second = asyncio.ensure_future(flights.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert not cancelled and flights.in_flight == 1
+        second.cancel()
+        await asyncio.sleep(0)
+        # A caller joining before the cancelled task finished gets a call of its own
+        assert flights.in_flight == 0
+        late = asyncio.ensure_future(flights.do("key", lambda: asyncio.sleep(0, "late")))
+        return await late
+
+    assert asyncio.run(run()) == "late"
+    assert len(started) == 1 and len(cancelled) == 1
+
+def test_calls_that_cache_do_not_join_calls_that_do_not(monkeypatch, use_llm):
+    monkeypatch.setitem(vars(main), "result_cache", ResultCache())
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    monkeypatch.setitem(vars(main), "_batcher", None)
+    model = use_llm(FakeChatModel(latency=0.05, tokens_per_second=1e9), backend="fake")
+    code = "def greet(name):\n    return 'Hello ' + nam\n"
+
+    async def run():
+        return await asyncio.gather(*(
+            main.detect_bugs_async(code, use_cache=use_cache, static_analysis="off")
+            for use_cache in (False, True, False)
+        ))
+
+    first, second, third = asyncio.run(run())
+    assert first == second == third
+    # A detect and a fix call shared by the uncached analyses, and one of each for the cached one
+    assert model.stats["calls"] == 4
+    # The cached analysis stored its answers: nothing is called again
+    asyncio.run(main.detect_bugs_async(code, static_analysis="off"))
+    assert model.stats["calls"] == 4
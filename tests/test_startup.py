@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_main_creates_no_files(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    code = "import main, sys; assert 'langchain_core' not in sys.modules; main.cache_stats"
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True)
+    assert os.listdir(tmp_path) == []
+
+def test_the_result_cache_is_created_on_first_use(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT, FOAMAI_CACHE_PATH=str(tmp_path / "cache.sqlite"))
+    code = "import main; assert main.result_cache is main._get_result_cache(); print(main.cache_stats()['writes'])"
+    output = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == "0"
+    assert os.listdir(tmp_path) == ["cache.sqlite"]
@@ -0,0 +1,129 @@
+import textwrap
+
+from main import _merge_findings
+from static_analysis import analyze_code
+
+def findings(code):
+    return [(finding.line, finding.type) for finding in analyze_code(textwrap.dedent(code)).findings]
+
+def test_loop_without_update_is_infinite():
+    assert findings("""
+        def count():
+            i = 0
+            while i < 10:
+                print("counting")
+            return i
+    """) == [(4, "Infinite loop"), (6, "Unreachable code")]
+
+def test_loop_on_a_name_changed_through_nonlocal():
+    assert findings("""
+        def count():
+            n = 0
+            def inc():
+                nonlocal n
+                n += 1
+            while n < 5:
+                inc()
+            return n
+    """) == []
+
+def test_loop_on_a_list_a_callback_appends_to():
+    assert findings("""
+        def wait(client):
+            results = []
+            def on_result(result):
+                results.append(result)
+            client.subscribe(on_result)
+            while not results:
+                client.poll()
+            return results[0]
+    """) == []
+
+def test_loop_on_a_list_a_lambda_appends_to():
+    assert findings("""
+        def wait(client):
+            results = []
+            client.subscribe(lambda result: results.append(result))
+            while not results:
+                client.poll()
+            return results[0]
+    """) == []
+
+def test_closure_two_levels_down():
+    assert findings("""
+        def count():
+            n = 0
+            class Counter:
+                def inc(self):
+                    nonlocal n
+                    n += 1
+            counter = Counter()
+            while n < 5:
+                counter.inc()
+            return n
+    """) == []
+
+def test_name_shadowed_in_the_closure_is_still_fixed():
+    assert findings("""
+        def count():
+            n = 0
+            def reset():
+                n = 10
+                return n
+            while n < 5:
+                reset()
+            return n
+    """) == [(7, "Infinite loop"), (9, "Unreachable code")]
+
+def test_llm_bugs_on_overlapping_lines_merge_with_static_findings():
+    static = [({"type": "Infinite loop", "location": "line 9", "description": "static"}, None)]
+    llm = [
+        ({"type": "infinite loop", "location": "lines 8-9", "description": "same"}, None),
+        ({"type": "Infinite loop", "location": "line 12", "description": "other lines"}, None),
+        ({"type": "Logic error", "location": "line 9", "description": "other type"}, None),
+    ]
+    merged = _merge_findings(static, llm)
+    assert [bug["description"] for bug, _ in merged] == ["static", "other lines", "other type"]
+
+def test_broad_llm_bugs_only_merge_when_they_name_the_finding():
+    static = [
+        ({"type": "Uninitialized variable", "location": "line 9",
+          "description": "'total' is read before it is assigned, so this raises UnboundLocalError."}, None),
+        ({"type": "Uninitialized variable", "location": "line 20",
+          "description": "'count' is used but never defined or assigned, so this raises NameError."}, None),
+    ]
+    llm = [
+        ({"type": "Uninitialized variable", "location": "lines 3-40",
+          "description": "'result' may be unset when the loop is empty"}, None),
+        ({"type": "Uninitialized variable", "location": "lines 3-40",
+          "description": "total is used before it is set"}, None),
+    ]
+    merged = _merge_findings(static, llm)
+    assert [bug["description"] for bug, _ in merged[2:]] == ["'result' may be unset when the loop is empty"]
+
+def test_loop_on_a_list_changed_through_a_bound_method():
+    assert findings("""
+        def walk(root):
+            stack = [root]
+            pop = stack.pop
+            push, seen = stack.append, []
+            while stack:
+                node = pop()
+                seen.append(node)
+            while len(seen) > 10:
+                push(seen.pop())
+            return seen
+    """) == []
+
+def test_alias_of_another_name_does_not_change_the_condition():
+    assert findings("""
+        def drain(items, other):
+            pop = other.pop
+            while items:
+                pop()
+            return items
+    """) == [(4, "Infinite loop"), (6, "Unreachable code")]
+
+def test_module_level_read_before_assignment_raises_name_error():
+    finding, = analyze_code("print(total)\ntotal = 0\n").findings
+    assert finding.type == "Uninitialized variable" and "NameError" in finding.description
@@ -0,0 +1,47 @@
+"""
+Token usage of streamed answers, checked against the stub OpenAI API.
+
+The openai backend reports usage in a metadata-only chunk after the
+answer, so it is only counted if the stream is not closed too early.
+"""
+import asyncio
+
+import httpx
+import pytest
+from langchain_openai import ChatOpenAI
+
+import main
+import metrics
+from stub_openai import create_app
+
+CODE = "def greet(name):\n    return 'Hello ' + len(name)\n"
+
+@pytest.fixture
+def stub_model(monkeypatch, use_llm):
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.setitem(vars(main), "result_cache", None)
+    monkeypatch.setitem(vars(main), "similarity_index", None)
+    app = create_app(latency=0)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stub/v1")
+    model = ChatOpenAI(model_name=main.MODEL_NAME, temperature=0, stream_usage=True, max_retries=0,
+                       base_url="http://stub/v1", http_async_client=client)
+    use_llm(model, backend="openai")
+    return client
+
+def tokens(chain, direction):
+    return metrics.LLM_TOKENS.value(chain=chain, direction=direction)
+
+def test_usage_after_the_array_is_counted(stub_model):
+    before = {(chain, direction): tokens(chain, direction)
+              for chain in ("detect", "fix") for direction in ("prompt", "completion")}
+
+    result = asyncio.run(main.detect_bugs_async(CODE, static_analysis="off"))
+
+    assert result["bugs"]
+    stats = asyncio.run(stub_model.get("http://stub/stats")).json()
+    assert stats["requests"] == 2
+    # Exactly the usage the stub answered with, not an estimate
+    counted = {key: tokens(*key) - value for key, value in before.items()}
+    assert counted[("detect", "prompt")] + counted[("fix", "prompt")] == stats["prompt_tokens"]
+    assert counted[("detect", "completion")] + counted[("fix", "completion")] == stats["completion_tokens"]
+    assert counted[("detect", "completion")] > 0 and counted[("fix", "completion")] > 0